@@ -1,90 +1,151 @@
+import time
+# 起動タイムラインの基準 (import より前に記録する)
+_MODULE_START_NS = time.perf_counter_ns()
+
 import pygame
 import sys
-import time
+import argparse
 import datetime
-import csv 
-import math
 import os 
-import matplotlib.pyplot as plt 
-import matplotlib.image as mpimg
 import numpy as np 
-from typing import Dict, Any, Final
+from typing import Dict, Any
+
+import startup_timeline
+import analyze_engine
+import raw_format
+import raw_writer
+import loop_stats
+import scheduler
+import rasterizer
+import live_view
+import input_sources
+import course_geometry
+import course_validator
+import map_matching
+import kinematics
+import laps
+import run_store
+import run_metrics
+import telemetry
+# matplotlib は --plot-engine matplotlib の描画でしか使わないため、その時に読み込む (起動が 0.5 秒以上速くなる)
+_IMPORTS_DONE_NS = time.perf_counter_ns()
 
 # =============================================================================
 # 0. 定数定義クラス
 # =============================================================================
 
-class CourseConstants:
-    """画像のピクセルを基準にすべてのスケールを定義する"""
-    
-    # --- 1. ハードウェア設定 ---
-    DPI_SETTING: Final[int] = 800              
-    POLLING_RATE: Final[int] = 1000
-    
-    # 1ミッキーが何センチか (0.003175 cm)
-    MICKEY_TO_CM: Final[float] = 1/DPI_SETTING * 2.54      
-    
-    # --- 2. 画像と現実の対応 ---
-    # 画像1000px = 現実1000cm なので 1.0
-    CM_PER_PIXEL: Final[float] = 1.0 
-    
-    # ミッキー -> ピクセル変換係数
-    MICKEY_TO_PIXEL: Final[float] = MICKEY_TO_CM / CM_PER_PIXEL
-
-    # --- 3. スタート地点 (画像上のピクセル座標) ---
-    START_PX_X: Final[int] = 500  # 中心
-    START_PX_Y: Final[int] = 273  # 中心
+# 定数は course_constants.py で定義する (FootPrint.CourseConstants としても参照できる)
+from course_constants import CourseConstants
 
 
 # =============================================================================
 # 1. 初期化 (Setup) - ★画像自動選択ロジック追加★
 # =============================================================================
 
+def _parse_options(args: list) -> argparse.Namespace:
+    """マウス名に続くオプション引数を解釈する"""
+    parser = argparse.ArgumentParser(prog=os.path.basename(args[0]))
+    parser.add_argument('mouse_name')
+    parser.add_argument('--raw-format', choices=['csv', 'binary'], default='csv',
+                        help="生データの保存形式 (csv: raw_data.log / binary: raw_data.bin)")
+    parser.add_argument('--scheduler', choices=list(scheduler.SCHEDULERS), default='tick',
+                        help="ループの周期制御 (tick: Clock.tick / hybrid: sleep+スピン / free: 待たずにイベント合算)")
+    parser.add_argument('--plot-engine', choices=['raster', 'matplotlib'], default='raster',
+                        help="軌跡図の描画方法 (raster: NumPy で直接描画 / matplotlib: 従来の描画)")
+    parser.add_argument('--input', choices=list(input_sources.INPUT_SOURCES), default='pygame',
+                        help="移動量の取得元 (pygame: 従来どおり / evdev: Linux の入力デバイスを個別に読む / synthetic: 合成データ)")
+    parser.add_argument('--device', action='append', dest='devices', metavar='PATH',
+                        help="--input evdev で読むデバイス (複数指定可。省略時は REL_X/REL_Y を持つ全デバイス)")
+    parser.add_argument('--sensors', type=int, default=input_sources.SYNTHETIC_SENSORS,
+                        help="--input synthetic の仮想センサー数")
+    parser.add_argument('--map-match', action='store_true',
+                        help="解析時に軌跡をコースデータの中心線に当てはめてドリフトを補正する (matched_path.csv / trajectory_matched.png)")
+    parser.add_argument('--kinematics-dt', type=float, default=kinematics.DT_S, metavar='SECONDS',
+                        help="速度・加速度・ヨーレートを再標本化する間隔 [s] (kinematics.bin。0 で無効)")
+    parser.add_argument('--lap-gate-radius', type=float, default=laps.GATE_RADIUS_CM, metavar='CM',
+                        help="スタート地点を中心とする周回ゲートの半径 [cm] (計測中に SPACE で記録した場合はそちらを優先)")
+    parser.add_argument('--acquire-only', action='store_true',
+                        help="計測 (生データの記録) だけを行い、解析と描画は後で reanalyze.py に任せる")
+    parser.add_argument('--profile', action='store_true',
+                        help="工程ごとの cProfile の結果を profile_<工程>.prof に保存する (計測中のループも遅くなる)")
+    parser.add_argument('--telemetry', metavar='ADDRESS',
+                        help="計測中のサンプルを配信する (udp://127.0.0.1:9870 / unix:///tmp/footprint.sock)")
+    parser.add_argument('--telemetry-batch-ms', type=float, default=telemetry.DEFAULT_BATCH_MS, metavar='MS',
+                        help="配信でサンプルをまとめる最大の待ち時間 [ms]")
+    parser.add_argument('--backpressure', choices=list(raw_writer.BACKPRESSURE_POLICIES), default='block',
+                        help="書き込みが追いつかない時の扱い (block: 待つ / drop: バッファを破棄)")
+    return parser.parse_args(args[1:])
+
+def _save_session_settings(context: Dict[str, Any]):
+    """計測時のコース画像と解析オプションを session_settings.json に残す (--acquire-only でも再解析で再現できるように)"""
+    try:
+        run_store.save_session_settings(os.path.join(context['output_dir'], run_store.SESSION_SETTINGS_NAME),
+                                        run_store.build_session_settings(context))
+    except OSError as e:
+        print(f"⚠️ セッションの設定を保存できませんでした: {e}")
+
 def _setup_context(args: list) -> Dict[str, Any]:
     if len(args) < 2:
         raise ValueError("エラー: マウス名を引数として指定してください。\n実行例: py script.py G304_Test")
-    mouse_name = args[1]
+    options = _parse_options(args)
+    if options.telemetry:
+        # 宛先の書式の誤りは計測を始める前に知らせる
+        telemetry.parse_address(options.telemetry)
+    mouse_name = options.mouse_name
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     LOG_ROOT_DIR = os.path.join(BASE_DIR, "Log")
-    
-    # --- 画像ファイルの自動検索ロジック ---
-    # ルール: "CourseImage" で始まり、".jpg" または ".jpeg" で終わるファイル
-    image_candidates = []
-    try:
-        for f in os.listdir(BASE_DIR):
-            if f.startswith("CourseImage") and (f.lower().endswith(".jpg") or f.lower().endswith(".jpeg")):
-                image_candidates.append(os.path.join(BASE_DIR, f))
-    except FileNotFoundError:
-        pass
-
-    if image_candidates:
-        # 名前順で降順ソート（日付が入っていれば最新が先頭に来る想定）
-        image_candidates.sort(reverse=True)
-        image_path = image_candidates[0]
-    else:
-        # 見つからない場合はデフォルト名（後のチェックでエラーになる）
-        image_path = os.path.join(BASE_DIR, "CourseImage.jpg")
-
+    image_path = run_store.find_course_image(BASE_DIR)
     
     MOUSE_DIR = os.path.join(LOG_ROOT_DIR, mouse_name)
     OUTPUT_DIR = os.path.join(MOUSE_DIR, f"{mouse_name}_{timestamp}")
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    raw_log_path = os.path.join(OUTPUT_DIR, "raw_data.log")
+    raw_name = raw_format.RAW_BINARY_NAME if options.raw_format == 'binary' else raw_format.RAW_CSV_NAME
+    raw_log_path = os.path.join(OUTPUT_DIR, raw_name)
     analysis_log_path = os.path.join(OUTPUT_DIR, "analyze.log")
     plot_path = os.path.join(OUTPUT_DIR, "trajectory_plot.png")
     
     context = {
         'output_dir': OUTPUT_DIR, 'mouse_name': mouse_name, 'timestamp': timestamp, 
         'image_path': image_path, 'raw_log_path': raw_log_path, 'analysis_log_path': analysis_log_path,
-        'plot_path': plot_path, 'final_total_mickey_distance': 0.0
+        'plot_path': plot_path, 'final_total_mickey_distance': 0.0,
+        'raw_format': options.raw_format, 'backpressure': options.backpressure,
+        'scheduler': options.scheduler, 'plot_engine': options.plot_engine,
+        'input': options.input, 'devices': options.devices, 'synthetic_sensors': options.sensors,
+        'map_match': options.map_match, 'kinematics_dt': options.kinematics_dt,
+        'lap_gate_radius': options.lap_gate_radius, 'acquire_only': options.acquire_only,
+        'profile': options.profile,
+        'telemetry': options.telemetry, 'telemetry_batch_ms': options.telemetry_batch_ms,
     }
+    _save_session_settings(context)
     return context
 
+def _record_error(context: Dict[str, Any], stage: str, error: BaseException):
+    """工程の中で捕まえた例外を run_metrics.json に残す (表示は呼び出し側)"""
+    if context.get('metrics') is not None:
+        context['metrics'].record_error(stage, error)
+
+def check_course_layout(context: Dict[str, Any]):
+    """計測前の事前チェック: コースデータのパーツの重なり・フィールド外へのはみ出しを調べる (警告のみ)"""
+    data_path = course_geometry.find_course_data(context['image_path'])
+    if data_path is None:
+        return None
+    try:
+        report = course_validator.validate_file(data_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ コースデータを読み込めないため、レイアウト検証をスキップします: {e}")
+        return None
+    course_validator.print_report(report, max_items=5)
+    course_validator.save_report(os.path.join(context['output_dir'], course_validator.VALIDATION_NAME), report)
+    context['layout_ok'] = report['ok']
+    return report
+
 def _initialize_pygame(context: Dict[str, Any]) -> pygame.Surface:
-    pygame.init()
-    screen = pygame.display.set_mode((400, 300))
+    # 計測に使うのは画面と文字だけなので、オーディオ等は初期化しない (pygame.init() は環境によって遅い)
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode(live_view.WINDOW_SIZE)
     pygame.display.set_caption(f"Mickey Logger (DPI: {CourseConstants.DPI_SETTING})")
     pygame.event.set_grab(True)
     pygame.mouse.set_visible(False)
@@ -106,161 +167,495 @@ def _initialize_pygame(context: Dict[str, Any]) -> pygame.Surface:
 # 2. 生データ取得 (Acquire) - 高速化版
 # =============================================================================
 
+def _print_writer_stats(stats: Dict[str, Any]):
+    print(f"💾 書き込み: {stats['samples_written']:,} サンプル / {stats['buffers_written']} バッファ")
+    if stats['delayed_buffers']:
+        print(f"⚠️ 書き込み待ち: {stats['delayed_buffers']} バッファ (計 {stats['delayed_wait_s'] * 1000:.1f} ms 計測停止)")
+    if stats['dropped_buffers']:
+        print(f"⚠️ 破棄: {stats['dropped_buffers']} バッファ ({stats['dropped_samples']:,} サンプル)")
+
+def _save_loop_stats(context: Dict[str, Any], stats: loop_stats.LoopStats, sched):
+    """ループ計測結果を loop_stats.json に保存し、概要を表示する"""
+    summary = stats.to_dict()
+    summary['scheduler'] = sched.stats()
+    if 'writer_stats' in context:
+        summary['writer'] = context['writer_stats']
+    if 'live_view_stats' in context:
+        summary['live_view'] = context['live_view_stats']
+    if 'telemetry_stats' in context:
+        summary['telemetry'] = context['telemetry_stats']
+    if 'startup' in context:
+        summary['startup'] = context['startup'].to_dict()
+    context['loop_stats'] = summary
+    try:
+        loop_stats.save_loop_stats(os.path.join(context['output_dir'], loop_stats.LOOP_STATS_NAME), summary)
+    except OSError as e:
+        print(f"⚠️ ループ計測結果を保存できませんでした: {e}")
+    loop_stats.print_loop_summary(summary)
+
+def _stop_input_source(context: Dict[str, Any], source):
+    """デバイスの読み取りスレッドを止め、デバイスごとのストリームの件数を devices.json に保存する"""
+    try:
+        source.stop()
+    except Exception as e:
+        print(f"\n❌ 入力デバイスの停止中にエラー: {e}")
+        _record_error(context, 'acquire', e)
+    stats = source.stats()
+    context['input_stats'] = stats
+    if not stats['devices']:
+        return
+    for device in stats['devices']:
+        print(f"🖱️ {device['name']}: {device['samples']:,} サンプル -> {device['file']}")
+    for error in stats.get('errors', []):
+        print(f"⚠️ 入力デバイスの読み取りエラー: {error}")
+    try:
+        input_sources.save_devices(os.path.join(context['output_dir'], input_sources.DEVICES_NAME), stats)
+    except OSError as e:
+        print(f"⚠️ デバイス情報を保存できませんでした: {e}")
+
+def _close_telemetry(context: Dict[str, Any], publisher: telemetry.TelemetryPublisher):
+    try:
+        publisher.close()
+    except Exception as e:
+        print(f"\n❌ テレメトリの終了中にエラー: {e}")
+        _record_error(context, 'acquire', e)
+    context['telemetry_stats'] = publisher.stats()
+    telemetry.print_publisher_stats(context['telemetry_stats'])
+
 def acquire_raw_data(context: Dict[str, Any], screen: pygame.Surface):
-    raw_log_path = context['raw_log_path']
+    binary = context['raw_format'] == 'binary'
     total_x = 0
     total_y = 0
-    font = pygame.font.Font(None, 24)
-    data_buffer = []
     BUFFER_SIZE = 5000 
-    clock = pygame.time.Clock()
+    sched = scheduler.create_scheduler(context['scheduler'], CourseConstants.POLLING_RATE)
     running = True
-    start_time = time.time()
-    frame_count = 0 
+    view = None
+    source = None
+    writer = None
+    publisher = None
+    stats = None
+    buf = None
+    count = 0
+    lap_marks = []
+    timeline = context.get('startup')
+    first_poll = timeline is not None
     
     try:
-        with open(raw_log_path, 'w', newline='') as log_file:
-            log_file.write("Timestamp_s,Rel_X,Rel_Y,Total_X,Total_Y\n")
-            while running:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT: running = False
-                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE: running = False
-
-                dx, dy = pygame.mouse.get_rel()
-
-                if dx != 0 or dy != 0:
-                    total_x += dx
-                    total_y += dy
-                    elapsed = time.time() - start_time
-                    data_buffer.append(f"{elapsed:.4f},{dx},{dy},{total_x},{total_y}\n")
-
-                if len(data_buffer) >= BUFFER_SIZE:
-                    log_file.writelines(data_buffer)
-                    data_buffer.clear()
-
-                frame_count += 1
-                if frame_count % 15 == 0:
-                    screen.fill((20, 20, 30))
-                    text = font.render(f"Mickey: ({total_x}, {total_y})", True, (0, 255, 0))
-                    screen.blit(text, (10, 10))
-                    pygame.display.flip()
-                    frame_count = 0
-                
-                clock.tick(CourseConstants.POLLING_RATE)
+        # ファイル書き込みは別スレッドに任せ、ループ内では事前確保したバッファに詰めるだけにする
+        writer = raw_writer.RawLogWriter(context['raw_log_path'], binary, raw_format.default_header(), BUFFER_SIZE,
+                                         policy=context['backpressure'])
+        buf = writer.acquire_buffer()
+        # 配信はノンブロッキング送信のみで、購読者が遅い・いない時はフレームを捨てて数える
+        if context.get('telemetry'):
+            publisher = telemetry.TelemetryPublisher(context['telemetry'], context['telemetry_batch_ms'])
+        # 縮小コース画像に軌跡を差分描画する。描画は時間で間引き、描画コストに応じて間隔を広げる
+        view = live_view.LiveTrajectoryView(screen, context['image_path'],
+                                            (CourseConstants.START_PX_X, CourseConstants.START_PX_Y),
+                                            CourseConstants.MICKEY_TO_PIXEL, CourseConstants.POLLING_RATE)
+        view.draw_full()
+        if first_poll: timeline.mark("ライブビュー準備")
+        source = input_sources.create_source(context)
+        # 壁時計の補正 (NTP 等) の影響を受けない単調増加クロック
+        start_ns = time.perf_counter_ns()
+        # evdev / synthetic ではデバイスごとの読み取りスレッドがここから動き始める
+        source.start(start_ns)
+        if publisher is not None:
+            publisher.start(start_ns, raw_format.default_header())
+        stats = loop_stats.LoopStats(CourseConstants.POLLING_RATE, start_ns)
+        t_start = start_ns
+        sched.start()
+        while running:
+            events = pygame.event.get()
+            for event in events:
+                if event.type == pygame.QUIT: running = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE: running = False
+                # [SPACE] で周回の区切りを記録する (解析時にゲート判定の代わりに使う)
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                    lap_marks.append((time.perf_counter_ns() - start_ns) / 1e9)
+            t_events = time.perf_counter_ns()
+
+            dx, dy = source.poll(events, sched.drains_motion)
+            t_rel = time.perf_counter_ns()
+            if first_poll:
+                timeline.mark("最初の get_rel", t_rel)
+                first_poll = False
+
+            if dx != 0 or dy != 0:
+                total_x += dx
+                total_y += dy
+                elapsed = (time.perf_counter_ns() - start_ns) / 1e9
+                sample = (elapsed, dx, dy, total_x, total_y)
+                buf[count] = sample
+                count += 1
+                if count == BUFFER_SIZE:
+                    buf = writer.submit(buf, count)
+                    count = 0
+                if publisher is not None:
+                    publisher.add(sample, t_rel)
+            if publisher is not None:
+                publisher.tick(t_rel)
+            t_buffer = time.perf_counter_ns()
+
+            rendered = view.due(t_buffer, sched.time_left_ns(t_buffer))
+            if rendered:
+                view.render(total_x, total_y, t_buffer)
+            t_render = time.perf_counter_ns()
             
-            if data_buffer:
-                log_file.writelines(data_buffer)
+            sched.wait()
+            t_end = time.perf_counter_ns()
+            stats.record(t_start, t_events, t_rel, t_buffer, t_render, t_end, rendered)
+            t_start = t_end
 
     except Exception as e:
         print(f"\n❌ データ取得中にエラー: {e}")
+        _record_error(context, 'acquire', e)
     finally:
+        if timeline is not None:
+            timeline.print()
+        if source is not None:
+            _stop_input_source(context, source)
+        if publisher is not None:
+            _close_telemetry(context, publisher)
+        if writer is not None:
+            try:
+                writer.close(buf, count)
+            except Exception as e:
+                print(f"\n❌ 生データ書き込み中にエラー: {e}")
+                _record_error(context, 'acquire', e)
+            context['writer_stats'] = writer.stats()
+            context['acquired_rows'] = context['writer_stats']['samples_written']
+            _print_writer_stats(context['writer_stats'])
+        if view is not None:
+            context['live_view_stats'] = view.stats()
+        if stats is not None:
+            stats.finish()
+            _save_loop_stats(context, stats, sched)
         context['final_total_x'] = total_x
         context['final_total_y'] = total_y
+        if lap_marks:
+            laps.save_lap_marks(os.path.join(context['output_dir'], laps.LAP_MARKS_NAME), lap_marks)
+            print(f"⏱️ 周回の区切りを {len(lap_marks)} 回記録しました")
 
 
 # =============================================================================
 # 3. データ解析 (Analyze)
 # =============================================================================
 
+def _start_cm():
+    return (CourseConstants.START_PX_X * CourseConstants.CM_PER_PIXEL,
+            CourseConstants.START_PX_Y * CourseConstants.CM_PER_PIXEL)
+
+def _warn(context: Dict[str, Any], message: str):
+    """解析中の警告を context に溜める (表示は呼び出し側。reanalyze のワーカーからも返せるように)"""
+    context.setdefault('analysis_warnings', []).append(message)
+
+def _create_track_checker(context: Dict[str, Any]):
+    """コース画像と同じ日時の CourseData_*.csv があれば、コース上/コース外の判定器を作る"""
+    data_path = course_geometry.find_course_data(context['image_path'])
+    if data_path is None:
+        return None
+    try:
+        return course_geometry.create_track_checker(data_path, _start_cm(), CourseConstants.MICKEY_TO_CM)
+    except (OSError, ValueError, KeyError) as e:
+        _warn(context, f"⚠️ コースデータを読み込めないため、コース外判定をスキップします: {e}")
+        return None
+
+def _save_track_check(context: Dict[str, Any], checker) -> Dict[str, Any]:
+    """コース外イベントを offtrack_events.csv に保存し、集計結果を返す"""
+    summary = checker.finish()
+    context['track_summary'] = summary
+    course_geometry.save_offtrack_events(os.path.join(context['output_dir'], course_geometry.OFFTRACK_EVENTS_NAME),
+                                         checker.events)
+    return summary
+
+def _create_map_matcher(context: Dict[str, Any]):
+    """--map-match 指定時、コースデータの中心線に軌跡を当てはめるマッチャーを作る"""
+    if not context.get('map_match'):
+        return None
+    data_path = course_geometry.find_course_data(context['image_path'])
+    if data_path is None:
+        _warn(context, "⚠️ コースデータが見つからないため、マップマッチングをスキップします。")
+        return None
+    try:
+        return map_matching.create_map_matcher(data_path, _start_cm(), CourseConstants.MICKEY_TO_CM,
+                                               os.path.join(context['output_dir'], map_matching.MATCHED_PATH_NAME))
+    except (OSError, ValueError, KeyError) as e:
+        _warn(context, f"⚠️ コースデータを読み込めないため、マップマッチングをスキップします: {e}")
+        return None
+
+def _save_map_match(context: Dict[str, Any], matcher) -> Dict[str, Any]:
+    """残りの補正済み軌跡を matched_path.csv に書き切り、集計結果を返す"""
+    summary = matcher.finish()
+    context['map_match_summary'] = summary
+    return summary
+
+def _create_kinematics(context: Dict[str, Any]):
+    """等間隔の運動量 (kinematics.bin) を書き出すステージを作る (--kinematics-dt 0 なら作らない)"""
+    dt = context.get('kinematics_dt', kinematics.DT_S)
+    if not dt:
+        return None
+    return kinematics.KinematicsStage(_start_cm(), CourseConstants.MICKEY_TO_CM, CourseConstants.POLLING_RATE,
+                                      os.path.join(context['output_dir'], kinematics.KINEMATICS_NAME), dt)
+
+def _save_kinematics(context: Dict[str, Any], stage) -> Dict[str, Any]:
+    summary = stage.finish()
+    context['kinematics_summary'] = summary
+    return summary
+
+def _create_lap_detector(context: Dict[str, Any]):
+    """計測中に記録した区切り (lap_marks.json) があればそれを、無ければスタート地点のゲートで周回を区切る"""
+    return laps.LapDetector(_start_cm(), CourseConstants.MICKEY_TO_CM, laps.load_lap_marks(context['output_dir']),
+                            context.get('lap_gate_radius', laps.GATE_RADIUS_CM))
+
+def _save_laps(context: Dict[str, Any], detector) -> Dict[str, Any]:
+    """周回インデックスを lap_index.json に保存し、集計結果を返す"""
+    summary = detector.finish(context['raw_log_path'])
+    context['lap_summary'] = summary
+    laps.save_lap_index(os.path.join(context['output_dir'], laps.LAP_INDEX_NAME), summary, context['raw_log_path'])
+    return summary
+
+def _constants() -> Dict[str, Any]:
+    """セッションの比較に使う定数 (session_summary.json に記録する)"""
+    return {
+        'dpi': CourseConstants.DPI_SETTING, 'polling_rate': CourseConstants.POLLING_RATE,
+        'mickey_to_cm': CourseConstants.MICKEY_TO_CM, 'cm_per_pixel': CourseConstants.CM_PER_PIXEL,
+        'start_px_x': CourseConstants.START_PX_X, 'start_px_y': CourseConstants.START_PX_Y,
+    }
+
+def _save_session_summary(context: Dict[str, Any]) -> Dict[str, Any]:
+    """各工程の集計値を session_summary.json にまとめる (実行記録 run_store が取り込む)"""
+    summary = run_store.build_session_summary(context, _constants())
+    run_store.save_session_summary(os.path.join(context['output_dir'], run_store.SESSION_SUMMARY_NAME), summary)
+    return summary
+
+def run_analysis(context: Dict[str, Any]) -> Dict[str, Any]:
+    """生データを解析し、analyze.log と各工程の出力・session_summary.json を書き出す。
+
+    表示はせず、各工程の集計値 (track / laps / kinematics / map_match。無効な工程は None) と
+    総移動距離・行数・警告を返す。例外はそのまま送出する (FootPrint と reanalyze.py の共通処理)。
+    """
+    context['analysis_warnings'] = []
+    checker = _create_track_checker(context)
+    matcher = _create_map_matcher(context)
+    stage = _create_kinematics(context)
+    detector = _create_lap_detector(context)
+    # チャンク単位の NumPy 一括計算 (出力は従来の行単位版とバイト一致。コースデータがあれば On_Track 列を追加)
+    total_dist, rows = analyze_engine.analyze_file(context['raw_log_path'], context['analysis_log_path'],
+                                                   track_checker=checker, map_matcher=matcher,
+                                                   kinematics=stage, lap_detector=detector)
+    context['final_total_mickey_distance'] = total_dist
+    context['analyzed_rows'] = rows
+    result = {
+        'total_mickey_distance': total_dist, 'rows': rows,
+        'track': _save_track_check(context, checker) if checker is not None else None,
+        'laps': _save_laps(context, detector),
+        'kinematics': _save_kinematics(context, stage) if stage is not None else None,
+        'map_match': _save_map_match(context, matcher) if matcher is not None else None,
+    }
+    _save_session_summary(context)
+    result['warnings'] = context['analysis_warnings']
+    return result
+
 def analyze_raw_data(context: Dict[str, Any]):
-    raw_path = context['raw_log_path']; analyze_path = context['analysis_log_path']; total_dist = 0.0;
+    raw_path = context['raw_log_path']
     if not os.path.exists(raw_path): print("⚠️ 生データファイルが見つからないため、解析をスキップします。"); return
     try:
-        with open(analyze_path, 'w', newline='') as outfile:
-            writer = csv.writer(outfile); writer.writerow(['Timestamp_s', 'Rel_X', 'Rel_Y', 'Distance_Mickey', 'Angle_deg'])
-            with open(raw_path, 'r', newline='') as infile:
-                reader = csv.DictReader(infile)
-                for row in reader:
-                    dx = float(row['Rel_X']); dy = float(row['Rel_Y']); ts = float(row['Timestamp_s']);
-                    dist = math.sqrt(dx**2 + dy**2); total_dist += dist; angle = math.degrees(math.atan2(dy, dx))
-                    writer.writerow([f"{ts:.4f}", f"{dx:.0f}", f"{dy:.0f}", f"{dist:.3f}", f"{angle:.1f}"])
-        context['final_total_mickey_distance'] = total_dist; print(f"📊 解析完了: 総移動距離 {total_dist:.2f} Mickey")
-    except Exception as e: print(f"\n❌ 解析中にエラー: {e}")
+        result = run_analysis(context)
+    except Exception as e:
+        for warning in context.get('analysis_warnings', []): print(warning)
+        print(f"\n❌ 解析中にエラー: {e}"); _record_error(context, 'analyze', e); return
+    for warning in result['warnings']: print(warning)
+    print(f"📊 解析完了: 総移動距離 {result['total_mickey_distance']:.2f} Mickey")
+    summary = result['track']
+    if summary is not None and summary['samples']:
+        print(f"🛣️ コース上: {summary['on_track_percent']:.1f}% / コース外 {summary['offtrack_events']} 回 "
+              f"(計 {summary['offtrack_s']:.2f} s, {os.path.basename(summary['course_data'])})")
+    laps.print_laps(result['laps'])
+    summary = result['kinematics']
+    if summary is not None:
+        print(f"🏁 運動量 ({summary['dt_s'] * 1000:g} ms 間隔): 最高速度 {summary['max_speed_cm_s']:.1f} cm/s / "
+              f"最大加速度 {summary['max_abs_accel_cm_s2']:.0f} cm/s² / 最大ヨーレート {summary['max_abs_yaw_rate_deg_s']:.0f} deg/s")
+    summary = result['map_match']
+    if summary is not None and summary['steps']:
+        print(f"🧭 マップマッチング: 車線上 {summary['matched_percent']:.1f}% / 補正量 平均 {summary['mean_correction_cm']:.1f} cm・"
+              f"最大 {summary['max_correction_cm']:.1f} cm (終点 {summary['final_correction_cm']:.1f} cm)")
 
 
 # =============================================================================
 # 4. 結果図示 (Plot) - 画像ファースト
 # =============================================================================
 
+def _iter_trajectory_chunks(context: Dict[str, Any]):
+    """生データから画像上の軌跡 (x, y) [px] をチャンクごとに返す。先頭はスタート地点のみ"""
+    # 画像上のスタート地点
+    curr_x = float(CourseConstants.START_PX_X)
+    curr_y = float(CourseConstants.START_PX_Y)
+    yield np.array([curr_x]), np.array([curr_y])
+
+    for _, dx_m, dy_m in analyze_engine.iter_raw_chunks(context['raw_log_path']):
+        # Mickey -> Pixel
+        dx_px = dx_m * CourseConstants.MICKEY_TO_PIXEL
+        dy_px = dy_m * CourseConstants.MICKEY_TO_PIXEL
+        # Global X (Left/Right) = +dy_px (負の値なら左へ)
+        # Global Y (Up/Down) = -dx_px (正の値なら負(上)へ)
+        x = np.cumsum(np.concatenate(([curr_x], dy_px)))[1:]
+        y = np.cumsum(np.concatenate(([curr_y], -dx_px)))[1:]
+        if len(x):
+            curr_x = float(x[-1]); curr_y = float(y[-1])
+        yield x, y
+
+def _iter_matched_chunks(context: Dict[str, Any], matched: bool):
+    """matched_path.csv から補正後 (matched=False なら生) の軌跡 (x, y) [px] をチャンクごとに返す"""
+    yield np.array([float(CourseConstants.START_PX_X)]), np.array([float(CourseConstants.START_PX_Y)])
+    path = os.path.join(context['output_dir'], map_matching.MATCHED_PATH_NAME)
+    for raw_x, raw_y, x, y in map_matching.iter_matched_chunks(path):
+        if not matched:
+            x, y = raw_x, raw_y
+        yield x / CourseConstants.CM_PER_PIXEL, y / CourseConstants.CM_PER_PIXEL
+
+def _plot_matplotlib(x_plot, y_plot, image_path: str, plot_path: str, title: str, raw=None):
+    """従来の matplotlib による描画 (--plot-engine matplotlib)。raw を渡すと生の軌跡と補正後の軌跡を重ねる"""
+    import matplotlib.pyplot as plt
+    import matplotlib.image as mpimg
+
+    if os.path.exists(image_path):
+        img = mpimg.imread(image_path)
+        h, w = img.shape[:2]
+    else:
+        img = None; w, h = 1000, 546
+
+    dpi = 100
+    fig, ax = plt.subplots(figsize=(w/dpi, h/dpi), dpi=dpi)
+
+    if img is not None:
+        ax.imshow(img)
+    else:
+        ax.set_xlim(0, w); ax.set_ylim(h, 0)
+
+    if raw is not None:
+        ax.plot(raw[0], raw[1], label='Raw', color='red', linewidth=2, alpha=rasterizer.RAW_OVERLAY_ALPHA)
+        ax.plot(x_plot, y_plot, label='Matched', color=np.array(rasterizer.MATCHED_COLOR) / 255, linewidth=2)
+    else:
+        ax.plot(x_plot, y_plot, label='Trajectory', color='red', linewidth=2)
+    ax.scatter(x_plot[0], y_plot[0], color='lime', s=150, label='Start', edgecolors='black', zorder=5)
+    ax.scatter(x_plot[-1], y_plot[-1], color='blue', marker='x', s=150, label='End', zorder=5)
+    
+    ax.set_title(title)
+    ax.axis('off')
+    plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
+    plt.savefig(plot_path, bbox_inches='tight', pad_inches=0.1)
+    plt.close()
+
+def render_plot(context: Dict[str, Any]):
+    """context の生データから trajectory_plot.png を描く (例外はそのまま送出する)"""
+    plot_path = context['plot_path']
+    image_path = context['image_path']
+    title = f"Trajectory Overlay (Total: {context['final_total_mickey_distance']:.0f} Mickey)"
+    if context['plot_engine'] == 'matplotlib':
+        chunks = list(_iter_trajectory_chunks(context))
+        x_plot = np.concatenate([x for x, _ in chunks])
+        y_plot = np.concatenate([y for _, y in chunks])
+        _plot_matplotlib(x_plot, y_plot, image_path, plot_path, title)
+    else:
+        # サブピクセル精度で間引いた軌跡をコース画像の配列に直接描く
+        rasterizer.plot_trajectory_raster(_iter_trajectory_chunks(context), image_path, plot_path, title)
+
+def render_matched_plot(context: Dict[str, Any]) -> str:
+    """matched_path.csv から生の軌跡と補正後の軌跡を重ねた trajectory_matched.png を描き、そのパスを返す"""
+    plot_path = os.path.join(context['output_dir'], map_matching.MATCHED_PLOT_NAME)
+    title = "Raw (light red) vs Map-Matched Trajectory"
+    if context['plot_engine'] == 'matplotlib':
+        raw = [np.concatenate(c) for c in zip(*_iter_matched_chunks(context, matched=False))]
+        x_plot, y_plot = [np.concatenate(c) for c in zip(*_iter_matched_chunks(context, matched=True))]
+        _plot_matplotlib(x_plot, y_plot, context['image_path'], plot_path, title, raw=raw)
+    else:
+        rasterizer.plot_matched_raster(_iter_matched_chunks(context, matched=False),
+                                       _iter_matched_chunks(context, matched=True),
+                                       context['image_path'], plot_path, title)
+    return plot_path
+
 def plot_analysis_results(context: Dict[str, Any]):
     analyze_path = context['analysis_log_path']
     plot_path = context['plot_path']
-    image_path = context['image_path']
     
     if not os.path.exists(analyze_path): return
 
-    # 画像上のスタート地点
-    curr_x = CourseConstants.START_PX_X
-    curr_y = CourseConstants.START_PX_Y
-    
-    x_plot = [curr_x]
-    y_plot = [curr_y]
-    
     try:
-        with open(analyze_path, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                dx_m = float(row['Rel_X'])
-                dy_m = float(row['Rel_Y'])
-                
-                # Mickey -> Pixel
-                dx_px = dx_m * CourseConstants.MICKEY_TO_PIXEL
-                dy_px = dy_m * CourseConstants.MICKEY_TO_PIXEL
-                
-                # Global X (Left/Right) = +dy_px (負の値なら左へ)
-                delta_global_x = dy_px 
-                
-                # Global Y (Up/Down) = -dx_px (正の値なら負(上)へ)
-                delta_global_y = -dx_px 
-                
-                curr_x += delta_global_x
-                curr_y += delta_global_y
-                x_plot.append(curr_x); y_plot.append(curr_y)
-
-        # --- 描画 ---
-        if os.path.exists(image_path):
-            img = mpimg.imread(image_path)
-            h, w = img.shape[:2]
-        else:
-            img = None; w, h = 1000, 546
-
-        dpi = 100
-        fig, ax = plt.subplots(figsize=(w/dpi, h/dpi), dpi=dpi)
-
-        if img is not None:
-            ax.imshow(img)
-        else:
-            ax.set_xlim(0, w); ax.set_ylim(h, 0)
-
-        ax.plot(x_plot, y_plot, label='Trajectory', color='red', linewidth=2)
-        ax.scatter(x_plot[0], y_plot[0], color='lime', s=150, label='Start', edgecolors='black', zorder=5)
-        ax.scatter(x_plot[-1], y_plot[-1], color='blue', marker='x', s=150, label='End', zorder=5)
-        
-        ax.set_title(f"Trajectory Overlay (Total: {context['final_total_mickey_distance']:.0f} Mickey)")
-        ax.axis('off')
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-        plt.savefig(plot_path, bbox_inches='tight', pad_inches=0.1)
-        plt.close()
+        render_plot(context)
         print(f"🖼️ 軌跡図保存完了: {plot_path}")
+        if context.get('map_match_summary'):
+            print(f"🖼️ 補正前後の比較図保存完了: {render_matched_plot(context)}")
+
+    except Exception as e: print(f"\n❌ プロット中にエラー: {e}"); _record_error(context, 'plot', e)
 
-    except Exception as e: print(f"\n❌ プロット中にエラー: {e}")
+def store_session(context: Dict[str, Any]):
+    """session_summary.json と間引いた運動量を、セッションをまたいだ実行記録 Log/run_store/ に追記する"""
+    if not os.path.exists(os.path.join(context['output_dir'], run_store.SESSION_SUMMARY_NAME)): return
+    try:
+        store = run_store.RunStore(run_store.store_path_for_session(context['output_dir']))
+        result = store.ingest([context['output_dir']])
+        if result['ingested']:
+            print(f"🗄️ 実行記録に追加: {os.path.basename(result['segment'])} (計 {len(store)} セッション)")
+    except Exception as e: print(f"\n❌ 実行記録の保存中にエラー: {e}"); _record_error(context, 'store', e)
 
 # =============================================================================
 # 5. メイン実行
 # =============================================================================
+
+# 工程ごとの処理行数を context のどの値から取るか
+_STAGE_ROWS = {'acquire': 'acquired_rows', 'replay': 'acquired_rows', 'analyze': 'analyzed_rows', 'plot': 'analyzed_rows'}
+
+def start_metrics(context: Dict[str, Any]) -> run_metrics.RunMetrics:
+    """工程ごとの計測を始める (--profile 指定時は cProfile も)"""
+    settings = {k: context.get(k) for k in ('mouse_name', 'raw_format', 'scheduler', 'plot_engine', 'input',
+                                            'backpressure', 'map_match', 'kinematics_dt', 'acquire_only', 'telemetry')}
+    settings['constants'] = _constants()
+    metrics = run_metrics.RunMetrics(context['output_dir'] if context.get('profile') else None, settings)
+    context['metrics'] = metrics
+    return metrics
+
+def run_stage(context: Dict[str, Any], name: str, func, *args):
+    """工程を1つ実行し、所要時間・CPU 時間・メモリ・読み書き量・行数を記録する"""
+    with context['metrics'].stage(name) as stage:
+        result = func(*args)
+        stage.rows = context.get(_STAGE_ROWS.get(name))
+    return result
+
+def save_metrics(context: Dict[str, Any]):
+    """run_metrics.json を analyze.log と同じディレクトリに保存し、概要を表示する"""
+    try:
+        summary = context['metrics'].save(os.path.join(context['output_dir'], run_metrics.RUN_METRICS_NAME), merge=True)
+        run_metrics.print_metrics(summary)
+    except Exception as e: print(f"\n❌ 工程別の計測結果の保存中にエラー: {e}")
+
 def main():
+    timeline = startup_timeline.StartupTimeline(_MODULE_START_NS)
+    timeline.mark("import 完了", _IMPORTS_DONE_NS)
+    context = None
     try:
         context = _setup_context(sys.argv)
-        screen = _initialize_pygame(context)
-        acquire_raw_data(context, screen)
+        context['startup'] = timeline
+        start_metrics(context)
+        timeline.mark("オプション解釈")
+        run_stage(context, 'layout', check_course_layout, context)
+        timeline.mark("レイアウト検証")
+        screen = run_stage(context, 'window', _initialize_pygame, context)
+        timeline.mark("ウィンドウ表示")
+        run_stage(context, 'acquire', acquire_raw_data, context, screen)
         pygame.quit() 
-        analyze_raw_data(context)
-        plot_analysis_results(context)
+        if context['acquire_only']:
+            print("-" * 70); print("🎉 計測完了！ (解析と描画は py -3.12 reanalyze.py で実行してください)")
+            return
+        run_stage(context, 'analyze', analyze_raw_data, context)
+        run_stage(context, 'plot', plot_analysis_results, context)
+        run_stage(context, 'store', store_session, context)
         print("-" * 70); print("🎉 全工程完了！")
     except ValueError as e: print(f"エラー: {e}")
     except Exception as e: print(f"予期せぬエラー: {e}")
     finally:
-        if pygame.get_init(): pygame.quit()
+        # display/font だけを初期化しているため pygame.get_init() は False のまま。pygame.quit() は何度呼んでも安全
+        pygame.quit()
+        if context is not None and 'metrics' in context: save_metrics(context)
 
 if __name__ == "__main__":
     main()
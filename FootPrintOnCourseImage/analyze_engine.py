@@ -0,0 +1,147 @@
+import itertools
+import math
+import numpy as np
+from typing import Iterator, Optional, Tuple
+
+import raw_format
+
+# =============================================================================
+# チャンク分割 + NumPy 一括計算による解析エンジン
+# =============================================================================
+#
+# raw_data.log (または raw_data.bin) を CHUNK_ROWS 行ずつ配列に読み込み、距離・角度・累積距離を
+# チャンク単位でまとめて計算する。セッションの長さに関わらず、メモリ使用量は
+# 1チャンク分で頭打ちになる。
+# 出力する analyze.log は従来の csv.writer 版とバイト単位で一致させる
+# (改行コード \r\n、各列の書式も同一)。
+# コース形状 (course_geometry.TrackChecker) を渡した場合だけ、末尾に On_Track 列 (1: コース上 / 0: コース外) を足す。
+# マップマッチング (map_matching.MapMatcher) を渡した場合は、同じチャンクを流して補正後の軌跡を別ファイルに書かせる。
+# 運動量 (kinematics.KinematicsStage) も同様に、同じチャンクから等間隔の速度・加速度・ヨーレートを書かせる。
+# 周回の検出 (laps.LapDetector) も同じチャンクを受け取り、周回の区切りを溜める。
+
+CHUNK_ROWS: int = 100_000
+
+ANALYZE_COLUMNS = ['Timestamp_s', 'Rel_X', 'Rel_Y', 'Distance_Mickey', 'Angle_deg']
+ANALYZE_HEADER: str = ",".join(ANALYZE_COLUMNS) + "\r\n"
+ANALYZE_TRACK_HEADER: str = ",".join(ANALYZE_COLUMNS + ['On_Track']) + "\r\n"
+
+# 従来の f"{ts:.4f}", f"{dx:.0f}", ... と同じ丸め規則になる % 書式
+_ROW_FORMAT: str = "%.4f,%.0f,%.0f,%.3f,%.1f"
+_PAIR_FORMAT: str = "%.0f,%.0f,%.3f,%.1f"
+
+# Timestamp_s は小数4桁で記録されるため、1e-4 秒単位の整数として書式化できる
+_TS_SCALE: int = 10_000
+_TS_EXACT_LIMIT: float = 1e15
+# (Rel_X, Rel_Y) を1つの int64 キーに詰めるための上限
+_PAIR_LIMIT: float = 2.0 ** 31
+
+
+def iter_raw_chunks(raw_path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """raw_data.log を (Timestamp_s, Rel_X, Rel_Y) の float64 配列としてチャンクごとに返す"""
+    if raw_format.is_binary(raw_path):
+        # バイナリ形式は memmap のスライスをそのまま使うため、文字列の解析は不要
+        for rec in raw_format.iter_record_chunks(raw_path, chunk_rows):
+            yield (rec['Timestamp_s'].astype(np.float64), rec['Rel_X'].astype(np.float64),
+                   rec['Rel_Y'].astype(np.float64))
+        return
+    with open(raw_path, 'r', newline='') as infile:
+        header = infile.readline().strip().split(',')
+        # DictReader と同様に列名で参照する
+        cols = (header.index('Timestamp_s'), header.index('Rel_X'), header.index('Rel_Y'))
+        while True:
+            lines = list(itertools.islice(infile, chunk_rows))
+            if not lines:
+                break
+            data = np.loadtxt(lines, delimiter=',', usecols=cols, dtype=np.float64, ndmin=2)
+            yield data[:, 0], data[:, 1], data[:, 2]
+
+
+def compute_chunk(dx: np.ndarray, dy: np.ndarray, carry: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """1チャンク分の距離・角度・累積距離を計算する (carry は前チャンクまでの総距離)"""
+    dist = np.sqrt(dx * dx + dy * dy)
+    angle = np.degrees(np.arctan2(dy, dx))
+    # 従来版の total_dist += dist と同じ加算順序になるよう、carry を先頭に置いて逐次累積する
+    running = np.cumsum(np.concatenate(([carry], dist)))[1:]
+    return dist, angle, running
+
+
+def _pair_suffixes(dx: np.ndarray, dy: np.ndarray) -> Optional[list]:
+    """行ごとの "dx,dy,dist,angle" の文字列リストを返す。
+
+    (Rel_X, Rel_Y) の組はごく少数の種類しか現れないため、組ごとに1回だけ
+    従来と同じ math 関数で計算・書式化し、行へ展開する。
+    整数値でない値など組をキーにできない場合は None を返す。
+    """
+    ok = (np.abs(dx) < _PAIR_LIMIT) & (np.abs(dy) < _PAIR_LIMIT)
+    ok &= (np.rint(dx) == dx) & (np.rint(dy) == dy)
+    # -0.0 は "%.0f" で "-0" になるため、0.0 と同じキーにはできない
+    ok &= ~(np.signbit(dx) & (dx == 0)) & ~(np.signbit(dy) & (dy == 0))
+    if not ok.all():
+        return None
+    key = dx.astype(np.int64) * (1 << 32) + (dy.astype(np.int64) + (1 << 31))
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    suffixes = []
+    for x, y in zip(dx[first].tolist(), dy[first].tolist()):
+        dist = math.sqrt(x**2 + y**2); angle = math.degrees(math.atan2(y, x))
+        suffixes.append(_PAIR_FORMAT % (x, y, dist, angle))
+    return np.array(suffixes, dtype=object)[inverse.reshape(-1)].tolist()
+
+
+def format_chunk(ts: np.ndarray, dx: np.ndarray, dy: np.ndarray, on_track: Optional[np.ndarray] = None) -> str:
+    """1チャンク分の analyze.log 行を一度の % 演算でまとめて文字列化する"""
+    n = len(ts)
+    if n == 0:
+        return ""
+    # On_Track 列は行末の書式に1項目足すだけにする
+    end = "\r\n" if on_track is None else ",%d\r\n"
+    extra = [] if on_track is None else [on_track.astype(np.int8).tolist()]
+    suffixes = _pair_suffixes(dx, dy)
+    if suffixes is None:
+        dist = np.sqrt(dx * dx + dy * dy)
+        angle = np.degrees(np.arctan2(dy, dx))
+        values = np.column_stack([ts, dx, dy, dist, angle] + extra).ravel().tolist()
+        return ((_ROW_FORMAT + end) * n) % tuple(values)
+
+    k = np.rint(ts * _TS_SCALE)
+    if np.all((k / _TS_SCALE == ts) & (k >= 0) & (k < _TS_EXACT_LIMIT)):
+        # ts が小数4桁の10進値に最も近い double であれば "%.4f" は整数部.小数部 と一致する
+        int_part, frac_part = np.divmod(k.astype(np.int64), _TS_SCALE)
+        columns = [int_part.tolist(), frac_part.tolist(), suffixes] + extra
+        row_format = "%d.%04d,%s" + end
+    else:
+        columns = [ts.tolist(), suffixes] + extra
+        row_format = "%.4f,%s" + end
+    width = len(columns)
+    values = [None] * (width * n)
+    for i, column in enumerate(columns):
+        values[i::width] = column
+    return (row_format * n) % tuple(values)
+
+
+def analyze_file(raw_path: str, analyze_path: str, chunk_rows: int = CHUNK_ROWS,
+                 track_checker=None, map_matcher=None, kinematics=None, lap_detector=None) -> Tuple[float, int]:
+    """raw_data.log を解析して analyze.log を書き出す。戻り値は (総移動距離, 行数)
+
+    track_checker (course_geometry.TrackChecker) を渡すと、各行のコース上/コース外を判定して
+    On_Track 列を加える。コース外イベントは track_checker 側に溜まる。
+    map_matcher (map_matching.MapMatcher) を渡すと、各チャンクを渡して補正後の軌跡を逐次書き出させる
+    (analyze.log の内容は変わらない)。kinematics (kinematics.KinematicsStage) と
+    lap_detector (laps.LapDetector) も同じく各チャンクを受け取る。
+    """
+    total_dist = 0.0
+    rows = 0
+    with open(analyze_path, 'w', newline='') as outfile:
+        outfile.write(ANALYZE_HEADER if track_checker is None else ANALYZE_TRACK_HEADER)
+        for ts, dx, dy in iter_raw_chunks(raw_path, chunk_rows):
+            dist, angle, running = compute_chunk(dx, dy, total_dist)
+            on_track = track_checker.update(ts, dx, dy) if track_checker is not None else None
+            outfile.write(format_chunk(ts, dx, dy, on_track))
+            if map_matcher is not None:
+                map_matcher.update(ts, dx, dy)
+            if kinematics is not None:
+                kinematics.update(ts, dx, dy)
+            if lap_detector is not None:
+                lap_detector.update(ts, dx, dy)
+            total_dist = float(running[-1])
+            rows += len(ts)
+    return total_dist, rows
@@ -0,0 +1,427 @@
+import argparse
+import csv
+import json
+import math
+import platform
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+import analyze_engine
+
+# =============================================================================
+# ベンチマーク: 合成ログによる各工程のスループット計測
+# =============================================================================
+#
+# 実行例:
+#   py -3.12 benchmark.py analyze --rows 10000000
+#   py -3.12 benchmark.py analyze --rows 200000 --legacy   (従来版との比較・バイト一致確認)
+#   py -3.12 benchmark.py scheduler --seconds 5            (スケジューラごとの達成レートと CPU 使用率)
+#   py -3.12 benchmark.py plot --rows 3600000              (軌跡図: NumPy ラスタライザ vs matplotlib)
+#   py -3.12 benchmark.py suite --output bench.json        (合成周回データで全工程を計測)
+#   py -3.12 benchmark.py suite --baseline bench.json      (前回の結果と比べて劣化を検出)
+#   py -3.12 benchmark.py telemetry --seconds 5            (配信の遅延とループへの負荷。--slow-ms で遅い購読者)
+
+
+def write_synthetic_raw_log(path: str, rows: int, seed: int = 0, chunk_rows: int = analyze_engine.CHUNK_ROWS):
+    """1000Hz 相当の合成 raw_data.log を書き出す (メモリは1チャンク分のみ使用)"""
+    rng = np.random.default_rng(seed)
+    total_x = 0
+    total_y = 0
+    elapsed = 0.0
+    with open(path, 'w', newline='') as f:
+        f.write("Timestamp_s,Rel_X,Rel_Y,Total_X,Total_Y\n")
+        for start in range(0, rows, chunk_rows):
+            n = min(chunk_rows, rows - start)
+            dx = rng.integers(-6, 7, n)
+            dy = rng.integers(-12, 3, n)
+            # 取得ループは移動量ゼロのサンプルを記録しない
+            dx[(dx == 0) & (dy == 0)] = 1
+            ts = elapsed + np.cumsum(rng.uniform(0.0009, 0.0011, n))
+            tx = total_x + np.cumsum(dx)
+            ty = total_y + np.cumsum(dy)
+            values = np.column_stack((ts, dx, dy, tx, ty)).ravel().tolist()
+            f.write(("%.4f,%d,%d,%d,%d\n" * n) % tuple(values))
+            elapsed = float(ts[-1]); total_x = int(tx[-1]); total_y = int(ty[-1])
+
+
+def _analyze_legacy(raw_path: str, analyze_path: str) -> float:
+    """比較用: 変更前の csv.DictReader による行単位の解析"""
+    total_dist = 0.0
+    with open(analyze_path, 'w', newline='') as outfile:
+        writer = csv.writer(outfile); writer.writerow(['Timestamp_s', 'Rel_X', 'Rel_Y', 'Distance_Mickey', 'Angle_deg'])
+        with open(raw_path, 'r', newline='') as infile:
+            reader = csv.DictReader(infile)
+            for row in reader:
+                dx = float(row['Rel_X']); dy = float(row['Rel_Y']); ts = float(row['Timestamp_s']);
+                dist = math.sqrt(dx**2 + dy**2); total_dist += dist; angle = math.degrees(math.atan2(dy, dx))
+                writer.writerow([f"{ts:.4f}", f"{dx:.0f}", f"{dy:.0f}", f"{dist:.3f}", f"{angle:.1f}"])
+    return total_dist
+
+
+def _measure(func, *args):
+    """(経過秒, 戻り値) を返す"""
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def _measure_peak(func, *args) -> float:
+    """tracemalloc によるピークメモリ (MB)。計測オーバーヘッドがあるため時間計測とは別に実行する"""
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def bench_analyze(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, "raw_data.log")
+        out_path = os.path.join(tmp, "analyze.log")
+        legacy_path = os.path.join(tmp, "analyze_legacy.log")
+
+        print(f"⏳ 合成ログ生成中: {args.rows:,} 行")
+        gen_sec, _ = _measure(write_synthetic_raw_log, raw_path, args.rows)
+        size_mb = os.path.getsize(raw_path) / 1e6
+        print(f"   生成 {gen_sec:.2f} s ({size_mb:.1f} MB)")
+
+        sec, (total, rows) = _measure(analyze_engine.analyze_file, raw_path, out_path, args.chunk_rows)
+        print(f"📊 NumPy チャンク版: {sec:.2f} s  {rows / sec:,.0f} rows/s  {size_mb / sec:.1f} MB/s  (総距離 {total:.2f})")
+        if args.memory:
+            peak = _measure_peak(analyze_engine.analyze_file, raw_path, out_path, args.chunk_rows)
+            print(f"   ピークメモリ: {peak:.1f} MB (chunk_rows={args.chunk_rows:,})")
+
+        if args.legacy:
+            legacy_sec, legacy_total = _measure(_analyze_legacy, raw_path, legacy_path)
+            print(f"🐢 従来版 (csv): {legacy_sec:.2f} s  {rows / legacy_sec:,.0f} rows/s  (総距離 {legacy_total:.2f})")
+            print(f"   速度比: x{legacy_sec / sec:.1f}")
+            with open(out_path, 'rb') as a, open(legacy_path, 'rb') as b:
+                identical = a.read() == b.read()
+            print(f"   analyze.log バイト一致: {'✅' if identical else '❌'}")
+            if not identical:
+                return 1
+    return 0
+
+
+def bench_scheduler(args):
+    """描画・記録なしの空ループで、スケジューラごとの達成レートと CPU コストを比べる"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import loop_stats
+    import scheduler
+
+    pygame.init()
+    pygame.display.set_mode((64, 64))
+    try:
+        for name in args.modes:
+            sched = scheduler.create_scheduler(name, args.rate)
+            start_ns = time.perf_counter_ns()
+            stats = loop_stats.LoopStats(args.rate, start_ns)
+            end_ns = start_ns + int(args.seconds * 1e9)
+            t_start = start_ns
+            sched.start()
+            while t_start < end_ns:
+                events = pygame.event.get()
+                t_events = time.perf_counter_ns()
+                if sched.drains_motion:
+                    scheduler.sum_motion(events)
+                else:
+                    pygame.mouse.get_rel()
+                t_rel = time.perf_counter_ns()
+                sched.wait()
+                t_end = time.perf_counter_ns()
+                stats.record(t_start, t_events, t_rel, t_rel, t_rel, t_end, False)
+                t_start = t_end
+            stats.finish()
+            d = stats.to_dict()
+            period = d['period_ms']
+            print(f"⏱️ {name:6s}: {d['achieved_rate_hz']:10,.1f} Hz  p50 {period['p50']:.2f} ms  p99 {period['p99']:.2f} ms  "
+                  f"最大 {period['max']:.2f} ms  取りこぼし {d['missed_periods']:,}  CPU {d['cpu_percent']:.0f}%")
+    finally:
+        pygame.quit()
+    return 0
+
+
+def synthetic_trajectory_chunks(rows: int, seed: int = 0, chunk_rows: int = analyze_engine.CHUNK_ROWS):
+    """コース画像上を楕円状に周回する合成軌跡 (x, y) [px] をチャンクごとに返す"""
+    rng = np.random.default_rng(seed)
+    samples_per_lap = 10_000  # 1周 約 20 m を 1000Hz で 10 秒
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        theta = 2 * np.pi * np.arange(start, start + n) / samples_per_lap
+        lap = np.arange(start, start + n) / samples_per_lap
+        # 周回ごとに少しずつずれる (ドリフト) 様子を再現する
+        x = 500 + (350 + 3 * np.sin(lap)) * np.cos(theta) + rng.normal(0, 0.05, n)
+        y = 273 + (200 + 3 * np.cos(lap)) * np.sin(theta) + rng.normal(0, 0.05, n)
+        yield x, y
+
+
+def bench_plot(args):
+    import FootPrint
+    import rasterizer
+
+    image_path = args.image or ""
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = args.keep or tmp
+        title = "Trajectory Overlay (Total: 0 Mickey)"
+
+        raster_path = os.path.join(out_dir, "trajectory_raster.png")
+        sec, vertices = _measure(rasterizer.plot_trajectory_raster,
+                                 synthetic_trajectory_chunks(args.rows), image_path, raster_path, title)
+        print(f"🖼️ NumPy ラスタライザ: {sec:.2f} s  ({args.rows:,} 点 -> 簡略化後 {vertices:,} 頂点)")
+
+        if args.matplotlib:
+            chunks = list(synthetic_trajectory_chunks(args.rows))
+            x = np.concatenate([c[0] for c in chunks]); y = np.concatenate([c[1] for c in chunks])
+            mpl_path = os.path.join(out_dir, "trajectory_matplotlib.png")
+            mpl_sec, _ = _measure(FootPrint._plot_matplotlib, x, y, image_path, mpl_path, title)
+            print(f"🐢 matplotlib: {mpl_sec:.2f} s  (速度比 x{mpl_sec / sec:.1f})")
+    return 0
+
+
+# --- 全工程の計測 (suite) ---
+
+SUITE_TOLERANCE: float = 0.2
+
+
+def _suite_stages(tmp: str, args):
+    """(工程名, 関数, 出力ファイル) の列。関数は処理した行数を返す"""
+    import FootPrint
+    import raw_format
+    import replay
+    import synthetic_laps
+
+    source = os.path.join(tmp, "source_raw_data.log")
+    csv_path = os.path.join(tmp, "raw_data.log")
+    bin_path = os.path.join(tmp, "raw_data.bin")
+    analyze_path = os.path.join(tmp, "analyze.log")
+    plot_path = os.path.join(tmp, "trajectory_plot.png")
+
+    def synthesize():
+        records = synthetic_laps.iter_synthetic_records(args.seconds, args.rate, args.speed, seed=args.seed)
+        return synthetic_laps.write_synthetic_log(source, records, binary=False)
+
+    def acquire(raw_format_name: str, raw_path: str):
+        def run():
+            context = {'raw_format': raw_format_name, 'raw_log_path': raw_path}
+            return replay.replay_records(context, replay.iter_source_records(source), 'max')['samples']
+        return run
+
+    def analyze(raw_path: str):
+        return lambda: analyze_engine.analyze_file(raw_path, analyze_path)[1]
+
+    def plot():
+        context = {'raw_log_path': bin_path, 'image_path': args.image or "", 'plot_path': plot_path,
+                   'plot_engine': args.plot_engine, 'final_total_mickey_distance': 0.0}
+        FootPrint.render_plot(context)
+        return len(raw_format.open_records(bin_path))
+
+    return [
+        ('synthesize', synthesize, source),
+        ('acquire_csv', acquire('csv', csv_path), csv_path),
+        ('acquire_binary', acquire('binary', bin_path), bin_path),
+        ('analyze_csv', analyze(csv_path), analyze_path),
+        ('analyze_binary', analyze(bin_path), analyze_path),
+        ('plot', plot, plot_path),
+    ]
+
+
+def _compare_baseline(results: dict, baseline: dict, tolerance: float) -> int:
+    """スループットの低下・ピークメモリの増加が tolerance を超えた工程の数を返す"""
+    regressions = 0
+    for name, stage in results['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            continue
+        ratio = stage['rows_per_s'] / base['rows_per_s']
+        worse = ratio < 1 - tolerance
+        detail = f"スループット x{ratio:.2f}"
+        if stage.get('peak_mb') is not None and base.get('peak_mb'):
+            mem_ratio = stage['peak_mb'] / base['peak_mb']
+            worse = worse or mem_ratio > 1 + tolerance
+            detail += f" / ピークメモリ x{mem_ratio:.2f}"
+        regressions += worse
+        print(f"   {'❌' if worse else '✅'} {name:15s} {detail}")
+    return regressions
+
+
+def bench_suite(args):
+    """合成周回データを 生成 -> 取得 (再生) -> 解析 -> 描画 と流し、工程ごとのスループットとピークメモリを記録する"""
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+        'params': {'seconds': args.seconds, 'rate': args.rate, 'speed': args.speed, 'seed': args.seed,
+                   'plot_engine': args.plot_engine},
+        'stages': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"⏳ 合成周回データ: {args.seconds:.0f} s x {args.rate} Hz (速度 {args.speed:.0f} cm/s)")
+        for name, func, out_path in _suite_stages(tmp, args):
+            # ばらつきを抑えるため、最速の回を採用する
+            sec, rows = min(_measure(func) for _ in range(args.repeat))
+            size_mb = os.path.getsize(out_path) / 1e6 if os.path.exists(out_path) else None
+            stage = {'seconds': sec, 'rows': rows, 'rows_per_s': rows / sec if sec > 0 else None,
+                     'output_mb': size_mb, 'peak_mb': None}
+            if args.memory:
+                stage['peak_mb'] = _measure_peak(func)
+            results['stages'][name] = stage
+            mem = f"  ピーク {stage['peak_mb']:.1f} MB" if stage['peak_mb'] is not None else ""
+            print(f"📊 {name:15s} {sec:7.2f} s  {stage['rows_per_s']:12,.0f} rows/s{mem}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 結果を保存しました: {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"🔍 基準との比較 ({args.baseline}, 許容 {args.tolerance:.0%}):")
+        if _compare_baseline(results, baseline, args.tolerance):
+            print("❌ 性能が劣化した工程があります")
+            return 1
+        print("✅ 劣化なし")
+    return 0
+
+
+# --- テレメトリ配信の遅延 (telemetry) ---
+
+def _telemetry_receiver(address: str, slow_ms: float, ready, results):
+    """別プロセスで動く購読者の代役。END を受け取るまで受信し、遅延と欠けを返す"""
+    import telemetry
+
+    subscriber = telemetry.TelemetrySubscriber(address)
+    ready.set()
+    transit = []
+    try:
+        while not subscriber.ended:
+            received = subscriber.receive(timeout=5.0)
+            if received is None:
+                break
+            frame, _ = received
+            transit.append((frame['recv_ns'] - frame['send_ns']) / 1e6)
+            if slow_ms:
+                time.sleep(slow_ms / 1000)
+        results.put({'subscriber': subscriber.stats(),
+                     'latency_ms': telemetry.latency_summary(subscriber.take_latencies()),
+                     'transit_ms': telemetry.latency_summary(np.array(transit))})
+    finally:
+        subscriber.close()
+
+
+def bench_telemetry(args):
+    """取得ループと同じ周期でサンプルを配信し、取得 -> 受信の遅延と、配信がループに足す時間を計測する"""
+    import multiprocessing
+    import raw_format
+    import scheduler
+    import telemetry
+
+    with tempfile.TemporaryDirectory() as tmp:
+        address = args.address
+        if address is None:
+            address = f"unix://{os.path.join(tmp, 'telemetry.sock')}" if os.name == 'posix' else "udp://127.0.0.1:9871"
+        ready = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        receiver = multiprocessing.Process(target=_telemetry_receiver, args=(address, args.slow_ms, ready, results),
+                                           daemon=True)
+        receiver.start()
+        if not ready.wait(10):
+            print("❌ 購読者の代役が起動しませんでした")
+            return 1
+
+        publisher = telemetry.TelemetryPublisher(address, args.batch_ms)
+        sched = scheduler.create_scheduler(args.scheduler, args.rate)
+        n = int(args.seconds * args.rate)
+        overhead = np.empty(n, dtype=np.int64)
+        start_ns = time.perf_counter_ns()
+        header = raw_format.default_header()
+        header['polling_rate'] = args.rate
+        publisher.start(start_ns, header)
+        sched.start()
+        for i in range(n):
+            t0 = time.perf_counter_ns()
+            publisher.add(((t0 - start_ns) / 1e9, 1, 2, i + 1, 2 * (i + 1)), t0)
+            publisher.tick(t0)
+            overhead[i] = time.perf_counter_ns() - t0
+            sched.wait()
+        publisher.close()
+        try:
+            received = results.get(timeout=10)
+        except Exception:
+            received = None
+        receiver.join(5)
+
+    sent = publisher.stats()
+    us = np.percentile(overhead, [50, 99]) / 1e3
+    print(f"📡 {address}: {n:,} サンプル ({args.rate} Hz x {args.seconds:.1f} s, まとめ {args.batch_ms} ms, "
+          f"購読者の処理 {args.slow_ms} ms/フレーム)")
+    print(f"⏱️ ループへの負荷: p50 {us[0]:.1f} µs  p99 {us[1]:.1f} µs  最大 {overhead.max() / 1e3:.1f} µs")
+    print(f"📤 送信 {sent['frames_sent']:,} フレーム / 破棄 {sent['dropped_frames']:,} フレーム "
+          f"({sent['dropped_samples']:,} サンプル) / 宛先なし {sent['unreachable_frames']:,}")
+    if received is None:
+        print("❌ 購読者の代役から結果を受け取れませんでした")
+        return 1
+    sub, latency, transit = received['subscriber'], received['latency_ms'], received['transit_ms']
+    print(f"📥 受信 {sub['frames']:,} フレーム / {sub['samples']:,} サンプル  欠け {sub['lost_frames']:,} フレーム "
+          f"({sub['lost_samples']:,} サンプル)")
+    print(f"🕒 遅延 (取得 -> 受信): p50 {latency['p50']:.2f} ms  p99 {latency['p99']:.2f} ms  最大 {latency['max']:.2f} ms")
+    print(f"🕒 転送 (送信 -> 受信): p50 {transit['p50']:.3f} ms  p99 {transit['p99']:.3f} ms  最大 {transit['max']:.3f} ms")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="FootPrint パイプラインのベンチマーク")
+    sub = parser.add_subparsers(dest='stage', required=True)
+
+    p = sub.add_parser('analyze', help="analyze_raw_data の解析エンジン")
+    p.add_argument('--rows', type=int, default=10_000_000)
+    p.add_argument('--chunk-rows', type=int, default=analyze_engine.CHUNK_ROWS)
+    p.add_argument('--legacy', action='store_true', help="従来の行単位版も実行して比較する")
+    p.add_argument('--memory', action='store_true', help="tracemalloc でピークメモリを計測する")
+    p.set_defaults(func=bench_analyze)
+
+    p = sub.add_parser('scheduler', help="acquire_raw_data のスケジューラ (tick / hybrid / free)")
+    p.add_argument('--seconds', type=float, default=5.0)
+    p.add_argument('--rate', type=int, default=1000)
+    p.add_argument('--modes', nargs='+', default=['tick', 'hybrid', 'free'])
+    p.set_defaults(func=bench_scheduler)
+
+    p = sub.add_parser('plot', help="plot_analysis_results の描画 (raster / matplotlib)")
+    p.add_argument('--rows', type=int, default=3_600_000)
+    p.add_argument('--image', help="背景のコース画像 (省略時は白紙)")
+    p.add_argument('--no-matplotlib', dest='matplotlib', action='store_false', help="matplotlib 版を計測しない")
+    p.add_argument('--keep', help="出力画像を保存するディレクトリ")
+    p.set_defaults(func=bench_plot)
+
+    p = sub.add_parser('suite', help="合成周回データで 生成 / 取得 (再生) / 解析 / 描画 の全工程を計測")
+    p.add_argument('--seconds', type=float, default=600.0, help="合成データの走行時間 [s]")
+    p.add_argument('--rate', type=int, default=1000)
+    p.add_argument('--speed', type=float, default=150.0, help="走行速度 [cm/s]")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--image', help="背景のコース画像 (省略時は白紙)")
+    p.add_argument('--plot-engine', choices=['raster', 'matplotlib'], default='raster')
+    p.add_argument('--repeat', type=int, default=3, help="各工程の繰り返し回数 (最速の回を採用)")
+    p.add_argument('--no-memory', dest='memory', action='store_false', help="ピークメモリを計測しない")
+    p.add_argument('--output', help="結果を保存する JSON ファイル")
+    p.add_argument('--baseline', help="比較する前回の結果 (JSON)")
+    p.add_argument('--tolerance', type=float, default=SUITE_TOLERANCE, help="劣化とみなす変化率")
+    p.set_defaults(func=bench_suite)
+
+    p = sub.add_parser('telemetry', help="acquire_raw_data のテレメトリ配信 (別プロセスの購読者の代役に送る)")
+    p.add_argument('--seconds', type=float, default=5.0)
+    p.add_argument('--rate', type=int, default=1000)
+    p.add_argument('--batch-ms', type=float, default=5.0, help="サンプルをまとめる最大の待ち時間 [ms]")
+    p.add_argument('--slow-ms', type=float, default=0.0, help="購読者が1フレームごとに費やす時間 [ms] (遅い購読者の再現)")
+    p.add_argument('--address', help="配信先 (省略時は一時ディレクトリの Unix ドメインソケット、Windows では UDP)")
+    p.add_argument('--scheduler', choices=['tick', 'hybrid', 'free'], default='tick')
+    p.set_defaults(func=bench_telemetry)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+from typing import Final
+
+# =============================================================================
+# 定数定義クラス
+# =============================================================================
+#
+# FootPrint.py と各ツール (raw_format / synthetic_laps / reanalyze など) が共通で使う定数。
+# FootPrint.py (pygame) を読み込まずに参照できるよう、独立したモジュールにしている。
+
+
+class CourseConstants:
+    """画像のピクセルを基準にすべてのスケールを定義する"""
+    
+    # --- 1. ハードウェア設定 ---
+    DPI_SETTING: Final[int] = 800              
+    POLLING_RATE: Final[int] = 1000
+    
+    # 1ミッキーが何センチか (0.003175 cm)
+    MICKEY_TO_CM: Final[float] = 1/DPI_SETTING * 2.54      
+    
+    # --- 2. 画像と現実の対応 ---
+    # 画像1000px = 現実1000cm なので 1.0
+    CM_PER_PIXEL: Final[float] = 1.0 
+    
+    # ミッキー -> ピクセル変換係数
+    MICKEY_TO_PIXEL: Final[float] = MICKEY_TO_CM / CM_PER_PIXEL
+
+    # --- 3. スタート地点 (画像上のピクセル座標) ---
+    START_PX_X: Final[int] = 500  # 中心
+    START_PX_Y: Final[int] = 273  # 中心
@@ -0,0 +1,287 @@
+import csv
+import glob
+import os
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+# =============================================================================
+# コース形状 (CourseData_*.csv) とコース上/コース外の判定
+# =============================================================================
+#
+# Course Maker (App.jsx) が CourseImage_<日時>.jpg と一緒に書き出す CourseData_<日時>.csv を読み、
+# 各パーツを回転した長方形 (中心, 半長, 半幅, 回転角) の配列として持つ。
+#   - パーツの寸法は App.jsx の PART_TYPES と同じ (長さ 120 / 60 / 42 cm、幅 15 cm)
+#   - x, y はパーツ中心 [cm]、rotation は SVG の rotate と同じく画像上で時計回りの角度 [度]
+#
+# 判定は一様グリッドの空間インデックスで行う:
+#   - 各セルに、そのセルと外接矩形が重なるパーツの一覧 (CSR 形式) を持つ
+#   - セル全体が1つのパーツに含まれる「内側セル」は、点ごとの判定をせずにコース上とする
+#   - それ以外の点だけを (点, 候補パーツ) の組に展開し、まとめて回転長方形の内外判定をする
+
+PART_TYPES: Dict[str, Tuple[float, float]] = {
+    # 種類: (長さ, 幅) [cm]
+    'yellow': (120.0, 15.0),
+    'blue': (60.0, 15.0),
+    'green': (42.0, 15.0),
+}
+FIELD_SIZE_CM: Tuple[float, float] = (1000.0, 546.0)
+
+CELL_SIZE_CM: float = 10.0
+# (点, 候補パーツ) の組の展開はこの点数ずつ行い、メモリ使用量を抑える
+CONTAINS_CHUNK: int = 200_000
+
+OFFTRACK_EVENTS_NAME: str = "offtrack_events.csv"
+OFFTRACK_EVENT_COLUMNS = ['Start_s', 'End_s', 'Duration_s', 'Samples', 'Start_X_cm', 'Start_Y_cm', 'End_X_cm', 'End_Y_cm']
+
+
+class CourseLayout:
+    """パーツを回転長方形の配列として持つ"""
+
+    def __init__(self, names: List[str], types: List[str], x: np.ndarray, y: np.ndarray, rotation_deg: np.ndarray,
+                 source: Optional[str] = None):
+        unknown = sorted(set(types) - set(PART_TYPES))
+        if unknown:
+            raise ValueError(f"未対応のパーツ種類です: {', '.join(unknown)}")
+        self.names = names
+        self.types = types
+        self.source = source
+        self.cx = np.asarray(x, dtype=np.float64)
+        self.cy = np.asarray(y, dtype=np.float64)
+        self.rotation_deg = np.asarray(rotation_deg, dtype=np.float64)
+        rad = np.radians(self.rotation_deg)
+        self.cos = np.cos(rad)
+        self.sin = np.sin(rad)
+        self.half_length = np.array([PART_TYPES[t][0] / 2 for t in types], dtype=np.float64)
+        self.half_width = np.array([PART_TYPES[t][1] / 2 for t in types], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def corners(self) -> np.ndarray:
+        """各パーツの4隅 (N, 4, 2)。App.jsx の getCorners と同じ順序"""
+        lx = np.array([-1, 1, 1, -1], dtype=np.float64)[None, :] * self.half_length[:, None]
+        ly = np.array([-1, -1, 1, 1], dtype=np.float64)[None, :] * self.half_width[:, None]
+        x = self.cx[:, None] + lx * self.cos[:, None] - ly * self.sin[:, None]
+        y = self.cy[:, None] + lx * self.sin[:, None] + ly * self.cos[:, None]
+        return np.stack((x, y), axis=-1)
+
+    def bounds(self) -> np.ndarray:
+        """各パーツの外接矩形 (N, 4): xmin, ymin, xmax, ymax"""
+        c = self.corners()
+        return np.column_stack((c[:, :, 0].min(axis=1), c[:, :, 1].min(axis=1),
+                                c[:, :, 0].max(axis=1), c[:, :, 1].max(axis=1)))
+
+    def inside(self, part: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """点 (x, y) がパーツ part の長方形に含まれるか (境界を含む)。配列は同じ長さ"""
+        dx = x - self.cx[part]
+        dy = y - self.cy[part]
+        c = self.cos[part]; s = self.sin[part]
+        # パーツの局所座標 (長さ方向 u, 幅方向 v) に戻して比べる
+        u = dx * c + dy * s
+        v = -dx * s + dy * c
+        return (np.abs(u) <= self.half_length[part]) & (np.abs(v) <= self.half_width[part])
+
+
+def load_course_csv(path: str) -> CourseLayout:
+    """CourseData_*.csv (Name,type,x,y,rotation) を読み込む"""
+    names = []; types = []; xs = []; ys = []; rots = []
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            if not row.get('type'):
+                continue
+            names.append(row.get('Name') or f"Part_{len(names) + 1:03d}")
+            types.append(row['type'].strip())
+            xs.append(float(row['x'])); ys.append(float(row['y'])); rots.append(float(row['rotation']))
+    return CourseLayout(names, types, np.array(xs), np.array(ys), np.array(rots), source=path)
+
+
+def find_course_data(image_path: str) -> Optional[str]:
+    """CourseImage_<日時>.jpg と同じ日時の CourseData_<日時>.csv を探す"""
+    if not image_path:
+        return None
+    directory, name = os.path.split(image_path)
+    stem = os.path.splitext(name)[0]
+    if stem.startswith("CourseImage"):
+        candidate = os.path.join(directory, "CourseData" + stem[len("CourseImage"):] + ".csv")
+        if os.path.exists(candidate):
+            return candidate
+    # 対応が取れない場合は、画像と同じディレクトリで最新 (名前順で最後) のものを使う
+    candidates = sorted(glob.glob(os.path.join(directory, "CourseData*.csv")))
+    return candidates[-1] if candidates else None
+
+
+class GridIndex:
+    """一様グリッドによるパーツの空間インデックス"""
+
+    def __init__(self, layout: CourseLayout, cell_size: float = CELL_SIZE_CM):
+        self.layout = layout
+        self.cell_size = cell_size
+        n = len(layout)
+        if n == 0:
+            self.origin = (0.0, 0.0); self.shape = (0, 0)
+            self.cell_start = np.zeros(1, dtype=np.int64); self.cell_parts = np.zeros(0, dtype=np.int64)
+            self.cell_full = np.zeros(0, dtype=bool)
+            return
+
+        b = layout.bounds()
+        x0 = float(b[:, 0].min()); y0 = float(b[:, 1].min())
+        nx = int(np.floor((b[:, 2].max() - x0) / cell_size)) + 1
+        ny = int(np.floor((b[:, 3].max() - y0) / cell_size)) + 1
+        self.origin = (x0, y0)
+        self.shape = (ny, nx)
+
+        # パーツごとの外接矩形が覆うセルの範囲 -> (セル, パーツ) の組
+        i0 = np.floor((b[:, 0] - x0) / cell_size).astype(np.int64)
+        j0 = np.floor((b[:, 1] - y0) / cell_size).astype(np.int64)
+        i1 = np.minimum(np.floor((b[:, 2] - x0) / cell_size).astype(np.int64), nx - 1)
+        j1 = np.minimum(np.floor((b[:, 3] - y0) / cell_size).astype(np.int64), ny - 1)
+        wi = i1 - i0 + 1; wj = j1 - j0 + 1
+        counts = wi * wj
+        part = np.repeat(np.arange(n), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ci = i0[part] + k % wi[part]
+        cj = j0[part] + k // wi[part]
+        cell = cj * nx + ci
+
+        # セルの4隅がすべてパーツに含まれれば、そのセルは丸ごとコース上 (長方形は凸なので)
+        full = np.ones(len(cell), dtype=bool)
+        for ox in (0, 1):
+            for oy in (0, 1):
+                full &= layout.inside(part, x0 + (ci + ox) * cell_size, y0 + (cj + oy) * cell_size)
+        self.cell_full = np.zeros(nx * ny, dtype=bool)
+        self.cell_full[cell[full]] = True
+
+        order = np.argsort(cell, kind='stable')
+        self.cell_parts = part[order]
+        self.cell_start = np.concatenate(([0], np.cumsum(np.bincount(cell, minlength=nx * ny))))
+
+    def cells(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """点が属するセル番号。グリッド外は -1"""
+        ny, nx = self.shape
+        i = np.floor((x - self.origin[0]) / self.cell_size)
+        j = np.floor((y - self.origin[1]) / self.cell_size)
+        valid = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+        cell = np.full(len(x), -1, dtype=np.int64)
+        cell[valid] = j[valid].astype(np.int64) * nx + i[valid].astype(np.int64)
+        return cell
+
+    def contains(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """各点がいずれかのパーツ上にあるか (bool 配列)"""
+        x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+        result = np.zeros(len(x), dtype=bool)
+        if len(self.layout) == 0:
+            return result
+        for start in range(0, len(x), CONTAINS_CHUNK):
+            sl = slice(start, start + CONTAINS_CHUNK)
+            result[sl] = self._contains_chunk(x[sl], y[sl])
+        return result
+
+    def _contains_chunk(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        cell = self.cells(x, y)
+        valid = cell >= 0
+        result = np.zeros(len(x), dtype=bool)
+        result[valid] = self.cell_full[cell[valid]]
+
+        # 内側セルでもグリッド外でもない点だけを、候補パーツとの組に展開して判定する
+        idx = np.flatnonzero(valid & ~result)
+        if len(idx) == 0:
+            return result
+        c = cell[idx]
+        begin = self.cell_start[c]
+        counts = self.cell_start[c + 1] - begin
+        has = counts > 0
+        idx = idx[has]; begin = begin[has]; counts = counts[has]
+        if len(idx) == 0:
+            return result
+        point = np.repeat(np.arange(len(idx)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        part = self.cell_parts[begin[point] + k]
+        hit = self.layout.inside(part, x[idx[point]], y[idx[point]])
+        result[idx] = np.bincount(point, weights=hit, minlength=len(idx)) > 0
+        return result
+
+
+class TrackChecker:
+    """解析中の軌跡をチャンクごとに判定し、コース外イベントを集計する
+
+    位置は plot と同じ変換 (画像 x = スタート + ΣRel_Y, 画像 y = スタート - ΣRel_X) で求める。
+    """
+
+    def __init__(self, index: GridIndex, start_cm: Tuple[float, float], mickey_to_cm: float):
+        self.index = index
+        self.mickey_to_cm = mickey_to_cm
+        self.x = float(start_cm[0])
+        self.y = float(start_cm[1])
+        self.samples = 0
+        self.on_track_samples = 0
+        self.events: List[Dict[str, Any]] = []
+        self._open: Optional[Dict[str, Any]] = None
+
+    def update(self, ts: np.ndarray, dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
+        """1チャンク分の (Timestamp_s, Rel_X, Rel_Y) を判定し、各行のコース上フラグを返す"""
+        n = len(ts)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        x = self.x + np.cumsum(dy) * self.mickey_to_cm
+        y = self.y - np.cumsum(dx) * self.mickey_to_cm
+        self.x = float(x[-1]); self.y = float(y[-1])
+        on = self.index.contains(x, y)
+        self.samples += n
+        self.on_track_samples += int(on.sum())
+        self._collect_events(ts, x, y, on)
+        return on
+
+    def _collect_events(self, ts, x, y, on):
+        # コース外の連続区間 (前チャンクから続く区間も含む) を取り出す
+        off = (~on).astype(np.int8)
+        edges = np.diff(np.concatenate(([0], off, [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+        for s, e in zip(starts.tolist(), ends.tolist()):
+            if s == 0 and self._open is not None:
+                event = self._open
+            else:
+                self._close()
+                event = {'start_s': float(ts[s]), 'samples': 0,
+                         'start_x_cm': float(x[s]), 'start_y_cm': float(y[s])}
+            event['samples'] += e - s + 1
+            event.update({'end_s': float(ts[e]), 'end_x_cm': float(x[e]), 'end_y_cm': float(y[e])})
+            self._open = event
+            if e < len(on) - 1:
+                self._close()
+        if on[-1]:
+            self._close()
+
+    def _close(self):
+        if self._open is not None:
+            self._open['duration_s'] = self._open['end_s'] - self._open['start_s']
+            self.events.append(self._open)
+            self._open = None
+
+    def finish(self) -> Dict[str, Any]:
+        self._close()
+        return self.summary()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'course_data': self.index.layout.source, 'parts': len(self.index.layout),
+            'samples': self.samples, 'on_track_samples': self.on_track_samples,
+            'on_track_percent': self.on_track_samples / self.samples * 100 if self.samples else None,
+            'offtrack_events': len(self.events),
+            'offtrack_s': sum(e['duration_s'] for e in self.events),
+        }
+
+
+def create_track_checker(course_data_path: str, start_cm: Tuple[float, float], mickey_to_cm: float) -> TrackChecker:
+    return TrackChecker(GridIndex(load_course_csv(course_data_path)), start_cm, mickey_to_cm)
+
+
+def save_offtrack_events(path: str, events: List[Dict[str, Any]]):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(OFFTRACK_EVENT_COLUMNS)
+        for e in events:
+            writer.writerow([f"{e['start_s']:.4f}", f"{e['end_s']:.4f}", f"{e['duration_s']:.4f}", e['samples'],
+                             f"{e['start_x_cm']:.1f}", f"{e['start_y_cm']:.1f}",
+                             f"{e['end_x_cm']:.1f}", f"{e['end_y_cm']:.1f}"])
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from typing import Any, Dict, Tuple
+
+import course_geometry
+
+# =============================================================================
+# コースレイアウトの検証 (CourseData_*.csv)
+# =============================================================================
+#
+# Course Maker の checkCollisionSAT はドラッグ中のパーツと固定パーツの組しか調べないため、
+# 書き出したレイアウト全体を検証する。
+#   - 重なり     : 空間ハッシュ (一様グリッド) で外接矩形が同じセルに入る組だけを候補にし、
+#                  候補の組をまとめて NumPy で分離軸判定 (SAT) する。総当たり O(N^2) にならない
+#   - フィールド外: 4隅のいずれかが 1000 x 546 cm のフィールドからはみ出すパーツ
+#   - 未配置     : 中心が x < 0 (パーツ置き場) のパーツ。App.jsx と同様に重なり判定の対象外
+# 重なりは「どの軸でも投影が tolerance より深く重なる」組とする。App.jsx は辺が接しているだけでも
+# 衝突とみなすが、パーツを端同士でつないだレイアウトが誤検出されないよう、既定では接触は重なりに含めない。
+#
+# 実行例:
+#   py -3.12 course_validator.py CourseData_20251207_143200.csv
+#   py -3.12 course_validator.py CourseData_20251207_143200.csv --tolerance 0.5 --json report.json
+
+OVERLAP_TOLERANCE_CM: float = 0.0
+VALIDATION_NAME: str = "course_validation.json"
+# パーツの最大寸法 (黄 120 cm の対角線) より少し大きいセルにすると、1パーツあたりのセル数が数個で済む
+HASH_CELL_CM: float = 128.0
+
+
+def _axes(layout: course_geometry.CourseLayout, part: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """パーツの長さ方向・幅方向の単位ベクトル (M, 2) x 2"""
+    c = layout.cos[part]; s = layout.sin[part]
+    return np.column_stack((c, s)), np.column_stack((-s, c))
+
+
+def sat_overlap_depth(layout: course_geometry.CourseLayout, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """パーツの組 (a[k], b[k]) ごとの分離軸判定。戻り値は4軸での投影の重なりの最小値 [cm]
+
+    値が正なら重なっている (その深さ)、0 以下なら分離している (またはちょうど接している)。
+    """
+    ua, va = _axes(layout, a)
+    ub, vb = _axes(layout, b)
+    hla = layout.half_length[a][:, None]; hwa = layout.half_width[a][:, None]
+    hlb = layout.half_length[b][:, None]; hwb = layout.half_width[b][:, None]
+    d = np.column_stack((layout.cx[b] - layout.cx[a], layout.cy[b] - layout.cy[a]))
+
+    # 候補軸 (M, 4, 2): a の2軸 + b の2軸
+    axes = np.stack((ua, va, ub, vb), axis=1)
+
+    def radius(u, v, hl, hw):
+        # 長方形を軸へ投影したときの半径 = hl |u・axis| + hw |v・axis|
+        return (hl * np.abs(np.einsum('mk,mak->ma', u, axes))
+                + hw * np.abs(np.einsum('mk,mak->ma', v, axes)))
+
+    distance = np.abs(np.einsum('mk,mak->ma', d, axes))
+    overlap = radius(ua, va, hla, hwa) + radius(ub, vb, hlb, hwb) - distance
+    return overlap.min(axis=1)
+
+
+def candidate_pairs(bounds: np.ndarray, cell_size: float = HASH_CELL_CM) -> np.ndarray:
+    """外接矩形 (N, 4) が同じハッシュセルに入り、かつ外接矩形同士が重なる組 (i < j) を (M, 2) で返す"""
+    n = len(bounds)
+    if n < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    i0 = np.floor(bounds[:, 0] / cell_size).astype(np.int64)
+    j0 = np.floor(bounds[:, 1] / cell_size).astype(np.int64)
+    i1 = np.floor(bounds[:, 2] / cell_size).astype(np.int64)
+    j1 = np.floor(bounds[:, 3] / cell_size).astype(np.int64)
+    wi = i1 - i0 + 1; wj = j1 - j0 + 1
+    counts = wi * wj
+    part = np.repeat(np.arange(n), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ci = i0[part] + k % wi[part]
+    cj = j0[part] + k // wi[part]
+    # セル座標は負にもなり得るため、ずらしてから1つの整数キーに詰める
+    ci -= ci.min(); cj -= cj.min()
+    cell = cj * (int(ci.max()) + 1) + ci
+
+    order = np.lexsort((part, cell))
+    cell = cell[order]; part = part[order]
+    # 同じセル内の後ろの要素すべてと組にする
+    group_end = np.searchsorted(cell, cell, side='right')
+    later = group_end - np.arange(len(cell)) - 1
+    first = np.repeat(np.arange(len(cell)), later)
+    offset = np.arange(later.sum()) - np.repeat(np.cumsum(later) - later, later)
+    a = part[first]; b = part[first + 1 + offset]
+
+    # 複数のセルで同じ組が出るため、重複を除く
+    key = np.unique(np.minimum(a, b) * n + np.maximum(a, b))
+    a = key // n; b = key % n
+    aabb = ((bounds[a, 0] <= bounds[b, 2]) & (bounds[b, 0] <= bounds[a, 2])
+            & (bounds[a, 1] <= bounds[b, 3]) & (bounds[b, 1] <= bounds[a, 3]))
+    return np.column_stack((a[aabb], b[aabb]))
+
+
+def validate_layout(layout: course_geometry.CourseLayout, tolerance: float = OVERLAP_TOLERANCE_CM,
+                    field: Tuple[float, float] = course_geometry.FIELD_SIZE_CM) -> Dict[str, Any]:
+    """重なり・フィールド外・未配置のパーツを調べ、各工程の所要時間とともに返す"""
+    timings = {}
+    t0 = time.perf_counter()
+    n = len(layout)
+    placed = np.flatnonzero(layout.cx >= 0)
+    unplaced = np.flatnonzero(layout.cx < 0)
+    bounds = layout.bounds()
+    # はみ出し量: 各辺ごとの超過の最大値
+    excess = np.maximum.reduce([-bounds[:, 0], -bounds[:, 1], bounds[:, 2] - field[0], bounds[:, 3] - field[1]])
+    outside = placed[excess[placed] > 0]
+    t1 = time.perf_counter(); timings['bounds_s'] = t1 - t0
+
+    pairs = candidate_pairs(bounds[placed])
+    pairs = placed[pairs] if len(pairs) else pairs
+    t2 = time.perf_counter(); timings['spatial_hash_s'] = t2 - t1
+
+    depth = sat_overlap_depth(layout, pairs[:, 0], pairs[:, 1]) if len(pairs) else np.zeros(0)
+    hit = depth > tolerance
+    t3 = time.perf_counter(); timings['sat_s'] = t3 - t2
+    timings['total_s'] = t3 - t0
+
+    names = layout.names
+    overlaps = [
+        {'a': names[i], 'b': names[j], 'type_a': layout.types[i], 'type_b': layout.types[j], 'depth_cm': float(d)}
+        for i, j, d in zip(pairs[hit, 0].tolist(), pairs[hit, 1].tolist(), depth[hit].tolist())
+    ]
+    overlaps.sort(key=lambda o: o['depth_cm'], reverse=True)
+    return {
+        'course_data': layout.source, 'parts': n, 'placed_parts': len(placed),
+        'all_pairs': len(placed) * (len(placed) - 1) // 2, 'candidate_pairs': len(pairs),
+        'tolerance_cm': tolerance,
+        'overlaps': overlaps,
+        'outside_field': [{'name': names[i], 'type': layout.types[i], 'excess_cm': float(excess[i])}
+                          for i in outside.tolist()],
+        'unplaced': [names[i] for i in unplaced.tolist()],
+        'timings': timings,
+        'ok': not overlaps and not len(outside),
+    }
+
+
+def print_report(report: Dict[str, Any], max_items: int = 10):
+    t = report['timings']
+    name = os.path.basename(report['course_data']) if report['course_data'] else "-"
+    print(f"🧩 レイアウト検証: {name} ({report['placed_parts']} / {report['parts']} パーツ配置済み)")
+    print(f"   候補の組: {report['candidate_pairs']:,} / 総当たり {report['all_pairs']:,} "
+          f"(空間ハッシュ {t['spatial_hash_s'] * 1000:.2f} ms, SAT {t['sat_s'] * 1000:.2f} ms, 計 {t['total_s'] * 1000:.2f} ms)")
+    for o in report['overlaps'][:max_items]:
+        print(f"   ⚠️ 重なり: {o['a']} ({o['type_a']}) と {o['b']} ({o['type_b']}) 深さ {o['depth_cm']:.1f} cm")
+    for o in report['outside_field'][:max_items]:
+        print(f"   ⚠️ フィールド外: {o['name']} ({o['type']}) はみ出し {o['excess_cm']:.1f} cm")
+    hidden = max(0, len(report['overlaps']) - max_items) + max(0, len(report['outside_field']) - max_items)
+    if hidden:
+        print(f"   ... ほか {hidden} 件")
+    if report['unplaced']:
+        print(f"   ℹ️ パーツ置き場に残っているパーツ: {len(report['unplaced'])} 個 (検証対象外)")
+    if report['ok']:
+        print("   ✅ 重なり・はみ出しなし")
+    else:
+        print(f"   ❌ 重なり {len(report['overlaps'])} 組 / フィールド外 {len(report['outside_field'])} 個")
+
+
+def validate_file(path: str, tolerance: float = OVERLAP_TOLERANCE_CM) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    layout = course_geometry.load_course_csv(path)
+    load_s = time.perf_counter() - t0
+    report = validate_layout(layout, tolerance)
+    report['timings']['load_s'] = load_s
+    return report
+
+
+def save_report(path: str, report: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="CourseData_*.csv のパーツの重なりとフィールド外へのはみ出しを検証する")
+    parser.add_argument('course_data', help="Course Maker が書き出した CourseData_*.csv")
+    parser.add_argument('--tolerance', type=float, default=OVERLAP_TOLERANCE_CM,
+                        help="この深さ [cm] 以下の重なりは無視する (既定: 0 = 接しているだけなら可)")
+    parser.add_argument('--json', help="検証結果を保存する JSON ファイル")
+    args = parser.parse_args(argv)
+
+    try:
+        report = validate_file(args.course_data, args.tolerance)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ コースデータを読み込めません: {e}")
+        return 2
+    print_report(report)
+    if args.json:
+        save_report(args.json, report)
+    return 0 if report['ok'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import analyze_engine
+import raw_format
+import run_store
+
+# =============================================================================
+# 複数セッションの滞在ヒートマップ (コース画像ごとに追記で更新)
+# =============================================================================
+#
+# 何百枚もの trajectory_plot.png を matplotlib で重ね直す代わりに、コース画像と同じ解像度 (1 px = 1 cm) の
+# 2次元ヒストグラムをコース画像ごとに Log/heatmaps/heatmap_<画像のハッシュ>.npz として持ち続ける。
+#   - 値は滞在時間 [s]。各サンプルの位置に、次のサンプルまでの時間 (MAX_SAMPLE_DT_S で頭打ち) を積む
+#   - 新しいセッションは生データをチャンクごとに np.bincount で一度に加算する。取り込み済みのセッションは読まない
+#   - 全体の合計 (counts) のほかにセッションごとの寄与を疎な形 (セル番号と時間) で持つため、
+#     マウスや期間で絞った図や、2つの条件の差分 (それぞれの合計を 1 に正規化した滞在割合の差) も生データなしで作れる
+# 対象のセッションと定数 (DPI・スタート地点) は実行記録 (run_store) から取る。
+#
+# 実行例:
+#   py -3.12 heatmap.py update                                   (未集計のセッションを加算)
+#   py -3.12 heatmap.py render --mouse G304 --since 2025-12-01
+#   py -3.12 heatmap.py diff --a-mouse G304 --b-mouse G305
+#   py -3.12 heatmap.py diff --a-until 2025-12-01 --b-since 2025-12-01
+
+HEATMAP_DIR_NAME: str = "heatmaps"
+HEATMAP_NAME: str = "heatmap_{}.npz"
+HEATMAP_PLOT_NAME: str = "heatmap_{}.png"
+DIFF_PLOT_NAME: str = "heatmap_diff_{}.png"
+# 止まっている間や記録の途切れを1サンプルに大きく積まないための上限 [s]
+MAX_SAMPLE_DT_S: float = 0.05
+# 描画前に掛ける箱型の平滑化の半径 [px] (差分の画素単位のばらつきを抑える)
+SMOOTH_RADIUS_PX: int = 2
+# 画像の無いセッション (白紙に描いたもの) をまとめるキー
+BLANK_IMAGE_KEY: str = "blank"
+
+
+def session_occupancy(raw_path: str, constants: Dict[str, Any], width: int,
+                      height: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    """1セッションの生データを (セル番号 int32, 滞在時間 float32, 合計 [s]) にする (画像外のサンプルは除く)"""
+    mickey_to_px = constants['mickey_to_cm'] / constants['cm_per_pixel']
+    x0 = float(constants['start_px_x']); y0 = float(constants['start_px_y'])
+    dense = np.zeros(width * height, dtype=np.float64)
+    pending_cell, pending_ts = -1, None
+    for ts, dx, dy in analyze_engine.iter_raw_chunks(raw_path):
+        if not len(ts):
+            continue
+        # plot と同じ変換: 画像 x = スタート + ΣRel_Y, 画像 y = スタート - ΣRel_X
+        x = x0 + np.cumsum(dy) * mickey_to_px
+        y = y0 - np.cumsum(dx) * mickey_to_px
+        x0 = float(x[-1]); y0 = float(y[-1])
+        col = np.floor(x).astype(np.int64); row = np.floor(y).astype(np.int64)
+        inside = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+        cell = np.where(inside, row * width + col, -1)
+        # サンプル i の位置には次のサンプルまでの時間を積む。前のチャンクの最後のサンプルはこのチャンクの先頭までの時間
+        if pending_cell >= 0:
+            dense[pending_cell] += min(max(float(ts[0]) - pending_ts, 0.0), MAX_SAMPLE_DT_S)
+        dt = np.clip(np.diff(ts), 0.0, MAX_SAMPLE_DT_S)
+        keep = inside[:-1]
+        dense += np.bincount(cell[:-1][keep], weights=dt[keep], minlength=width * height)
+        pending_cell, pending_ts = int(cell[-1]), float(ts[-1])
+    cells = np.flatnonzero(dense)
+    return cells.astype(np.int32), dense[cells].astype(np.float32), float(dense.sum())
+
+
+def smooth(values: np.ndarray, radius: int = SMOOTH_RADIUS_PX) -> np.ndarray:
+    """(2 radius + 1)^2 の箱型平均 (累積和で縦横に分けて計算する)"""
+    if radius <= 0:
+        return values
+    k = 2 * radius + 1
+    out = values
+    for axis in (0, 1):
+        padded = np.pad(out, [(radius, radius) if a == axis else (0, 0) for a in (0, 1)], mode='edge')
+        c = np.cumsum(padded, axis=axis, dtype=np.float64)
+        c = np.concatenate((np.zeros_like(np.take(c, [0], axis=axis)), c), axis=axis)
+        n = out.shape[axis]
+        out = (np.take(c, np.arange(k, k + n), axis=axis) - np.take(c, np.arange(n), axis=axis)) / k
+    return out
+
+
+class OccupancyHeatmap:
+    """1つのコース画像に対する滞在時間のヒストグラムと、セッションごとの寄与"""
+
+    def __init__(self, image: str, image_sha256: str, width: int, height: int):
+        self.image = image
+        self.image_sha256 = image_sha256
+        self.width = width
+        self.height = height
+        self.counts = np.zeros(width * height, dtype=np.float64)
+        self.keys = np.zeros(0, dtype=str)
+        self.mice = np.zeros(0, dtype=str)
+        self.started_at = np.zeros(0, dtype='datetime64[s]')
+        self.seconds = np.zeros(0, dtype=np.float64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.cells = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def load(cls, path: str) -> 'OccupancyHeatmap':
+        with np.load(path) as z:
+            heatmap = cls(str(z['image']), str(z['image_sha256']), int(z['width']), int(z['height']))
+            for name in ('counts', 'keys', 'mice', 'started_at', 'seconds', 'offsets', 'cells', 'weights'):
+                setattr(heatmap, name, z[name])
+        return heatmap
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 途中で中断されても壊れたファイルを残さないよう、書き終えてから置き換える
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, image=self.image, image_sha256=self.image_sha256, width=self.width,
+                                height=self.height, counts=self.counts, keys=self.keys, mice=self.mice,
+                                started_at=self.started_at, seconds=self.seconds, offsets=self.offsets,
+                                cells=self.cells, weights=self.weights)
+        os.replace(tmp_path, path)
+
+    def __contains__(self, key: str) -> bool:
+        return bool(np.any(self.keys == key))
+
+    def add(self, key: str, mouse: str, started_at: np.datetime64, cells: np.ndarray, weights: np.ndarray,
+            seconds: float):
+        self.counts += np.bincount(cells, weights=weights, minlength=len(self.counts))
+        self.keys = np.append(self.keys, key)
+        self.mice = np.append(self.mice, mouse)
+        self.started_at = np.append(self.started_at, np.datetime64(started_at, 's'))
+        self.seconds = np.append(self.seconds, seconds)
+        self.offsets = np.append(self.offsets, self.offsets[-1] + len(cells))
+        self.cells = np.concatenate((self.cells, cells.astype(np.int32)))
+        self.weights = np.concatenate((self.weights, weights.astype(np.float32)))
+
+    def select(self, mouse=None, since=None, until=None) -> np.ndarray:
+        """条件に合うセッションの番号。since は含み、until は含まない"""
+        mask = np.ones(len(self.keys), dtype=bool)
+        if mouse is not None:
+            mask &= np.isin(self.mice, mouse if isinstance(mouse, (list, tuple)) else [mouse])
+        if since is not None:
+            mask &= self.started_at >= np.datetime64(since, 's')
+        if until is not None:
+            mask &= self.started_at < np.datetime64(until, 's')
+        return np.flatnonzero(mask)
+
+    def histogram(self, sessions: Optional[np.ndarray] = None) -> np.ndarray:
+        """セッション (省略時は全体) の滞在時間 (H, W) [s]"""
+        if sessions is None:
+            return self.counts.reshape(self.height, self.width)
+        counts = self.offsets[sessions + 1] - self.offsets[sessions]
+        # 選んだセッションの区間を1本の添字列に展開する
+        index = np.repeat(self.offsets[sessions], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        hist = np.bincount(self.cells[index], weights=self.weights[index], minlength=self.width * self.height)
+        return hist.reshape(self.height, self.width)
+
+
+def heatmap_path(log_root: str, image_sha256: Optional[str]) -> str:
+    name = image_sha256[:12] if image_sha256 else BLANK_IMAGE_KEY
+    return os.path.join(log_root, HEATMAP_DIR_NAME, HEATMAP_NAME.format(name))
+
+
+def _find_raw(session_dir: str) -> Optional[str]:
+    # 両方ある場合 (変換済み) は読むのが速いバイナリ形式を使う
+    for name in (raw_format.RAW_BINARY_NAME, raw_format.RAW_CSV_NAME):
+        path = os.path.join(session_dir, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _image_size(image_dir: str, image: str) -> Tuple[int, int]:
+    import rasterizer
+
+    path = os.path.join(image_dir, image) if image else None
+    h, w = rasterizer.load_course_image(path).shape[:2]
+    return w, h
+
+
+def update(log_root: str, image_dir: str) -> List[Dict[str, Any]]:
+    """実行記録にあって、ヒートマップに未集計のセッションを加算する (コース画像ごと)"""
+    store = run_store.RunStore(os.path.join(log_root, run_store.STORE_DIR_NAME))
+    store.ingest(run_store.find_session_dirs(log_root))
+    c = store.columns
+    results = []
+    for sha in np.unique(c['course_image_sha256']).tolist():
+        rows = np.flatnonzero(c['course_image_sha256'] == sha)
+        path = heatmap_path(log_root, sha)
+        if os.path.exists(path):
+            heatmap = OccupancyHeatmap.load(path)
+        else:
+            image = str(c['course_image'][rows[0]])
+            heatmap = OccupancyHeatmap(image, sha, *_image_size(image_dir, image))
+        t0 = time.perf_counter()
+        added = 0
+        for i in rows:
+            key = str(c['key'][i])
+            raw_path = _find_raw(os.path.join(log_root, key))
+            if key in heatmap or raw_path is None:
+                continue
+            constants = {name: c[name][i].item() for name in ('mickey_to_cm', 'cm_per_pixel', 'start_px_x', 'start_px_y')}
+            cells, weights, seconds = session_occupancy(raw_path, constants, heatmap.width, heatmap.height)
+            heatmap.add(key, str(c['mouse'][i]), c['started_at'][i], cells, weights, seconds)
+            added += 1
+        if added:
+            heatmap.save(path)
+        results.append({'image': heatmap.image or BLANK_IMAGE_KEY, 'path': path, 'added': added,
+                        'sessions': len(heatmap.keys), 'seconds': time.perf_counter() - t0})
+    return results
+
+
+def _describe(mouse, since, until) -> str:
+    parts = [",".join(mouse) if mouse else "all"]
+    if since or until:
+        parts.append(f"{since or ''}~{until or ''}")
+    return " ".join(parts)
+
+
+def main(argv=None) -> int:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="複数セッションの滞在ヒートマップの更新と描画")
+    parser.add_argument('--log-root', default=os.path.join(base_dir, "Log"), help="Log ディレクトリ")
+    parser.add_argument('--image', help="対象のコース画像のファイル名 (省略時は現在のコース画像)")
+    parser.add_argument('-o', '--output', help="保存する PNG (省略時は Log/heatmaps/ 以下)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('update', help="未集計のセッションを加算する")
+    p = sub.add_parser('render', help="滞在ヒートマップをコース画像に重ねて描く")
+    p.add_argument('--mouse', action='append', help="対象のマウス名 (複数指定可)")
+    p.add_argument('--since', help="この日時以降に開始したセッション (例: 2025-12-01)")
+    p.add_argument('--until', help="この日時より前に開始したセッション")
+    p = sub.add_parser('diff', help="2つの条件の滞在割合の差を描く (A が多い所は赤、B が多い所は青)")
+    for side in ('a', 'b'):
+        p.add_argument(f'--{side}-mouse', action='append', help=f"{side.upper()} のマウス名 (複数指定可)")
+        p.add_argument(f'--{side}-since', help=f"{side.upper()} の期間の開始")
+        p.add_argument(f'--{side}-until', help=f"{side.upper()} の期間の終了 (含まない)")
+    args = parser.parse_args(argv)
+
+    import rasterizer
+
+    try:
+        if args.command == 'update':
+            for r in update(args.log_root, base_dir):
+                print(f"🔥 {r['image']}: {r['added']} セッションを加算 (計 {r['sessions']} セッション, {r['seconds']:.2f} s)")
+            return 0
+        image_path = os.path.join(base_dir, args.image) if args.image else run_store.find_course_image(base_dir)
+        sha = run_store.file_sha256(image_path) if os.path.exists(image_path) else None
+        path = heatmap_path(args.log_root, sha)
+        if not os.path.exists(path):
+            print(f"❌ {os.path.basename(image_path)} のヒートマップがありません (先に update を実行してください)")
+            return 1
+        heatmap = OccupancyHeatmap.load(path)
+        image = rasterizer.load_course_image(image_path if sha else None)
+        stem = os.path.splitext(os.path.basename(image_path))[0] if sha else BLANK_IMAGE_KEY
+
+        if args.command == 'render':
+            sessions = heatmap.select(args.mouse, args.since, args.until)
+            values = smooth(heatmap.histogram(sessions))
+            title = f"Occupancy: {_describe(args.mouse, args.since, args.until)} ({len(sessions)} sessions)"
+            out = args.output or os.path.join(os.path.dirname(path), HEATMAP_PLOT_NAME.format(stem))
+            rasterizer.save_png(rasterizer.render_heatmap(image, values, title), out)
+        else:
+            a = heatmap.select(args.a_mouse, args.a_since, args.a_until)
+            b = heatmap.select(args.b_mouse, args.b_since, args.b_until)
+            if not len(a) or not len(b):
+                print(f"❌ 条件に合うセッションがありません (A: {len(a)} / B: {len(b)})")
+                return 1
+            # セッション数や走行時間の違いを打ち消すため、それぞれの合計を 1 にしてから引く
+            hist_a = smooth(heatmap.histogram(a)); hist_b = smooth(heatmap.histogram(b))
+            diff = hist_a / max(hist_a.sum(), 1e-12) - hist_b / max(hist_b.sum(), 1e-12)
+            title = (f"A: {_describe(args.a_mouse, args.a_since, args.a_until)} ({len(a)}, red) - "
+                     f"B: {_describe(args.b_mouse, args.b_since, args.b_until)} ({len(b)}, blue)")
+            out = args.output or os.path.join(os.path.dirname(path), DIFF_PLOT_NAME.format(stem))
+            rasterizer.save_png(rasterizer.render_difference(image, diff, title), out)
+        print(f"🖼️ ヒートマップ保存完了: {out}")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ ヒートマップを処理できません: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import glob
+import json
+import os
+import re
+import select
+import sys
+import threading
+import time
+import numpy as np
+import pygame
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+import raw_format
+import raw_writer
+import scheduler
+import synthetic_laps
+
+try:
+    import evdev
+    from evdev import ecodes
+except ImportError:
+    evdev = None
+    ecodes = None
+
+# =============================================================================
+# 入力ソース (移動量の取得元)
+# =============================================================================
+#
+#   pygame    : 従来どおり pygame.mouse.get_rel() (free スケジューラでは MOUSEMOTION の合算)。
+#               pygame は全てのポインティングデバイスの移動量を1つにまとめてしまう
+#   evdev     : Linux の /dev/input/event* を直接読む。センサーごとに専用スレッドで読み取るため、
+#               複数センサーの移動量を個別に記録できる (要 `pip install evdev` と読み取り権限)
+#   synthetic : 合成周回データ (synthetic_laps) を実時間で流す仮想センサー。実機なしの動作確認用
+#
+# evdev / synthetic ではデバイスごとに DeviceStream を持ち、
+#   - 読み取りスレッド -> 事前確保バッファ -> 専用の書き込みスレッド (raw_writer) -> raw_data_<デバイス>.log
+# と流す。デバイス同士は読み取りも書き込みも独立しているため、センサーを増やしても
+# 他のセンサーの読み取りやポーリングループが待たされることはない。
+# ポーリングループは先頭のデバイス (primary) の移動量を poll() で受け取り、従来どおり raw_data.log に記録する。
+# デバイスの一覧と各ストリームの件数は devices.json に保存する。
+
+INPUT_SOURCES = ('pygame', 'evdev', 'synthetic')
+DEVICES_NAME: str = "devices.json"
+DEVICE_BUFFER_SIZE: int = 1000
+SYNTHETIC_SENSORS: int = 2
+# evdev の読み取りスレッドが停止要求を確認する間隔
+_SELECT_TIMEOUT_S: float = 0.1
+# 読み取りスレッドがある間の GIL の切り替え間隔。既定の 5 ms のままだと、ポーリングループが
+# スピン待ちしている間は読み取りスレッドが最大 5 ms 待たされ、センサーのサンプルがまとめて届いてしまう
+THREAD_SWITCH_INTERVAL_S: float = 0.0002
+
+
+def device_stream_path(output_dir: str, device_name: str, binary: bool) -> str:
+    """デバイスごとのストリームファイル名 (raw_data_<デバイス名>.log / .bin)"""
+    safe = re.sub(r'[^0-9A-Za-z_.-]', '_', device_name)
+    base, ext = os.path.splitext(raw_format.RAW_BINARY_NAME if binary else raw_format.RAW_CSV_NAME)
+    return os.path.join(output_dir, f"{base}_{safe}{ext}")
+
+
+class DeviceStream:
+    """1デバイス分の移動量をタイムスタンプ付きで記録し、未読の移動量をポーリングループに渡す"""
+
+    def __init__(self, name: str, path: str, binary: bool, header: Dict[str, Any], start_ns: int,
+                 policy: str = 'block', info: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.path = path
+        self.info = info or {}
+        self.start_ns = start_ns
+        self.total_x = 0
+        self.total_y = 0
+        self.samples = 0
+        self._writer = raw_writer.RawLogWriter(path, binary, header, DEVICE_BUFFER_SIZE, policy=policy)
+        self._buf = self._writer.acquire_buffer()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._pending_x = 0
+        self._pending_y = 0
+
+    def add(self, dx: int, dy: int, t_ns: int):
+        """読み取りスレッドから呼ぶ。t_ns は time.perf_counter_ns() の値"""
+        self.total_x += dx
+        self.total_y += dy
+        self._buf[self._count] = ((t_ns - self.start_ns) / 1e9, dx, dy, self.total_x, self.total_y)
+        self._count += 1
+        self.samples += 1
+        if self._count == DEVICE_BUFFER_SIZE:
+            self._buf = self._writer.submit(self._buf, self._count)
+            self._count = 0
+        with self._lock:
+            self._pending_x += dx
+            self._pending_y += dy
+
+    def take(self) -> Tuple[int, int]:
+        """前回の呼び出しから溜まった移動量を返す (ポーリングループから呼ぶ)"""
+        with self._lock:
+            dx, dy = self._pending_x, self._pending_y
+            self._pending_x = 0
+            self._pending_y = 0
+        return dx, dy
+
+    def close(self):
+        self._writer.close(self._buf, self._count)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {'name': self.name, 'file': os.path.basename(self.path), 'samples': self.samples,
+                 'total_x': self.total_x, 'total_y': self.total_y, 'writer': self._writer.stats()}
+        stats.update(self.info)
+        return stats
+
+
+class PygameSource:
+    """従来の pygame による取得 (全デバイスの合算)"""
+    name = 'pygame'
+
+    def __init__(self, context: Dict[str, Any]):
+        self.context = context
+
+    def start(self, start_ns: int):
+        pass
+
+    def poll(self, events: list, drains_motion: bool) -> Tuple[int, int]:
+        if drains_motion:
+            return scheduler.sum_motion(events)
+        return pygame.mouse.get_rel()
+
+    def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {'source': self.name, 'devices': []}
+
+
+class _ThreadedSource(ABC):
+    """デバイスごとに読み取りスレッドと DeviceStream を持つ入力ソースの共通部分"""
+    name = ''
+
+    def __init__(self, context: Dict[str, Any]):
+        self.context = context
+        self.streams: List[DeviceStream] = []
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._errors: List[str] = []
+        self._switch_interval: Optional[float] = None
+
+    @abstractmethod
+    def _devices(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """(デバイス名, devices.json に残す情報) の一覧"""
+
+    @abstractmethod
+    def _read_loop(self, index: int, stream: DeviceStream):
+        """1デバイス分の読み取りループ (専用スレッドで実行され、self._stop が立つまで stream に書き足す)"""
+
+    def start(self, start_ns: int):
+        binary = self.context['raw_format'] == 'binary'
+        header = raw_format.default_header()
+        devices = self._devices()
+        if not devices:
+            raise RuntimeError(f"入力デバイスが見つかりません ({self.name})")
+        for name, info in devices:
+            path = device_stream_path(self.context['output_dir'], name, binary)
+            self.streams.append(DeviceStream(name, path, binary, header, start_ns,
+                                             self.context.get('backpressure', 'block'), info))
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, THREAD_SWITCH_INTERVAL_S))
+        for index, stream in enumerate(self.streams):
+            thread = threading.Thread(target=self._run, args=(index, stream), name=f"Input-{stream.name}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self, index: int, stream: DeviceStream):
+        try:
+            self._read_loop(index, stream)
+        except Exception as e:
+            self._errors.append(f"{stream.name}: {e}")
+
+    def poll(self, events: list, drains_motion: bool) -> Tuple[int, int]:
+        return self.streams[0].take()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        for stream in self.streams:
+            stream.close()
+        if self._switch_interval is not None:
+            sys.setswitchinterval(self._switch_interval)
+            self._switch_interval = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'source': self.name, 'devices': [s.stats() for s in self.streams], 'errors': list(self._errors)}
+
+
+class EvdevSource(_ThreadedSource):
+    """Linux evdev の複数デバイスを、デバイスごとのスレッドで同時に読む"""
+    name = 'evdev'
+
+    def __init__(self, context: Dict[str, Any], device_paths: Optional[List[str]] = None):
+        super().__init__(context)
+        if evdev is None:
+            raise RuntimeError("evdev 入力には python-evdev が必要です (pip install evdev)")
+        self.device_paths = device_paths or find_evdev_mice()
+        self._devs = []
+
+    def _devices(self):
+        devices = []
+        for path in self.device_paths:
+            dev = evdev.InputDevice(path)
+            self._devs.append(dev)
+            devices.append((os.path.basename(path), {'path': path, 'device_name': dev.name, 'phys': dev.phys}))
+        return devices
+
+    def _read_loop(self, index: int, stream: DeviceStream):
+        dev = self._devs[index]
+        dx = 0
+        dy = 0
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([dev.fd], [], [], _SELECT_TIMEOUT_S)
+                if not ready:
+                    continue
+                for event in dev.read():
+                    if event.type == ecodes.EV_REL:
+                        if event.code == ecodes.REL_X:
+                            dx += event.value
+                        elif event.code == ecodes.REL_Y:
+                            dy += event.value
+                    elif event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+                        # 1レポート (= センサーの1回のポーリング) を1サンプルとして記録する
+                        if dx or dy:
+                            stream.add(dx, dy, time.perf_counter_ns())
+                            dx = 0
+                            dy = 0
+        finally:
+            dev.close()
+
+
+def find_evdev_mice() -> List[str]:
+    """REL_X / REL_Y を持つ /dev/input/event* を列挙する (読み取り権限のあるものだけ)"""
+    if evdev is None:
+        return []
+    paths = []
+    for path in sorted(glob.glob('/dev/input/event*'), key=lambda p: int(re.sub(r'\D', '', p) or 0)):
+        try:
+            dev = evdev.InputDevice(path)
+        except OSError:
+            continue
+        rel = dev.capabilities().get(ecodes.EV_REL, [])
+        if ecodes.REL_X in rel and ecodes.REL_Y in rel:
+            paths.append(path)
+        dev.close()
+    return paths
+
+
+class SyntheticSource(_ThreadedSource):
+    """合成周回データを実時間で流す仮想センサー (センサーごとにノイズの乱数系列が異なる)"""
+    name = 'synthetic'
+
+    def __init__(self, context: Dict[str, Any], sensors: int = SYNTHETIC_SENSORS, rate: int = 1000,
+                 speed_cm_s: Optional[float] = None, noise_mickey: float = 0.5):
+        super().__init__(context)
+        self.sensors = sensors
+        self.rate = rate
+        self.speed_cm_s = speed_cm_s
+        self.noise_mickey = noise_mickey
+
+    def _devices(self):
+        return [(f"synthetic{i}", {'rate': self.rate}) for i in range(self.sensors)]
+
+    def _read_loop(self, index: int, stream: DeviceStream):
+        from course_constants import CourseConstants
+
+        path = synthetic_laps.LapPath()
+        speed = self.speed_cm_s or synthetic_laps.DEFAULT_SPEED_CM_S
+        rng = np.random.default_rng(index)
+        period_ns = 1_000_000_000 // self.rate
+        next_ns = stream.start_ns
+        prev_x = 0
+        prev_y = 0
+        while not self._stop.is_set():
+            # 寝過ごしが積み重ならないよう、開始時刻からの期限に合わせて眠る
+            next_ns += period_ns
+            delay = next_ns - time.perf_counter_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+            t_ns = time.perf_counter_ns()
+            x, y = path.positions(np.array([speed * (t_ns - stream.start_ns) / 1e9]))
+            noise = rng.normal(0.0, self.noise_mickey, 2) if self.noise_mickey else (0.0, 0.0)
+            # 画像 x = +Total_Y, 画像 y = -Total_X (plot と同じ対応)
+            tx = int(round(-y[0] / CourseConstants.MICKEY_TO_CM + noise[0]))
+            ty = int(round(x[0] / CourseConstants.MICKEY_TO_CM + noise[1]))
+            if tx != prev_x or ty != prev_y:
+                stream.add(tx - prev_x, ty - prev_y, t_ns)
+                prev_x = tx
+                prev_y = ty
+
+
+def create_source(context: Dict[str, Any]):
+    name = context.get('input', 'pygame')
+    if name == 'pygame':
+        return PygameSource(context)
+    if name == 'evdev':
+        return EvdevSource(context, context.get('devices'))
+    if name == 'synthetic':
+        return SyntheticSource(context, context.get('synthetic_sensors', SYNTHETIC_SENSORS))
+    raise ValueError(f"未対応の入力ソースです: {name}")
+
+
+def save_devices(path: str, stats: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
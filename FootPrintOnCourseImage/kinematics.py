@@ -0,0 +1,269 @@
+import argparse
+import math
+import os
+import struct
+import sys
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# =============================================================================
+# 等時間間隔への再標本化と運動量 (速度・加速度・ヨーレート)
+# =============================================================================
+#
+# raw_data.log のタイムスタンプは不等間隔で、移動が無い周は記録されない。
+# 解析チャンクごとに次の処理を行い、kinematics.bin に書き足していく (メモリはチャンク1つ分 + フィルター長)。
+#   1. 再標本化: 各サンプルの移動量は「直前の1ポーリング周期」の間に生じたものとして位置の折れ線を作り、
+#      DT_S 刻みの格子へ np.interp で一括補間する (止まっていた区間に移動がにじまない)
+#   2. 平滑化と微分: ガウス重み付きの局所多項式あてはめに相当する3本のカーネル (位置・1階微分・2階微分) を
+#      sliding_window_view と行列積で x, y 両方にまとめて畳み込む
+#   3. 速度 = |v|、加速度 = 進行方向成分 (v・a / |v|)、ヨーレート = (v x a) / |v|^2、進行方向 = atan2(v)
+# 前後はスタート地点・最終位置で止まっていたものとして埋めるため、出力は 0 秒から最後のサンプルまでを覆う。
+# 向きは画像座標 (x 右, y 下) で、ヨーレート・進行方向は画像上で反時計回りを正とする。
+#
+# kinematics.bin (列指向):
+#   [ヘッダー] magic, version, 列数, DT_S, SIGMA_S, 列名
+#   [ブロック] x N  開始格子番号(i8), 行数(u4), 列ごとに float32 x 行数
+# 列はブロック内で連続しているため、必要な列だけを読み (他は読み飛ばし) ブロック単位で処理できる。
+#
+# 実行例:
+#   py -3.12 kinematics.py Log/G304_Test01/G304_Test01_20251207_143200/raw_data.log --dt 0.001
+
+KINEMATICS_NAME: str = "kinematics.bin"
+DT_S: float = 0.01
+SIGMA_S: float = 0.02
+# これより遅い時は進行方向が定まらないため、ヨーレート・加速度・進行方向を 0 とする
+MIN_SPEED_CM_S: float = 1.0
+
+COLUMNS = ['X_cm', 'Y_cm', 'Speed_cm_s', 'Accel_cm_s2', 'YawRate_deg_s', 'Heading_deg']
+
+MAGIC: bytes = b"FPKN"
+VERSION: int = 1
+_HEADER_STRUCT = struct.Struct('<4sHHdd')
+_BLOCK_STRUCT = struct.Struct('<qI')
+_VALUE_DTYPE = np.dtype('<f4')
+
+
+def make_kernels(dt: float, sigma: float) -> np.ndarray:
+    """平滑化 (位置)・1階微分・2階微分のカーネル (K, 3)。相関 (カーネルを反転しない畳み込み) で使う
+
+    ガウス重み g で正規化したうえで、直線に対して1階微分が、2次式に対して2階微分が正確になるよう規格化する。
+    """
+    h = max(1, int(math.ceil(4 * sigma / dt)))
+    tau = np.arange(-h, h + 1) * dt
+    g = np.exp(-0.5 * (tau / sigma) ** 2)
+    g /= g.sum()
+    d1 = tau * g
+    d1 /= (d1 * tau).sum()
+    d2 = (tau ** 2 - (tau ** 2 * g).sum()) * g
+    d2 /= (d2 * tau ** 2).sum() / 2
+    return np.column_stack((g, d1, d2))
+
+
+def write_header(f, dt: float, sigma: float, columns: Sequence[str]):
+    f.write(_HEADER_STRUCT.pack(MAGIC, VERSION, len(columns), dt, sigma))
+    for name in columns:
+        encoded = name.encode('ascii')
+        f.write(struct.pack('<B', len(encoded)) + encoded)
+
+
+def read_header(f) -> Dict[str, Any]:
+    data = f.read(_HEADER_STRUCT.size)
+    if len(data) < _HEADER_STRUCT.size:
+        raise ValueError("kinematics.bin のヘッダーが不完全です")
+    magic, version, n_columns, dt, sigma = _HEADER_STRUCT.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("kinematics.bin ではありません")
+    if version != VERSION:
+        raise ValueError(f"未対応の kinematics.bin です (version={version})")
+    columns = []
+    for _ in range(n_columns):
+        length = f.read(1)[0]
+        columns.append(f.read(length).decode('ascii'))
+    return {'version': version, 'dt': dt, 'sigma': sigma, 'columns': columns}
+
+
+def iter_kinematics_blocks(path: str, columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """kinematics.bin をブロックごとに {列名: 配列} で返す (Time_s は格子番号から求める)。
+
+    columns を指定すると、それ以外の列は読まずに読み飛ばす。
+    """
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        names = header['columns']
+        wanted = set(names if columns is None else columns)
+        unknown = wanted - set(names) - {'Time_s'}
+        if unknown:
+            raise ValueError(f"kinematics.bin に無い列です: {', '.join(sorted(unknown))}")
+        while True:
+            data = f.read(_BLOCK_STRUCT.size)
+            if len(data) < _BLOCK_STRUCT.size:
+                break
+            start, rows = _BLOCK_STRUCT.unpack(data)
+            block = {'Time_s': (start + np.arange(rows)) * header['dt']} if 'Time_s' in wanted or columns is None else {}
+            size = rows * _VALUE_DTYPE.itemsize
+            for name in names:
+                if name in wanted:
+                    block[name] = np.frombuffer(f.read(size), dtype=_VALUE_DTYPE)
+                else:
+                    f.seek(size, os.SEEK_CUR)
+            yield block
+
+
+def read_kinematics(path: str, columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """kinematics.bin の指定列をすべて読み込む"""
+    parts: Dict[str, List[np.ndarray]] = {}
+    for block in iter_kinematics_blocks(path, columns):
+        for name, values in block.items():
+            parts.setdefault(name, []).append(values)
+    return {name: np.concatenate(values) for name, values in parts.items()}
+
+
+class KinematicsStage:
+    """解析中の軌跡をチャンクごとに受け取り、等間隔の運動量を kinematics.bin に書き足す
+
+    位置は plot と同じ変換 (画像 x = スタート + ΣRel_Y, 画像 y = スタート - ΣRel_X) で求める。
+    """
+
+    def __init__(self, start_cm: Tuple[float, float], mickey_to_cm: float, polling_rate: int,
+                 out_path: Optional[str] = None, dt: float = DT_S, sigma: float = SIGMA_S):
+        if dt <= 0:
+            raise ValueError(f"再標本化の間隔は正の値にしてください: {dt}")
+        self.mickey_to_cm = mickey_to_cm
+        self.period = 1.0 / polling_rate
+        self.dt = dt
+        self.sigma = max(sigma, dt)
+        self.kernels = make_kernels(dt, self.sigma)
+        self.half = (len(self.kernels) - 1) // 2
+        self.out_path = out_path
+
+        # 最後のサンプルの時刻と位置、次に補間する格子番号
+        self.t = 0.0
+        self.x = float(start_cm[0]); self.y = float(start_cm[1])
+        self.next_k = 0
+        # 畳み込み待ちの格子点 (2, m)。先頭はスタート地点で止まっていたものとして埋める
+        self._tail = np.tile([[self.x], [self.y]], (1, self.half))
+        self._out_k = 0
+
+        self.samples = 0
+        self.rows = 0
+        self._speed_sum = 0.0
+        self.max_speed = 0.0
+        self.max_abs_accel = 0.0
+        self.max_abs_yaw_rate = 0.0
+
+        self._out = None
+        if out_path is not None:
+            self._out = open(out_path, 'wb')
+            write_header(self._out, dt, self.sigma, COLUMNS)
+
+    def update(self, ts: np.ndarray, dx: np.ndarray, dy: np.ndarray):
+        """1チャンク分の (Timestamp_s, Rel_X, Rel_Y) を再標本化し、畳み込める分を書き出す"""
+        n = len(ts)
+        if n == 0:
+            return
+        x = self.x + np.cumsum(dy) * self.mickey_to_cm
+        y = self.y - np.cumsum(dx) * self.mickey_to_cm
+        prev_t = np.concatenate(([self.t], ts[:-1]))
+        # 各サンプルの移動は直前の1周期の間に起きたものとする
+        begin = np.maximum(prev_t, ts - self.period)
+        kt = np.concatenate(([self.t], np.column_stack((begin, ts)).ravel()))
+        kx = np.concatenate(([self.x], np.column_stack((np.concatenate(([self.x], x[:-1])), x)).ravel()))
+        ky = np.concatenate(([self.y], np.column_stack((np.concatenate(([self.y], y[:-1])), y)).ravel()))
+
+        k_end = int(np.floor(ts[-1] / self.dt))
+        grid = np.arange(self.next_k, k_end + 1) * self.dt
+        self.next_k = max(self.next_k, k_end + 1)
+        self.t = float(ts[-1]); self.x = float(x[-1]); self.y = float(y[-1])
+        self.samples += n
+        if len(grid):
+            self._filter(np.vstack((np.interp(grid, kt, kx), np.interp(grid, kt, ky))))
+
+    def _filter(self, points: np.ndarray):
+        buf = np.concatenate((self._tail, points), axis=1)
+        width = len(self.kernels)
+        if buf.shape[1] < width:
+            self._tail = buf
+            return
+        # (2, M, K) @ (K, 3) -> x, y それぞれの (位置, 1階微分, 2階微分)
+        res = np.lib.stride_tricks.sliding_window_view(buf, width, axis=1) @ self.kernels
+        self._tail = buf[:, buf.shape[1] - (width - 1):]
+        self._write(res)
+
+    def _write(self, res: np.ndarray):
+        px, py = res[0, :, 0], res[1, :, 0]
+        vx, vy = res[0, :, 1], res[1, :, 1]
+        ax, ay = res[0, :, 2], res[1, :, 2]
+        speed = np.hypot(vx, vy)
+        moving = speed > MIN_SPEED_CM_S
+        safe = np.where(moving, speed, 1.0)
+        accel = np.where(moving, (vx * ax + vy * ay) / safe, 0.0)
+        # y 軸が下向きなので、画像上の反時計回りを正にするため符号を反転する
+        yaw_rate = np.where(moving, np.degrees(-(vx * ay - vy * ax) / (safe * safe)), 0.0)
+        heading = np.where(moving, np.degrees(np.arctan2(-vy, vx)), 0.0)
+
+        rows = len(px)
+        if self._out is not None:
+            self._out.write(_BLOCK_STRUCT.pack(self._out_k, rows))
+            for values in (px, py, speed, accel, yaw_rate, heading):
+                self._out.write(values.astype(_VALUE_DTYPE).tobytes())
+        self._out_k += rows
+        self.rows += rows
+        self._speed_sum += float(speed.sum())
+        self.max_speed = max(self.max_speed, float(speed.max()))
+        self.max_abs_accel = max(self.max_abs_accel, float(np.abs(accel).max()))
+        self.max_abs_yaw_rate = max(self.max_abs_yaw_rate, float(np.abs(yaw_rate).max()))
+
+    def finish(self) -> Dict[str, Any]:
+        """最後のサンプルの位置を1格子点足し、その位置で止まっていたものとして残りを書き出す"""
+        final = np.tile([[self.x], [self.y]], (1, 1 + self.half))
+        self.next_k += 1
+        self._filter(final)
+        self._tail = self._tail[:, :0]
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        return self.summary()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'samples': self.samples, 'rows': self.rows, 'dt_s': self.dt, 'sigma_s': self.sigma,
+            'duration_s': self.rows * self.dt,
+            'distance_cm': self._speed_sum * self.dt,
+            'mean_speed_cm_s': self._speed_sum / self.rows if self.rows else None,
+            'max_speed_cm_s': self.max_speed,
+            'max_abs_accel_cm_s2': self.max_abs_accel,
+            'max_abs_yaw_rate_deg_s': self.max_abs_yaw_rate,
+        }
+
+
+def main(argv=None) -> int:
+    import analyze_engine
+    from course_constants import CourseConstants
+
+    parser = argparse.ArgumentParser(description="生データを等時間間隔に再標本化し、速度・加速度・ヨーレートを kinematics.bin に書き出す")
+    parser.add_argument('raw', help="raw_data.log / raw_data.bin")
+    parser.add_argument('--dt', type=float, default=DT_S, help=f"格子の間隔 [s] (既定: {DT_S})")
+    parser.add_argument('--sigma', type=float, default=SIGMA_S, help=f"平滑化の幅 [s] (既定: {SIGMA_S})")
+    parser.add_argument('-o', '--output', help="出力先 (省略時は生データと同じディレクトリの kinematics.bin)")
+    args = parser.parse_args(argv)
+
+    out_path = args.output or os.path.join(os.path.dirname(os.path.abspath(args.raw)), KINEMATICS_NAME)
+    start_cm = (CourseConstants.START_PX_X * CourseConstants.CM_PER_PIXEL,
+                CourseConstants.START_PX_Y * CourseConstants.CM_PER_PIXEL)
+    try:
+        stage = KinematicsStage(start_cm, CourseConstants.MICKEY_TO_CM, CourseConstants.POLLING_RATE,
+                                out_path, args.dt, args.sigma)
+        for ts, dx, dy in analyze_engine.iter_raw_chunks(args.raw):
+            stage.update(ts, dx, dy)
+        summary = stage.finish()
+    except (OSError, ValueError) as e:
+        print(f"❌ 運動量の計算に失敗しました: {e}")
+        return 1
+    print(f"🏁 {out_path}: {summary['rows']:,} 行 (dt {summary['dt_s'] * 1000:g} ms)")
+    print(f"   最高速度 {summary['max_speed_cm_s']:.1f} cm/s / 最大加速度 {summary['max_abs_accel_cm_s2']:.0f} cm/s² / "
+          f"最大ヨーレート {summary['max_abs_yaw_rate_deg_s']:.0f} deg/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
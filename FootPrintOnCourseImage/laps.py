@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import raw_format
+
+# =============================================================================
+# 周回 (ラップ) の検出と周回インデックス
+# =============================================================================
+#
+# 1回の計測 (ESC から ESC まで) に含まれる複数の周回を区切り、lap_index.json に保存する。
+#   gate   : スタート地点 (START_PX_X/Y) を中心とする半径 GATE_RADIUS_CM の円をスタート/フィニッシュゲートとし、
+#            一度 GATE_REARM_CM 以上離れてから戻ってきた時の最接近サンプルを周回の区切りとする
+#   manual : 計測中に [SPACE] キーで記録した時刻 (lap_marks.json) を区切りとする (ゲートより優先)
+# 解析チャンクごとに判定するため、生データを読み直す必要はない。
+#
+# lap_index.json には周回ごとに生データの行番号とバイト位置・時刻・距離・開始位置を記録する。
+# read_lap() は生データ全体を走査せず、その周回の範囲だけをシークして読む。
+#
+# 実行例:
+#   py -3.12 laps.py Log/G304_Test01/G304_Test01_20251207_143200            (周回の一覧)
+#   py -3.12 laps.py Log/G304_Test01/G304_Test01_20251207_143200 --lap 3 --plot
+
+LAP_INDEX_NAME: str = "lap_index.json"
+LAP_MARKS_NAME: str = "lap_marks.json"
+LAP_PLOT_NAME: str = "trajectory_lap{:03d}.png"
+
+GATE_RADIUS_CM: float = 30.0
+GATE_REARM_CM: float = 100.0
+_SCAN_BLOCK_SIZE: int = 1 << 23
+
+
+class LapDetector:
+    """解析中の軌跡をチャンクごとに受け取り、スタート/フィニッシュゲートの通過 (または手動の記録) で周回を区切る
+
+    位置は plot と同じ変換 (画像 x = スタート + ΣRel_Y, 画像 y = スタート - ΣRel_X) で求める。
+    """
+
+    def __init__(self, start_cm: Tuple[float, float], mickey_to_cm: float, marks: Optional[Sequence[float]] = None,
+                 gate_radius_cm: float = GATE_RADIUS_CM, rearm_cm: float = GATE_REARM_CM):
+        self.start = (float(start_cm[0]), float(start_cm[1]))
+        self.mickey_to_cm = mickey_to_cm
+        self.marks = sorted(float(t) for t in marks) if marks else None
+        self.gate_radius_cm = gate_radius_cm
+        self.rearm_cm = max(rearm_cm, gate_radius_cm)
+
+        self.x, self.y = self.start
+        self.distance = 0.0
+        self.rows = 0
+        self.last_ts = 0.0
+        # 区切り: (行番号, 時刻, その行までの距離, 位置 x, 位置 y)。先頭はスタート地点
+        self.boundaries: List[Tuple[int, float, float, float, float]] = [(0, 0.0, 0.0, self.x, self.y)]
+        self._armed = False
+        self._visit: Optional[Tuple[float, int, float, float, float, float]] = None
+        self._mark_index = 0
+
+    @property
+    def mode(self) -> str:
+        return 'manual' if self.marks is not None else 'gate'
+
+    def update(self, ts: np.ndarray, dx: np.ndarray, dy: np.ndarray):
+        n = len(ts)
+        if n == 0:
+            return
+        x = self.x + np.cumsum(dy) * self.mickey_to_cm
+        y = self.y - np.cumsum(dx) * self.mickey_to_cm
+        dist = self.distance + np.cumsum(np.hypot(dx, dy)) * self.mickey_to_cm
+        # 区切りの行は「その行から次の周回が始まる」行。行 i の位置・距離はその行の移動を含むため1つ前の値を使う
+        px = np.concatenate(([self.x], x[:-1])); py = np.concatenate(([self.y], y[:-1]))
+        pd = np.concatenate(([self.distance], dist[:-1]))
+        if self.marks is not None:
+            self._split_marks(ts, px, py, pd)
+        else:
+            self._split_gate(ts, x, y, dist)
+        self.x = float(x[-1]); self.y = float(y[-1]); self.distance = float(dist[-1])
+        self.rows += n
+        self.last_ts = float(ts[-1])
+
+    def _split_marks(self, ts, px, py, pd):
+        while self._mark_index < len(self.marks) and self.marks[self._mark_index] <= ts[-1]:
+            i = int(np.searchsorted(ts, self.marks[self._mark_index], side='right'))
+            if self.rows == 0 and self.marks[self._mark_index] <= ts[0]:
+                # 最初のサンプルと同時刻の記録も、それより前の記録と同じく周回 1 の開始とする
+                i = 0
+            if i == len(ts):
+                # チャンクの最後の行と同時刻の区切りは、次のチャンクの先頭行から始まる (最終チャンクなら周回は増えない)
+                return
+            self._add(i, self.marks[self._mark_index], px, py, pd)
+            self._mark_index += 1
+
+    def _split_gate(self, ts, x, y, dist):
+        d = np.hypot(x - self.start[0], y - self.start[1])
+        n = len(d)
+        i = 0
+        while i < n:
+            if not self._armed:
+                # ゲートから十分に離れるまでは次の通過を数えない
+                far = np.flatnonzero(d[i:] > self.rearm_cm)
+                if len(far) == 0:
+                    return
+                i += int(far[0])
+                self._armed = True
+            if self._visit is None:
+                near = np.flatnonzero(d[i:] <= self.gate_radius_cm)
+                if len(near) == 0:
+                    return
+                i += int(near[0])
+                self._visit = (float('inf'), -1, 0.0, 0.0, 0.0, 0.0)
+            # ゲート内にいる間の最接近サンプルを探す
+            out = np.flatnonzero(d[i:] > self.gate_radius_cm)
+            end = i + int(out[0]) if len(out) else n
+            # end == i は前のチャンクから続くゲート内の滞在が、このチャンクの先頭で既に終わっている場合
+            if end > i:
+                j = i + int(np.argmin(d[i:end]))
+                if d[j] < self._visit[0]:
+                    # 最接近サンプルの次の行から次の周回とする
+                    self._visit = (float(d[j]), self.rows + j + 1, float(ts[j]), float(dist[j]), float(x[j]), float(y[j]))
+            if not len(out):
+                return
+            self.boundaries.append(self._visit[1:])
+            self._visit = None
+            self._armed = False
+            i = end
+
+    def _add(self, i: int, t: float, px, py, pd):
+        boundary = (self.rows + i, float(t), float(pd[i]), float(px[i]), float(py[i]))
+        if boundary[0] == self.boundaries[-1][0]:
+            # 間にサンプルが無い区切り (最初のサンプルより前の記録や、移動せずに続けた記録) は
+            # 0 行の周回にせず、後の区切りをその周回の開始とする
+            self.boundaries[-1] = boundary
+        else:
+            self.boundaries.append(boundary)
+
+    def finish(self, raw_path: Optional[str] = None) -> Dict[str, Any]:
+        """最後の区間を閉じて周回の一覧を作る。raw_path を渡すと各周回のバイト位置も求める"""
+        if self._visit is not None:
+            if self._visit[1] < self.rows:
+                self.boundaries.append(self._visit[1:])
+            self._visit = None
+        bounds = self.boundaries + [(self.rows, self.last_ts, self.distance, self.x, self.y)]
+        laps = []
+        for k, ((r0, t0, d0, x0, y0), (r1, t1, d1, _, _)) in enumerate(zip(bounds[:-1], bounds[1:]), 1):
+            laps.append({
+                'lap': k, 'start_row': r0, 'end_row': r1, 'start_s': t0, 'end_s': t1, 'time_s': t1 - t0,
+                'distance_cm': d1 - d0, 'start_x_cm': x0, 'start_y_cm': y0,
+                # 最後の区間は区切りで終わっていない (計測終了で打ち切り)
+                'complete': k < len(bounds) - 1,
+            })
+        if raw_path is not None:
+            offsets = raw_row_offsets(raw_path, [lap['start_row'] for lap in laps] + [self.rows])
+            for lap, begin, end in zip(laps, offsets[:-1], offsets[1:]):
+                lap['start_byte'] = begin; lap['end_byte'] = end
+        return self.summary(laps)
+
+    def summary(self, laps: List[Dict[str, Any]]) -> Dict[str, Any]:
+        complete = [lap for lap in laps if lap['complete']]
+        best = min(complete, key=lambda lap: lap['time_s']) if complete else None
+        return {
+            'mode': self.mode, 'gate_radius_cm': self.gate_radius_cm if self.marks is None else None,
+            'rows': self.rows, 'duration_s': self.last_ts, 'distance_cm': self.distance,
+            'end_x_cm': self.x, 'end_y_cm': self.y,
+            'laps': laps, 'complete_laps': len(complete),
+            'best_lap': best['lap'] if best else None, 'best_time_s': best['time_s'] if best else None,
+            'mean_time_s': sum(lap['time_s'] for lap in complete) / len(complete) if complete else None,
+            'mean_distance_cm': sum(lap['distance_cm'] for lap in complete) / len(complete) if complete else None,
+        }
+
+
+def raw_row_offsets(raw_path: str, rows: Sequence[int]) -> List[int]:
+    """生データの各行 (0 始まり、ヘッダー行を除く) の先頭のバイト位置"""
+    if raw_format.is_binary(raw_path):
+        return [raw_format.HEADER_SIZE + int(r) * raw_format.RECORD_DTYPE.itemsize for r in rows]
+    # CSV は改行の位置を数える (1回だけ、ブロック単位で走査する)
+    wanted = np.asarray(rows, dtype=np.int64)
+    size = os.path.getsize(raw_path)
+    result = np.full(len(wanted), size, dtype=np.int64)
+    seen = 0
+    base = 0
+    with open(raw_path, 'rb') as f:
+        while True:
+            block = f.read(_SCAN_BLOCK_SIZE)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + base
+            # 行 r は (r + 1) 個目の改行 (先頭はヘッダー行の改行) の直後から始まる
+            hit = (wanted >= seen) & (wanted < seen + len(newlines))
+            result[hit] = newlines[wanted[hit] - seen] + 1
+            seen += len(newlines)
+            base += len(block)
+    return np.minimum(result, size).tolist()
+
+
+def save_lap_index(path: str, summary: Dict[str, Any], raw_path: str):
+    index = dict(summary)
+    index['raw_file'] = os.path.basename(raw_path)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+
+
+def load_lap_index(session_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(session_dir, LAP_INDEX_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_lap_marks(session_dir: str) -> Optional[List[float]]:
+    path = os.path.join(session_dir, LAP_MARKS_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('marks_s') or None
+
+
+def save_lap_marks(path: str, marks: List[float]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'marks_s': marks}, f, indent=2)
+
+
+def read_lap(session_dir: str, lap: Union[int, Dict[str, Any]],
+             raw_name: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """周回インデックスのバイト位置へシークし、その周回の (Timestamp_s, Rel_X, Rel_Y) だけを読む
+
+    lap は周回の番号 (1始まり) か、lap_index.json の 'laps' の要素。
+    """
+    if raw_name is None or not isinstance(lap, dict):
+        index = load_lap_index(session_dir)
+        raw_name = raw_name or index['raw_file']
+        if not isinstance(lap, dict):
+            lap = next(l for l in index['laps'] if l['lap'] == lap)
+    raw_path = os.path.join(session_dir, raw_name)
+    begin, end = lap['start_byte'], lap['end_byte']
+    if raw_format.is_binary(raw_path):
+        rec = raw_format.open_records(raw_path)[lap['start_row']:lap['end_row']]
+        return rec['Timestamp_s'].astype(np.float64), rec['Rel_X'].astype(np.float64), rec['Rel_Y'].astype(np.float64)
+    with open(raw_path, 'rb') as f:
+        f.seek(begin)
+        text = f.read(end - begin).decode('ascii')
+    if not text:
+        return np.empty(0), np.empty(0), np.empty(0)
+    data = np.loadtxt(text.splitlines(), delimiter=',', usecols=(0, 1, 2), dtype=np.float64, ndmin=2)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def print_laps(summary: Dict[str, Any], max_laps: int = 20):
+    laps = summary['laps']
+    mode = "手動" if summary['mode'] == 'manual' else f"ゲート 半径 {summary['gate_radius_cm']:.0f} cm"
+    if summary['best_lap'] is None:
+        print(f"🏁 周回: 区切りなし ({mode})")
+        return
+    print(f"🏁 周回: {summary['complete_laps']} 周 ({mode}) / ベスト {summary['best_time_s']:.3f} s (第{summary['best_lap']}周) / "
+          f"平均 {summary['mean_time_s']:.3f} s・{summary['mean_distance_cm']:.0f} cm")
+    for lap in laps[:max_laps]:
+        mark = "⭐" if lap['lap'] == summary['best_lap'] else ("…" if not lap['complete'] else " ")
+        print(f"   {mark} 第{lap['lap']:>3}周: {lap['time_s']:8.3f} s  {lap['distance_cm']:8.1f} cm")
+    if len(laps) > max_laps:
+        print(f"   ... ほか {len(laps) - max_laps} 周")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="セッションの周回インデックスを表示し、指定した周回だけを読み出す")
+    parser.add_argument('session_dir', help="Log/<マウス名>/<マウス名>_<日時>/")
+    parser.add_argument('--lap', type=int, help="読み出す周回の番号")
+    parser.add_argument('--plot', action='store_true', help="--lap の周回だけの軌跡図を保存する")
+    args = parser.parse_args(argv)
+
+    try:
+        index = load_lap_index(args.session_dir)
+    except (OSError, ValueError) as e:
+        print(f"❌ 周回インデックスを読み込めません: {e}")
+        return 1
+    if args.lap is None:
+        print_laps(index, max_laps=len(index['laps']))
+        return 0
+    laps = {lap['lap']: lap for lap in index['laps']}
+    if args.lap not in laps:
+        print(f"❌ 第{args.lap}周はありません (1〜{len(laps)})")
+        return 1
+    lap = laps[args.lap]
+    ts, dx, dy = read_lap(args.session_dir, lap)
+    print(f"⏱️ 第{args.lap}周: {lap['start_s']:.3f}〜{lap['end_s']:.3f} s, {len(ts):,} 行, {lap['distance_cm']:.1f} cm")
+    if args.plot:
+        import rasterizer
+        import run_store
+        from course_constants import CourseConstants
+
+        scale = CourseConstants.MICKEY_TO_CM / CourseConstants.CM_PER_PIXEL
+        x = lap['start_x_cm'] / CourseConstants.CM_PER_PIXEL + np.cumsum(np.concatenate(([0.0], dy))) * scale
+        y = lap['start_y_cm'] / CourseConstants.CM_PER_PIXEL - np.cumsum(np.concatenate(([0.0], dx))) * scale
+        plot_path = os.path.join(args.session_dir, LAP_PLOT_NAME.format(args.lap))
+        image_path, warning = run_store.session_course_image(args.session_dir,
+                                                             run_store.load_session_settings(args.session_dir))
+        if warning:
+            print(warning)
+        rasterizer.plot_trajectory_raster([(x, y)], image_path, plot_path, f"Lap {args.lap} ({lap['time_s']:.3f} s)")
+        print(f"🖼️ 周回の軌跡図保存完了: {plot_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
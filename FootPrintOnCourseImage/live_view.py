@@ -0,0 +1,152 @@
+import os
+import time
+import pygame
+from typing import List, Optional, Tuple
+
+# =============================================================================
+# 計測ウィンドウのライブ軌跡表示
+# =============================================================================
+#
+# 縮小したコース画像を常駐サーフェス (track) に持ち、描画のたびに
+# 「前回描いた位置 -> 現在位置」の線分だけを track に書き足す。
+# 画面へは変化した領域 (線分・現在位置マーカー・テキスト行) だけを転送して
+# pygame.display.update(rects) するため、1回の描画コストは計測時間の長さに依存しない。
+#
+# 描画の間隔は、描画にかかった時間の移動平均が全体の RENDER_BUDGET_SHARE を
+# 超えないよう自動で広げる (ポーリングループの周期を描画が食わないようにする)。
+# 期限を持つスケジューラ (hybrid) では、今周の残り時間が描画コストに足りない時は次の周へ見送る。
+
+WINDOW_SIZE: Tuple[int, int] = (400, 300)
+TEXT_HEIGHT_PX: int = 28
+COURSE_SIZE_PX: Tuple[int, int] = (1000, 546)
+
+BACKGROUND_COLOR = (20, 20, 30)
+BLANK_COURSE_COLOR = (235, 235, 235)
+TEXT_COLOR = (0, 255, 0)
+TRACK_COLOR = (255, 0, 0)
+START_COLOR = (0, 255, 0)
+MARKER_COLOR = (0, 0, 255)
+MARKER_RADIUS_PX: int = 3
+
+# 描画間隔の下限 (目標周期の何周分か)。従来のテキスト表示と同じ 15 周
+RENDER_INTERVAL_PERIODS: int = 15
+# 描画に使ってよい時間の割合
+RENDER_BUDGET_SHARE: float = 0.05
+# 縮小画面上でこれより短い移動は描かずに次回へ持ち越す
+MIN_SEGMENT_PX: float = 0.5
+
+
+class LiveTrajectoryView:
+    """縮小コース画像の上に軌跡を差分描画する"""
+
+    def __init__(self, screen: pygame.Surface, image_path: str, start_px: Tuple[float, float],
+                 mickey_to_pixel: float, polling_rate: int):
+        self.screen = screen
+        self.start_px = start_px
+        self.mickey_to_pixel = mickey_to_pixel
+        self.font = pygame.font.Font(None, 24)
+
+        w, h = screen.get_size()
+        course = self._load_course(image_path)
+        cw, ch = course.get_size()
+        self.scale = min(w / cw, (h - TEXT_HEIGHT_PX) / ch)
+        size = (max(1, round(cw * self.scale)), max(1, round(ch * self.scale)))
+        self.track = pygame.transform.smoothscale(course, size)
+        self.origin = ((w - size[0]) // 2, TEXT_HEIGHT_PX + (h - TEXT_HEIGHT_PX - size[1]) // 2)
+        self.map_rect = pygame.Rect(self.origin, size)
+        self.text_rect = pygame.Rect(0, 0, w, TEXT_HEIGHT_PX)
+
+        self.last_point = self._to_screen(0, 0)
+        pygame.draw.circle(self.track, START_COLOR, self._to_track(self.last_point), MARKER_RADIUS_PX)
+        self.marker_rect: Optional[pygame.Rect] = None
+
+        self.min_interval_ns = RENDER_INTERVAL_PERIODS * 1_000_000_000 // polling_rate
+        self.interval_ns = self.min_interval_ns
+        self.last_render_ns = 0
+        self._cost_ns = 0.0
+        self.frames = 0
+        self.segments = 0
+        self.deferred = 0
+
+    @staticmethod
+    def _load_course(image_path: str) -> pygame.Surface:
+        if image_path and os.path.exists(image_path):
+            try:
+                return pygame.image.load(image_path).convert()
+            except pygame.error:
+                pass
+        surface = pygame.Surface(COURSE_SIZE_PX).convert()
+        surface.fill(BLANK_COURSE_COLOR)
+        return surface
+
+    def _to_screen(self, total_x: int, total_y: int) -> Tuple[float, float]:
+        # plot と同じ対応: 画像 x = +Total_Y, 画像 y = -Total_X
+        px = self.start_px[0] + total_y * self.mickey_to_pixel
+        py = self.start_px[1] - total_x * self.mickey_to_pixel
+        return (self.origin[0] + px * self.scale, self.origin[1] + py * self.scale)
+
+    def _to_track(self, point: Tuple[float, float]) -> Tuple[float, float]:
+        return (point[0] - self.origin[0], point[1] - self.origin[1])
+
+    def draw_full(self):
+        """ループ開始前に1回だけ画面全体を描く"""
+        self.screen.fill(BACKGROUND_COLOR)
+        self.screen.blit(self.track, self.origin)
+        self._draw_text(0, 0)
+        pygame.display.flip()
+
+    def due(self, now_ns: int, time_left_ns: Optional[int] = None) -> bool:
+        """描画する周かどうか。time_left_ns は今周の期限までの残り時間 (分からなければ None)"""
+        if now_ns - self.last_render_ns < self.interval_ns:
+            return False
+        if time_left_ns is not None and time_left_ns < 2 * self._cost_ns:
+            self.deferred += 1
+            return False
+        return True
+
+    def render(self, total_x: int, total_y: int, now_ns: int):
+        """前回からの線分・マーカー・テキストだけを描き、変化した領域だけを画面に転送する"""
+        t0 = time.perf_counter_ns()
+        dirty: List[pygame.Rect] = []
+
+        point = self._to_screen(total_x, total_y)
+        if abs(point[0] - self.last_point[0]) + abs(point[1] - self.last_point[1]) >= MIN_SEGMENT_PX:
+            rect = pygame.draw.line(self.track, TRACK_COLOR, self._to_track(self.last_point),
+                                    self._to_track(point), 1)
+            rect.move_ip(self.origin)
+            dirty.append(rect)
+            self.last_point = point
+            self.segments += 1
+
+        # 前回のマーカーを track の内容で消してから、現在位置に描き直す
+        if self.marker_rect is not None:
+            dirty.append(self.marker_rect)
+        for rect in dirty:
+            self.screen.blit(self.track, rect, rect.move(-self.origin[0], -self.origin[1]))
+        # コース外に出てもテキスト行や余白に跡が残らないよう、マーカーはコース画像の範囲に切り取る
+        self.screen.set_clip(self.map_rect)
+        self.marker_rect = pygame.draw.circle(self.screen, MARKER_COLOR, point, MARKER_RADIUS_PX).clip(self.map_rect)
+        self.screen.set_clip(None)
+        dirty.append(self.marker_rect)
+
+        dirty.append(self._draw_text(total_x, total_y))
+        pygame.display.update(dirty)
+
+        self.frames += 1
+        self.last_render_ns = now_ns
+        cost = time.perf_counter_ns() - t0
+        self._cost_ns = cost if self.frames == 1 else 0.9 * self._cost_ns + 0.1 * cost
+        # 描画コストが予算を超えるようなら、その分だけ描画間隔を広げる
+        self.interval_ns = max(self.min_interval_ns, int(self._cost_ns / RENDER_BUDGET_SHARE))
+
+    def _draw_text(self, total_x: int, total_y: int) -> pygame.Rect:
+        self.screen.fill(BACKGROUND_COLOR, self.text_rect)
+        text = self.font.render(f"Mickey: ({total_x}, {total_y})", True, TEXT_COLOR)
+        self.screen.blit(text, (10, 5))
+        return self.text_rect
+
+    def stats(self) -> dict:
+        return {
+            'frames': self.frames, 'segments': self.segments, 'deferred': self.deferred,
+            'mean_cost_ms': self._cost_ns / 1e6, 'interval_ms': self.interval_ns / 1e6,
+        }
@@ -0,0 +1,165 @@
+import heapq
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+# =============================================================================
+# ポーリングループの周期・ジッター計測
+# =============================================================================
+#
+# acquire_raw_data の1周ごとに time.perf_counter_ns() の区切り時刻を受け取り、
+#   - 周期のヒストグラム (BIN_US 刻み)
+#   - 最悪ストール上位 WORST_COUNT 件 (発生時刻と各処理の内訳つき)
+#   - 処理ごとの所要時間 (イベント処理 / get_rel / バッファ格納 / 描画 / スケジューラの待機)
+#   - ループ中のプロセス CPU 時間 (スケジューラごとの CPU コスト比較用)
+# を集計する。1周あたりの処理は整数演算とリスト更新だけに抑えている。
+
+BIN_US: int = 50
+BIN_COUNT: int = 400  # 0 〜 20 ms。それ以上は最後のビンにまとめる
+WORST_COUNT: int = 20
+
+LOOP_STATS_NAME: str = "loop_stats.json"
+
+PHASES = ('events', 'get_rel', 'buffer', 'render', 'wait')
+_PHASE_LABELS = {'events': "イベント", 'get_rel': "get_rel", 'buffer': "バッファ", 'render': "描画", 'wait': "待機"}
+
+
+class LoopStats:
+    """ポーリングループ1周ごとの所要時間を集計する"""
+
+    def __init__(self, target_rate: int, start_ns: int):
+        self.target_rate = target_rate
+        self.target_period_ns = 1_000_000_000 // target_rate
+        self.start_ns = start_ns
+        self.end_ns = start_ns
+        self.start_cpu_ns = time.process_time_ns()
+        self.end_cpu_ns = None
+        self.iterations = 0
+        self.render_frames = 0
+        self.missed_periods = 0
+        self.max_period_ns = 0
+        self.hist = [0] * (BIN_COUNT + 1)
+        self.phase_sum_ns = dict.fromkeys(PHASES, 0)
+        self.phase_max_ns = dict.fromkeys(PHASES, 0)
+        # (周期, 開始時刻, 内訳) の最小ヒープ。先頭が上位 WORST_COUNT 件の中で最も短い周期
+        self._worst: List[tuple] = []
+
+    def record(self, t_start: int, t_events: int, t_rel: int, t_buffer: int, t_render: int, t_end: int,
+               rendered: bool):
+        """1周分の区切り時刻 (ns) を記録する。t_end は次の周の t_start として使う"""
+        period = t_end - t_start
+        self.iterations += 1
+        self.end_ns = t_end
+
+        b = period // (BIN_US * 1000)
+        self.hist[b if b < BIN_COUNT else BIN_COUNT] += 1
+        if period > self.max_period_ns:
+            self.max_period_ns = period
+        # 目標周期の2倍以上かかった周は、その間のサンプル機会を取りこぼしたとみなす
+        if period >= 2 * self.target_period_ns:
+            self.missed_periods += period // self.target_period_ns - 1
+
+        durations = (t_events - t_start, t_rel - t_events, t_buffer - t_rel, t_render - t_buffer, t_end - t_render)
+        sums = self.phase_sum_ns; maxs = self.phase_max_ns
+        for name, d in zip(PHASES, durations):
+            sums[name] += d
+            if d > maxs[name]:
+                maxs[name] = d
+        if rendered:
+            self.render_frames += 1
+
+        worst = self._worst
+        if len(worst) < WORST_COUNT:
+            heapq.heappush(worst, (period, t_start, durations))
+        elif period > worst[0][0]:
+            heapq.heapreplace(worst, (period, t_start, durations))
+
+    def finish(self):
+        """ループ終了時に呼び、CPU 時間の計測を締める"""
+        self.end_cpu_ns = time.process_time_ns()
+
+    # --- 集計結果 ---
+
+    def _percentile_ms(self, q: float) -> Optional[float]:
+        """ヒストグラムから分位点を求める (該当ビンの上端を返すため、最大 BIN_US だけ大きめになる)"""
+        if self.iterations == 0:
+            return None
+        threshold = q * self.iterations
+        cumulative = 0
+        for i, count in enumerate(self.hist):
+            cumulative += count
+            if cumulative >= threshold:
+                return (i + 1) * BIN_US / 1000
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed_s = (self.end_ns - self.start_ns) / 1e9
+        n = self.iterations
+        end_cpu_ns = self.end_cpu_ns if self.end_cpu_ns is not None else time.process_time_ns()
+        cpu_s = (end_cpu_ns - self.start_cpu_ns) / 1e9
+        phases = {}
+        for name in PHASES:
+            # 描画は実際に描画した周だけで平均する
+            count = self.render_frames if name == 'render' else n
+            phases[name] = {
+                'total_s': self.phase_sum_ns[name] / 1e9,
+                'mean_ms': self.phase_sum_ns[name] / count / 1e6 if count else None,
+                'max_ms': self.phase_max_ns[name] / 1e6,
+                'share': self.phase_sum_ns[name] / (self.end_ns - self.start_ns) if self.end_ns > self.start_ns else None,
+            }
+        histogram = [
+            {'lower_ms': i * BIN_US / 1000, 'upper_ms': (i + 1) * BIN_US / 1000 if i < BIN_COUNT else None, 'count': c}
+            for i, c in enumerate(self.hist) if c
+        ]
+        worst = [
+            {'period_ms': period / 1e6, 'at_s': (t_start - self.start_ns) / 1e9,
+             'phases_ms': {name: d / 1e6 for name, d in zip(PHASES, durations)}}
+            for period, t_start, durations in sorted(self._worst, reverse=True)
+        ]
+        return {
+            'target_rate_hz': self.target_rate,
+            'achieved_rate_hz': n / elapsed_s if elapsed_s > 0 else None,
+            'iterations': n,
+            'elapsed_s': elapsed_s,
+            'render_frames': self.render_frames,
+            'missed_periods': self.missed_periods,
+            'cpu_s': cpu_s,
+            'cpu_percent': cpu_s / elapsed_s * 100 if elapsed_s > 0 else None,
+            'period_ms': {
+                'mean': elapsed_s * 1000 / n if n else None,
+                'p50': self._percentile_ms(0.50),
+                'p99': self._percentile_ms(0.99),
+                'p999': self._percentile_ms(0.999),
+                'max': self.max_period_ns / 1e6,
+            },
+            'phases': phases,
+            'histogram_bin_us': BIN_US,
+            'histogram': histogram,
+            'worst_stalls': worst,
+        }
+
+
+def save_loop_stats(path: str, stats: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
+
+
+def print_loop_summary(stats: Dict[str, Any]):
+    if not stats['iterations']:
+        return
+    period = stats['period_ms']
+    print(f"⏱️ ループ実績: {stats['achieved_rate_hz']:.1f} Hz (目標 {stats['target_rate_hz']} Hz) / "
+          f"周期 p50 {period['p50']:.2f} ms, p99 {period['p99']:.2f} ms, 最大 {period['max']:.2f} ms")
+    print(f"   取りこぼし推定: {stats['missed_periods']:,} 周期 / {stats['iterations']:,} 周")
+    scheduler = stats.get('scheduler', {}).get('name', '-')
+    print(f"   スケジューラ: {scheduler} / CPU 使用率 {stats['cpu_percent']:.0f}% (1コア = 100%)")
+    parts = []
+    for name in PHASES:
+        phase = stats['phases'][name]
+        if phase['mean_ms'] is not None:
+            parts.append(f"{_PHASE_LABELS[name]} {phase['mean_ms']:.3f} ms")
+    print(f"   平均内訳: {', '.join(parts)} (描画 {stats['render_frames']:,} 回)")
+    if stats['worst_stalls']:
+        w = stats['worst_stalls'][0]
+        slowest = max(w['phases_ms'], key=w['phases_ms'].get)
+        print(f"   最大ストール: {w['period_ms']:.2f} ms @ {w['at_s']:.3f} s (主因: {_PHASE_LABELS[slowest]})")
@@ -0,0 +1,341 @@
+import itertools
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import course_geometry
+import course_validator
+
+# =============================================================================
+# マップマッチングによるドリフト補正 (コース中心線への当てはめ)
+# =============================================================================
+#
+# 推測航法 (ΣRel x MICKEY_TO_CM) の軌跡は走行が長くなるほどずれが溜まり、コースから外れていく。
+# CourseData_*.csv の各パーツの中心線 (長さ方向の線分) を「車線」とし、軌跡を車線上に当てはめる。
+#
+#   1. 一定距離 (STEP_CM) 進むごとに1ステップとし、生データの移動量をビーム内の各仮説の位置に足す
+#   2. 足した位置の近くにある車線を一様グリッド (SegmentGrid) で引き、中心線へ射影した点を候補にする
+#   3. 隠れマルコフモデルの Viterbi を、車線ごとに最良の仮説だけ残し上位 BEAM_WIDTH 個に絞って進める
+#        - 出力確率: 中心線までの距離のガウス分布
+#        - 遷移確率: 同じ車線 > 端点がつながった車線 > それ以外。近くに車線が無い時は「コース外」状態
+#   4. 固定ラグ (FIXED_LAG_STEPS) だけ遅れて最良の経路を確定し、確定した補正量 (当てはめ位置 - 生の位置) を
+#      ステップ間で線形補間して、全サンプルの補正後の位置を matched_path.csv へ順に書き出す
+#
+# 1ステップの計算量はビーム幅と近くの車線数だけで決まり、履歴も固定ラグ分しか持たないため、
+# 処理時間はセッションの長さに比例し、メモリは一定で済む。
+
+MATCHED_PATH_NAME: str = "matched_path.csv"
+MATCHED_PLOT_NAME: str = "trajectory_matched.png"
+MATCHED_COLUMNS = ['Timestamp_s', 'Raw_X_cm', 'Raw_Y_cm', 'Matched_X_cm', 'Matched_Y_cm', 'Part']
+_ROW_FORMAT: str = "%.4f,%.2f,%.2f,%.2f,%.2f,%d\r\n"
+
+STEP_CM: float = 5.0
+BEAM_WIDTH: int = 8
+FIXED_LAG_STEPS: int = 40
+# 車線の候補を探す半径と、グリッドのセルの大きさ
+SEARCH_RADIUS_CM: float = 15.0
+GRID_CELL_CM: float = 20.0
+# 端点がこの距離以内にある車線同士はつながっているとみなす
+CONNECT_CM: float = 10.0
+
+# 1ステップで中心線へ寄せる割合 (1 にすると毎回中心線上に置く)
+SNAP_GAIN: float = 0.3
+
+# 対数確率
+SIGMA_CM: float = 5.0
+OFF_TRACK_LOGP: float = -0.5 * 3.0 ** 2
+ENTER_LOGP: float = -1.0
+LEAVE_LOGP: float = -4.0
+SWITCH_CONNECTED_LOGP: float = -1.0
+SWITCH_OTHER_LOGP: float = -8.0
+
+
+class Centerlines:
+    """配置済みパーツの中心線 (長さ方向の線分)"""
+
+    def __init__(self, layout: course_geometry.CourseLayout):
+        self.layout = layout
+        # パーツ置き場 (x < 0) のパーツは車線にしない
+        self.part = np.flatnonzero(layout.cx >= 0)
+        u = np.column_stack((layout.cos[self.part], layout.sin[self.part]))
+        c = np.column_stack((layout.cx[self.part], layout.cy[self.part]))
+        hl = layout.half_length[self.part][:, None]
+        self.p0 = c - hl * u
+        self.p1 = c + hl * u
+        self.vec = self.p1 - self.p0
+        self.len2 = (self.vec ** 2).sum(axis=1)
+
+    def __len__(self) -> int:
+        return len(self.part)
+
+    def bounds(self, margin: float = 0.0) -> np.ndarray:
+        """各線分の外接矩形 (N, 4) を margin だけ広げたもの"""
+        return np.column_stack((np.minimum(self.p0[:, 0], self.p1[:, 0]) - margin,
+                                np.minimum(self.p0[:, 1], self.p1[:, 1]) - margin,
+                                np.maximum(self.p0[:, 0], self.p1[:, 0]) + margin,
+                                np.maximum(self.p0[:, 1], self.p1[:, 1]) + margin))
+
+    def project(self, seg: np.ndarray, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """点 (x, y) を線分 seg へ射影した点と、その距離"""
+        vx = self.vec[seg, 0]; vy = self.vec[seg, 1]
+        t = np.clip(((x - self.p0[seg, 0]) * vx + (y - self.p0[seg, 1]) * vy) / self.len2[seg], 0.0, 1.0)
+        qx = self.p0[seg, 0] + t * vx
+        qy = self.p0[seg, 1] + t * vy
+        return qx, qy, np.hypot(x - qx, y - qy)
+
+    def connected_keys(self, tolerance: float = CONNECT_CM) -> np.ndarray:
+        """端点が相手の線分から tolerance 以内にある組 (両方向) を a * N + b の昇順配列で返す"""
+        n = len(self)
+        pairs = course_validator.candidate_pairs(self.bounds(tolerance / 2))
+        if len(pairs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        a = pairs[:, 0]; b = pairs[:, 1]
+        dist = np.full(len(pairs), np.inf)
+        for s, t in ((a, b), (b, a)):
+            for end in (self.p0, self.p1):
+                dist = np.minimum(dist, self.project(t, end[s, 0], end[s, 1])[2])
+        a = a[dist <= tolerance]; b = b[dist <= tolerance]
+        return np.unique(np.concatenate((a * n + b, b * n + a)))
+
+
+class SegmentGrid:
+    """点の近く (SEARCH_RADIUS_CM 以内) にある可能性のある線分を引く一様グリッド"""
+
+    def __init__(self, lines: Centerlines, cell_size: float = GRID_CELL_CM, radius: float = SEARCH_RADIUS_CM):
+        self.cell_size = cell_size
+        n = len(lines)
+        if n == 0:
+            self.origin = (0.0, 0.0); self.shape = (0, 0)
+            self.cell_start = np.zeros(1, dtype=np.int64); self.cell_segs = np.zeros(0, dtype=np.int64)
+            return
+        b = lines.bounds(radius)
+        x0 = float(b[:, 0].min()); y0 = float(b[:, 1].min())
+        nx = int(np.floor((b[:, 2].max() - x0) / cell_size)) + 1
+        ny = int(np.floor((b[:, 3].max() - y0) / cell_size)) + 1
+        self.origin = (x0, y0)
+        self.shape = (ny, nx)
+
+        i0 = np.floor((b[:, 0] - x0) / cell_size).astype(np.int64)
+        j0 = np.floor((b[:, 1] - y0) / cell_size).astype(np.int64)
+        i1 = np.minimum(np.floor((b[:, 2] - x0) / cell_size).astype(np.int64), nx - 1)
+        j1 = np.minimum(np.floor((b[:, 3] - y0) / cell_size).astype(np.int64), ny - 1)
+        wi = i1 - i0 + 1; wj = j1 - j0 + 1
+        counts = wi * wj
+        seg = np.repeat(np.arange(n), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell = (j0[seg] + k // wi[seg]) * nx + i0[seg] + k % wi[seg]
+        order = np.argsort(cell, kind='stable')
+        self.cell_segs = seg[order]
+        self.cell_start = np.concatenate(([0], np.cumsum(np.bincount(cell, minlength=nx * ny))))
+
+    def query(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """各点の候補線分を (点の番号, 線分の番号) の組で返す"""
+        ny, nx = self.shape
+        i = np.floor((x - self.origin[0]) / self.cell_size)
+        j = np.floor((y - self.origin[1]) / self.cell_size)
+        idx = np.flatnonzero((i >= 0) & (i < nx) & (j >= 0) & (j < ny))
+        c = j[idx].astype(np.int64) * nx + i[idx].astype(np.int64)
+        begin = self.cell_start[c]
+        counts = self.cell_start[c + 1] - begin
+        point = np.repeat(idx, counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return point, self.cell_segs[np.repeat(begin, counts) + k]
+
+
+class MapMatcher:
+    """解析中の軌跡をチャンクごとに受け取り、車線に当てはめた位置を matched_path.csv に書き出す
+
+    位置は plot と同じ変換 (画像 x = スタート + ΣRel_Y, 画像 y = スタート - ΣRel_X) で求める。
+    """
+
+    def __init__(self, lines: Centerlines, start_cm: Tuple[float, float], mickey_to_cm: float,
+                 out_path: Optional[str] = None, step_cm: float = STEP_CM, beam_width: int = BEAM_WIDTH,
+                 lag_steps: int = FIXED_LAG_STEPS):
+        self.lines = lines
+        self.grid = SegmentGrid(lines)
+        self.connected = lines.connected_keys()
+        self.mickey_to_cm = mickey_to_cm
+        self.step_cm = step_cm
+        self.beam_width = beam_width
+        self.lag_steps = max(1, lag_steps)
+        self.out_path = out_path
+
+        # 生データ (推測航法) の現在位置と、最後のステップの位置
+        self.x = float(start_cm[0]); self.y = float(start_cm[1])
+        self.travel = 0.0
+        self.step_x = self.x; self.step_y = self.y
+        # ビーム: 仮説ごとの車線 (-1 はコース外)・当てはめ位置・対数確率
+        self.seg = np.array([-1], dtype=np.int64)
+        self.pos = np.array([[self.x, self.y]])
+        self.score = np.zeros(1)
+        # 未確定のステップ: (時刻, 生の位置, 仮説の位置, 仮説の車線, 1つ前の仮説)
+        self._history: List[Tuple[float, float, float, np.ndarray, np.ndarray, np.ndarray]] = []
+        # 確定したステップの (時刻, 補正量 x, 補正量 y, 車線) と、補間の左端
+        self._final: List[Tuple[float, float, float, int]] = []
+        self._anchor: Optional[Tuple[float, float, float, int]] = None
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+        self.samples = 0
+        self.steps = 0
+        self.matched_steps = 0
+        self.switches = 0
+        self._last_seg = -1
+        self._correction_sum = 0.0
+        self.max_correction_cm = 0.0
+        self.final_correction_cm = 0.0
+
+        self._out = None
+        if out_path is not None:
+            self._out = open(out_path, 'w', newline='')
+            self._out.write(",".join(MATCHED_COLUMNS) + "\r\n")
+
+    # --- ストリーム処理 ---
+
+    def update(self, ts: np.ndarray, dx: np.ndarray, dy: np.ndarray):
+        """1チャンク分の (Timestamp_s, Rel_X, Rel_Y) を処理し、確定した分を書き出す"""
+        n = len(ts)
+        if n == 0:
+            return
+        if self._anchor is None:
+            self._anchor = (float(ts[0]), 0.0, 0.0, -1)
+        x = self.x + np.cumsum(dy) * self.mickey_to_cm
+        y = self.y - np.cumsum(dx) * self.mickey_to_cm
+        s = self.travel + np.cumsum(np.hypot(dx, dy)) * self.mickey_to_cm
+        # 移動距離が step_cm の倍数をまたいだサンプルでステップを進める
+        k = np.floor(s / self.step_cm)
+        prev = np.concatenate(([np.floor(self.travel / self.step_cm)], k[:-1]))
+        for i in np.flatnonzero(k > prev).tolist():
+            self._step(float(ts[i]), float(x[i]), float(y[i]))
+        self.x = float(x[-1]); self.y = float(y[-1]); self.travel = float(s[-1])
+        self._pending.append((ts, x, y))
+        self.samples += n
+        self._emit(final=False)
+
+    def _transition(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        n = len(self.lines)
+        key = a * n + b
+        if len(self.connected):
+            where = np.minimum(np.searchsorted(self.connected, key), len(self.connected) - 1)
+            conn = self.connected[where] == key
+        else:
+            conn = np.zeros(len(a), dtype=bool)
+        return np.where(a == b, 0.0, np.where(a < 0, ENTER_LOGP,
+                                              np.where(conn, SWITCH_CONNECTED_LOGP, SWITCH_OTHER_LOGP)))
+
+    def _step(self, t: float, rx: float, ry: float):
+        pred = self.pos + (rx - self.step_x, ry - self.step_y)
+        self.step_x = rx; self.step_y = ry
+
+        # 車線上の候補 (仮説, 車線)
+        hyp, seg = self.grid.query(pred[:, 0], pred[:, 1])
+        qx, qy, d = self.lines.project(seg, pred[hyp, 0], pred[hyp, 1])
+        near = d <= SEARCH_RADIUS_CM
+        hyp = hyp[near]; seg = seg[near]
+        on_score = (self.score[hyp] + self._transition(self.seg[hyp], seg) - 0.5 * (d[near] / SIGMA_CM) ** 2)
+        # コース外の候補 (当てはめずにそのまま進む)
+        off_score = self.score + np.where(self.seg < 0, 0.0, LEAVE_LOGP) + OFF_TRACK_LOGP
+
+        parent = np.concatenate((hyp, np.arange(len(self.seg))))
+        states = np.concatenate((seg, np.full(len(self.seg), -1, dtype=np.int64)))
+        # 中心線へ一気に移さず SNAP_GAIN の割合だけ寄せる。角で曲がり始めた移動量を捨てずに次の車線へ持ち越せる
+        on_pos = pred[hyp] + SNAP_GAIN * (np.column_stack((qx[near], qy[near])) - pred[hyp])
+        pos = np.concatenate((on_pos, pred))
+        score = np.concatenate((on_score, off_score))
+
+        # Viterbi: 状態 (車線) ごとに最良の仮説だけを残し、さらに上位 beam_width 個に絞る
+        order = np.argsort(-score, kind='stable')
+        _, first = np.unique(states[order], return_index=True)
+        keep = order[first]
+        keep = keep[np.argsort(-score[keep], kind='stable')][:self.beam_width]
+
+        self.seg = states[keep]
+        self.pos = pos[keep]
+        self.score = score[keep] - score[keep[0]]
+        self._history.append((t, rx, ry, self.pos, self.seg, parent[keep]))
+        self.steps += 1
+        if len(self._history) >= 2 * self.lag_steps:
+            self._finalize(self.lag_steps)
+
+    def _finalize(self, count: int):
+        """最良の仮説から履歴をたどり、古い方から count ステップを確定する"""
+        best = 0
+        path = []
+        for entry in reversed(self._history):
+            path.append(best)
+            best = int(entry[5][best])
+        path.reverse()
+        for (t, rx, ry, pos, seg, _), b in zip(self._history[:count], path[:count]):
+            ox = float(pos[b, 0]) - rx; oy = float(pos[b, 1]) - ry
+            s = int(seg[b])
+            self._final.append((t, ox, oy, s))
+            correction = float(np.hypot(ox, oy))
+            self._correction_sum += correction
+            self.max_correction_cm = max(self.max_correction_cm, correction)
+            self.final_correction_cm = correction
+            if s >= 0:
+                self.matched_steps += 1
+                if self._last_seg >= 0 and s != self._last_seg:
+                    self.switches += 1
+                self._last_seg = s
+        del self._history[:count]
+
+    def _emit(self, final: bool):
+        """確定した補正量で、補間できる範囲のサンプルを書き出す"""
+        if not self._pending or (not self._final and not final):
+            return
+        ts = np.concatenate([p[0] for p in self._pending])
+        x = np.concatenate([p[1] for p in self._pending])
+        y = np.concatenate([p[2] for p in self._pending])
+        knots = [self._anchor] + self._final
+        kt = np.array([k[0] for k in knots])
+        n = len(ts) if final else int(np.searchsorted(ts, kt[-1], side='right'))
+        if n == 0:
+            return
+        ox = np.interp(ts[:n], kt, [k[1] for k in knots])
+        oy = np.interp(ts[:n], kt, [k[2] for k in knots])
+        # 車線は直前に確定したステップのもの
+        part_of = np.array([self.lines.part[k[3]] if k[3] >= 0 else -1 for k in knots], dtype=np.int64)
+        part = part_of[np.maximum(np.searchsorted(kt, ts[:n], side='right') - 1, 0)]
+        if self._out is not None:
+            values = np.column_stack((ts[:n], x[:n], y[:n], x[:n] + ox, y[:n] + oy, part)).ravel().tolist()
+            self._out.write((_ROW_FORMAT * n) % tuple(values))
+        self._pending = [(ts[n:], x[n:], y[n:])] if n < len(ts) else []
+        self._anchor = knots[-1]
+        self._final = []
+
+    def finish(self) -> Dict[str, Any]:
+        """残りの履歴をすべて確定して書き出し、集計結果を返す"""
+        if self._history:
+            self._finalize(len(self._history))
+        self._emit(final=True)
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        return self.summary()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'course_data': self.lines.layout.source, 'lanes': len(self.lines),
+            'samples': self.samples, 'steps': self.steps, 'step_cm': self.step_cm, 'beam_width': self.beam_width,
+            'matched_percent': self.matched_steps / self.steps * 100 if self.steps else None,
+            'lane_switches': self.switches,
+            'mean_correction_cm': self._correction_sum / self.steps if self.steps else None,
+            'max_correction_cm': self.max_correction_cm,
+            'final_correction_cm': self.final_correction_cm,
+        }
+
+
+def create_map_matcher(course_data_path: str, start_cm: Tuple[float, float], mickey_to_cm: float,
+                       out_path: Optional[str] = None) -> MapMatcher:
+    return MapMatcher(Centerlines(course_geometry.load_course_csv(course_data_path)), start_cm, mickey_to_cm, out_path)
+
+
+def iter_matched_chunks(path: str, chunk_rows: int = 100_000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """matched_path.csv を (生の x, 生の y, 補正後の x, 補正後の y) [cm] のチャンクとして返す"""
+    with open(path, 'r', newline='') as f:
+        f.readline()
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            data = np.loadtxt(lines, delimiter=',', usecols=(1, 2, 3, 4), dtype=np.float64, ndmin=2)
+            yield data[:, 0], data[:, 1], data[:, 2], data[:, 3]
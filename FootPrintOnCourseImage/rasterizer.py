@@ -0,0 +1,351 @@
+import math
+import os
+import numpy as np
+import pygame
+from typing import Iterable, Optional, Tuple
+
+# =============================================================================
+# 軌跡の高速ラスタライザ (matplotlib を使わない描画経路)
+# =============================================================================
+#
+# 1. 間引き: 表示解像度 (SIMPLIFY_TOLERANCE_PX = サブピクセル) を基準に、
+#    連続して同じ格子に入る点を落としてから Ramer-Douglas-Peucker で折れ線を簡略化する。
+#    チャンク単位で処理するため、メモリは1チャンク分 + 簡略化後の頂点数で済む。
+# 2. 描画: 折れ線を 0.5px 刻みで標本化し、1/4px 格子で重複を除いた標本点ごとに
+#    「線の半径 - 距離」を被覆率としてキャンバスに max 合成する (アンチエイリアス)。
+#    標本点の数はキャンバスの面積で頭打ちになるため、セッションが長くても描画コストは増えない。
+# 3. 合成: デコード済みのコース画像 (NumPy 配列) に被覆率で色を重ね、
+#    スタート/ゴールのマーカーとタイトルを描いて PNG として保存する。
+#
+# 見た目は従来の matplotlib 版 (赤線 linewidth=2, スタート=黄緑の丸, ゴール=青の×) に合わせている。
+
+SIMPLIFY_TOLERANCE_PX: float = 0.25
+RDP_WINDOW: int = 128
+SAMPLE_STEP_PX: float = 0.5
+SUBPIXEL: int = 4
+STAMP_BATCH: int = 200_000
+# 標本点の格子は画像の外側にも線の太さ分の余白 (px) を持つ
+_PAD: int = 4
+
+# matplotlib 版 (dpi=100) の見た目に相当する大きさ
+LINE_WIDTH_PX: float = 2 * 100 / 72
+LINE_COLOR = (255, 0, 0)
+START_RADIUS_PX: float = math.sqrt(150) * 100 / 72 / 2
+START_COLOR = (0, 255, 0)
+START_EDGE_PX: float = 100 / 72
+END_HALF_SIZE_PX: float = math.sqrt(150) * 100 / 72 / 2
+END_LINE_PX: float = 1.5 * 100 / 72
+END_COLOR = (0, 0, 255)
+# マップマッチングの比較図: 生の軌跡は薄く、補正後の軌跡を濃く描く
+RAW_OVERLAY_ALPHA: float = 0.5
+MATCHED_COLOR = (170, 0, 220)
+
+# 滞在ヒートマップ: 少ない順に 青 -> 水色 -> 黄 -> 赤。差分は A が多い所を赤、B が多い所を青で塗る
+HEATMAP_COLORS = [(0, 0, 255), (0, 200, 255), (255, 230, 0), (255, 0, 0)]
+HEATMAP_ALPHA: float = 0.8
+HEATMAP_GAMMA: float = 0.5
+DIFF_COLORS = ((0, 60, 255), (255, 0, 0))
+
+TITLE_HEIGHT_PX: int = 30
+TITLE_FONT_SIZE: int = 24
+
+DEFAULT_SIZE = (1000, 546)
+
+
+# -----------------------------------------------------------------------------
+# 間引き
+# -----------------------------------------------------------------------------
+
+def drop_subpixel_steps(x: np.ndarray, y: np.ndarray, tolerance: float = SIMPLIFY_TOLERANCE_PX) -> Tuple[np.ndarray, np.ndarray]:
+    """直前の点と同じ tolerance 格子に入る点を落とす (先頭と末尾は残す)"""
+    n = len(x)
+    if n < 3:
+        return x, y
+    qx = np.floor(x / tolerance)
+    qy = np.floor(y / tolerance)
+    keep = np.empty(n, dtype=bool)
+    keep[0] = True
+    keep[1:] = (qx[1:] != qx[:-1]) | (qy[1:] != qy[:-1])
+    keep[-1] = True
+    return x[keep], y[keep]
+
+
+def simplify_rdp(x: np.ndarray, y: np.ndarray, tolerance: float = SIMPLIFY_TOLERANCE_PX,
+                 window: int = RDP_WINDOW) -> np.ndarray:
+    """Ramer-Douglas-Peucker で残す頂点のインデックスを返す。
+
+    window 点ごとに区切りを固定したうえで、全区間を1段ずつ同時に分割する (NumPy 一括計算)。
+    区切りを固定すると頂点数はやや増えるが、分割の段数が log2(window) 程度に収まる。
+    往復する軌跡を潰さないよう、距離は直線ではなく線分 (端点でクランプ) までの距離で測る。
+    """
+    n = len(x)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    starts = np.arange(0, n - 1, window)
+    ends = np.minimum(starts + window, n - 1)
+    keep[starts] = True
+    keep[ends] = True
+    tol2 = tolerance * tolerance
+    while len(starts):
+        counts = ends - starts - 1
+        active = counts > 0
+        starts, ends, counts = starts[active], ends[active], counts[active]
+        if not len(starts):
+            break
+        offsets = np.cumsum(counts) - counts
+        seg = np.repeat(np.arange(len(starts)), counts)
+        idx = np.arange(int(counts.sum())) - offsets[seg] + starts[seg] + 1
+
+        sx = (x[ends] - x[starts])[seg]
+        sy = (y[ends] - y[starts])[seg]
+        px = x[idx] - x[starts][seg]
+        py = y[idx] - y[starts][seg]
+        length2 = sx * sx + sy * sy
+        t = np.divide(px * sx + py * sy, length2, out=np.zeros_like(px), where=length2 > 0)
+        np.clip(t, 0.0, 1.0, out=t)
+        px -= t * sx
+        py -= t * sy
+        d2 = px * px + py * py
+
+        # 区間ごとに最も遠い点 (同値なら先頭) を求め、許容誤差を超えた区間だけ分割する
+        dmax = np.maximum.reduceat(d2, offsets)
+        cand = np.flatnonzero(d2 == dmax[seg])
+        far = idx[cand[np.unique(seg[cand], return_index=True)[1]]]
+        split = dmax > tol2
+        mid = far[split]
+        keep[mid] = True
+        starts, ends = np.concatenate((starts[split], mid)), np.concatenate((mid, ends[split]))
+    return np.flatnonzero(keep)
+
+
+def simplify_chunks(chunks: Iterable[Tuple[np.ndarray, np.ndarray]],
+                    tolerance: float = SIMPLIFY_TOLERANCE_PX) -> Tuple[np.ndarray, np.ndarray]:
+    """(x, y) チャンク列をチャンクごとに間引き・簡略化して連結する (メモリは1チャンク分 + 結果のみ)"""
+    xs = []
+    ys = []
+    for x, y in chunks:
+        if len(x) == 0:
+            continue
+        x, y = drop_subpixel_steps(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), tolerance)
+        idx = simplify_rdp(x, y, tolerance)
+        xs.append(x[idx]); ys.append(y[idx])
+    if not xs:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+# -----------------------------------------------------------------------------
+# 描画
+# -----------------------------------------------------------------------------
+
+def _mark_samples(hit: np.ndarray, x: np.ndarray, y: np.ndarray):
+    """折れ線を SAMPLE_STEP_PX 刻みで標本化し、1/SUBPIXEL 格子上の標本点を hit に記録する"""
+    _mark(hit, x[-1:], y[-1:])
+    if len(x) < 2:
+        return
+    seg_dx = np.diff(x)
+    seg_dy = np.diff(y)
+    steps = np.maximum(1, np.ceil(np.hypot(seg_dx, seg_dy) / SAMPLE_STEP_PX)).astype(np.int64)
+    cum = np.cumsum(steps)
+
+    # 1度に展開する標本点が STAMP_BATCH 程度になるよう、線分をまとめて処理する
+    start = 0
+    while start < len(steps):
+        done = int(cum[start - 1]) if start else 0
+        end = max(start + 1, int(np.searchsorted(cum, done + STAMP_BATCH, side='right')))
+        st = steps[start:end]
+        seg = np.repeat(np.arange(start, end), st)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(st) - st, st)
+        t = k / steps[seg]
+        _mark(hit, x[seg] + t * seg_dx[seg], y[seg] + t * seg_dy[seg])
+        start = end
+
+
+def _mark(hit: np.ndarray, sx: np.ndarray, sy: np.ndarray):
+    h, w = hit.shape
+    # 線の太さ分は画像外にはみ出してもよいので、格子の外側に _PAD px の余白を持たせてある
+    qx = np.rint((sx + _PAD) * SUBPIXEL).astype(np.int64)
+    qy = np.rint((sy + _PAD) * SUBPIXEL).astype(np.int64)
+    ok = (qx >= 0) & (qx < w) & (qy >= 0) & (qy < h)
+    hit[qy[ok], qx[ok]] = True
+
+
+def render_polyline_coverage(x: np.ndarray, y: np.ndarray, width: int, height: int,
+                             line_width: float = LINE_WIDTH_PX) -> np.ndarray:
+    """折れ線のアンチエイリアス被覆率 (0〜1, float32, shape=(height, width)) を返す"""
+    coverage = np.zeros((height, width), dtype=np.float32)
+    if len(x) == 0:
+        return coverage
+    hit = np.zeros(((height + 2 * _PAD) * SUBPIXEL, (width + 2 * _PAD) * SUBPIXEL), dtype=bool)
+    _mark_samples(hit, x, y)
+    qy, qx = np.nonzero(hit)
+    sx = qx / SUBPIXEL - _PAD
+    sy = qy / SUBPIXEL - _PAD
+
+    radius = line_width / 2
+    reach = int(math.ceil(radius + 0.5))
+    offsets = [(ox, oy) for oy in range(-reach, reach + 1) for ox in range(-reach, reach + 1)]
+    flat = coverage.reshape(-1)
+    for b in range(0, len(sx), STAMP_BATCH):
+        bx = sx[b:b + STAMP_BATCH]; by = sy[b:b + STAMP_BATCH]
+        cx = np.rint(bx).astype(np.int64); cy = np.rint(by).astype(np.int64)
+        for ox, oy in offsets:
+            px = cx + ox; py = cy + oy
+            # 画素中心 (整数座標) と標本点の距離から被覆率を求める
+            c = np.clip(radius + 0.5 - np.hypot(px - bx, py - by), 0.0, 1.0).astype(np.float32)
+            ok = (c > 0) & (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            np.maximum.at(flat, py[ok] * width + px[ok], c[ok])
+    return coverage
+
+
+def _blend(img: np.ndarray, coverage: np.ndarray, color, y0: int = 0, x0: int = 0):
+    """img[y0:, x0:] に被覆率 coverage で color を重ねる (in-place)"""
+    h, w = coverage.shape
+    region = img[y0:y0 + h, x0:x0 + w]
+    a = coverage[:region.shape[0], :region.shape[1], None]
+    region[...] = (region * (1.0 - a) + np.asarray(color, dtype=np.float32) * a + 0.5).astype(np.uint8)
+
+
+def _shape_box(cx: float, cy: float, extent: float, width: int, height: int):
+    x0 = max(0, int(math.floor(cx - extent))); x1 = min(width, int(math.ceil(cx + extent)) + 1)
+    y0 = max(0, int(math.floor(cy - extent))); y1 = min(height, int(math.ceil(cy + extent)) + 1)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    gy, gx = np.mgrid[y0:y1, x0:x1]
+    return x0, y0, gx.astype(np.float32), gy.astype(np.float32)
+
+
+def draw_start_marker(img: np.ndarray, cx: float, cy: float):
+    box = _shape_box(cx, cy, START_RADIUS_PX + START_EDGE_PX + 1, img.shape[1], img.shape[0])
+    if box is None:
+        return
+    x0, y0, gx, gy = box
+    d = np.hypot(gx - cx, gy - cy)
+    outer = np.clip(START_RADIUS_PX + START_EDGE_PX / 2 + 0.5 - d, 0, 1)
+    inner = np.clip(START_RADIUS_PX - START_EDGE_PX / 2 + 0.5 - d, 0, 1)
+    _blend(img, outer, (0, 0, 0), y0, x0)
+    _blend(img, inner, START_COLOR, y0, x0)
+
+
+def draw_end_marker(img: np.ndarray, cx: float, cy: float):
+    s = END_HALF_SIZE_PX
+    box = _shape_box(cx, cy, s + END_LINE_PX + 1, img.shape[1], img.shape[0])
+    if box is None:
+        return
+    x0, y0, gx, gy = box
+    coverage = np.zeros(gx.shape, dtype=np.float32)
+    for ex, ey in ((s, s), (s, -s)):
+        # 中心を通る長さ 2s の線分までの距離
+        length2 = 4 * (ex * ex + ey * ey)
+        t = np.clip(((gx - cx + ex) * 2 * ex + (gy - cy + ey) * 2 * ey) / length2, 0, 1)
+        d = np.hypot(gx - (cx - ex + t * 2 * ex), gy - (cy - ey + t * 2 * ey))
+        coverage = np.maximum(coverage, np.clip(END_LINE_PX / 2 + 0.5 - d, 0, 1))
+    _blend(img, coverage, END_COLOR, y0, x0)
+
+
+def _render_title(title: str, width: int) -> np.ndarray:
+    """白地に黒文字のタイトル帯 (TITLE_HEIGHT_PX x width x 3) を返す"""
+    band = np.full((TITLE_HEIGHT_PX, width, 3), 255, dtype=np.uint8)
+    if not pygame.font.get_init():
+        pygame.font.init()
+    text = pygame.font.Font(None, TITLE_FONT_SIZE).render(title, True, (0, 0, 0), (255, 255, 255))
+    pixels = pygame.surfarray.array3d(text).swapaxes(0, 1)
+    th, tw = pixels.shape[:2]
+    tw = min(tw, width)
+    x0 = (width - tw) // 2
+    y0 = max(0, (TITLE_HEIGHT_PX - th) // 2)
+    band[y0:y0 + th, x0:x0 + tw] = pixels[:TITLE_HEIGHT_PX - y0, :tw]
+    return band
+
+
+def load_course_image(image_path: Optional[str]) -> np.ndarray:
+    """コース画像を (H, W, 3) uint8 配列にデコードする。無ければ白紙を返す"""
+    if image_path and os.path.exists(image_path):
+        surface = pygame.image.load(image_path)
+        return pygame.surfarray.array3d(surface).swapaxes(0, 1).copy()
+    w, h = DEFAULT_SIZE
+    return np.full((h, w, 3), 255, dtype=np.uint8)
+
+
+def save_png(img: np.ndarray, path: str):
+    surface = pygame.surfarray.make_surface(np.ascontiguousarray(img.swapaxes(0, 1)))
+    pygame.image.save(surface, path)
+
+
+def render_trajectory(image: np.ndarray, x: np.ndarray, y: np.ndarray, title: str) -> np.ndarray:
+    """コース画像に簡略化済みの軌跡・マーカー・タイトルを描いた画像を返す"""
+    h, w = image.shape[:2]
+    canvas = image.copy()
+    if len(x):
+        coverage = render_polyline_coverage(x, y, w, h)
+        _blend(canvas, coverage, LINE_COLOR)
+        draw_start_marker(canvas, float(x[0]), float(y[0]))
+        draw_end_marker(canvas, float(x[-1]), float(y[-1]))
+    return np.concatenate((_render_title(title, w), canvas), axis=0)
+
+
+def plot_trajectory_raster(chunks: Iterable[Tuple[np.ndarray, np.ndarray]], image_path: Optional[str],
+                           plot_path: str, title: str) -> int:
+    """軌跡チャンク列から trajectory_plot.png を描く。戻り値は簡略化後の頂点数"""
+    x, y = simplify_chunks(chunks)
+    image = load_course_image(image_path)
+    save_png(render_trajectory(image, x, y, title), plot_path)
+    return len(x)
+
+
+def render_matched(image: np.ndarray, raw_x: np.ndarray, raw_y: np.ndarray, x: np.ndarray, y: np.ndarray,
+                   title: str) -> np.ndarray:
+    """生の軌跡 (半透明の赤) と補正後の軌跡 (紫) を重ねた画像を返す。マーカーは補正後の軌跡に付ける"""
+    h, w = image.shape[:2]
+    canvas = image.copy()
+    if len(raw_x):
+        _blend(canvas, render_polyline_coverage(raw_x, raw_y, w, h) * RAW_OVERLAY_ALPHA, LINE_COLOR)
+    if len(x):
+        _blend(canvas, render_polyline_coverage(x, y, w, h), MATCHED_COLOR)
+        draw_start_marker(canvas, float(x[0]), float(y[0]))
+        draw_end_marker(canvas, float(x[-1]), float(y[-1]))
+    return np.concatenate((_render_title(title, w), canvas), axis=0)
+
+
+def _colormap(t: np.ndarray, colors) -> np.ndarray:
+    """0〜1 の値を colors を等間隔に並べたグラデーションの色 (..., 3) にする"""
+    anchors = np.linspace(0.0, 1.0, len(colors))
+    colors = np.asarray(colors, dtype=np.float32)
+    return np.stack([np.interp(t, anchors, colors[:, c]) for c in range(3)], axis=-1)
+
+
+def render_heatmap(image: np.ndarray, values: np.ndarray, title: str, scale: Optional[float] = None) -> np.ndarray:
+    """コース画像に滞在量 values (H, W) を重ねた画像を返す。scale (既定: 0 でない値の 99 パーセンタイル) で 1 とする"""
+    canvas = image.copy()
+    nonzero = values[values > 0]
+    if len(nonzero):
+        scale = scale or float(np.percentile(nonzero, 99))
+        t = np.clip(values / scale, 0.0, 1.0) ** HEATMAP_GAMMA
+        a = np.where(values > 0, HEATMAP_ALPHA * np.clip(t * 4, 0.0, 1.0), 0.0)[..., None]
+        canvas[...] = (canvas * (1.0 - a) + _colormap(t, HEATMAP_COLORS) * a + 0.5).astype(np.uint8)
+    return np.concatenate((_render_title(title, image.shape[1]), canvas), axis=0)
+
+
+def render_difference(image: np.ndarray, diff: np.ndarray, title: str, scale: Optional[float] = None) -> np.ndarray:
+    """コース画像に差分 diff (H, W) を重ねた画像を返す。正 (A が多い) は赤、負 (B が多い) は青"""
+    canvas = image.copy()
+    nonzero = np.abs(diff[diff != 0])
+    if len(nonzero):
+        scale = scale or float(np.percentile(nonzero, 99))
+        t = np.clip(np.abs(diff) / scale, 0.0, 1.0) ** HEATMAP_GAMMA
+        color = np.where((diff > 0)[..., None], np.asarray(DIFF_COLORS[1], dtype=np.float32),
+                         np.asarray(DIFF_COLORS[0], dtype=np.float32))
+        a = (HEATMAP_ALPHA * t)[..., None]
+        canvas[...] = (canvas * (1.0 - a) + color * a + 0.5).astype(np.uint8)
+    return np.concatenate((_render_title(title, image.shape[1]), canvas), axis=0)
+
+
+def plot_matched_raster(raw_chunks: Iterable[Tuple[np.ndarray, np.ndarray]],
+                        matched_chunks: Iterable[Tuple[np.ndarray, np.ndarray]], image_path: Optional[str],
+                        plot_path: str, title: str):
+    """生の軌跡と補正後の軌跡のチャンク列から比較図を描く"""
+    raw_x, raw_y = simplify_chunks(raw_chunks)
+    x, y = simplify_chunks(matched_chunks)
+    image = load_course_image(image_path)
+    save_png(render_matched(image, raw_x, raw_y, x, y, title), plot_path)
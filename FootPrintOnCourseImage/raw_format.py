@@ -0,0 +1,186 @@
+import argparse
+import itertools
+import os
+import struct
+import sys
+import numpy as np
+from typing import Any, Dict, Iterator, Tuple
+
+from course_constants import CourseConstants
+
+# =============================================================================
+# 生データのバイナリ形式 (raw_data.bin)
+# =============================================================================
+#
+# ファイル構成:
+#   [ヘッダー 32 byte] magic, version, record_size, DPI, ポーリングレート, スタート地点(px)
+#   [レコード 24 byte] x N  Timestamp_s(f8), Rel_X(i4), Rel_Y(i4), Total_X(i4), Total_Y(i4)
+#
+# レコードは固定長なので、numpy.memmap で開けば文字列の解析なしに列を配列として参照できる。
+# CSV 形式 (raw_data.log) とは convert_* で相互変換できる。
+
+MAGIC: bytes = b"FPRW"
+VERSION: int = 1
+
+_HEADER_STRUCT = struct.Struct('<4sHHIIii8x')
+HEADER_SIZE: int = _HEADER_STRUCT.size
+
+RECORD_DTYPE = np.dtype([
+    ('Timestamp_s', '<f8'),
+    ('Rel_X', '<i4'),
+    ('Rel_Y', '<i4'),
+    ('Total_X', '<i4'),
+    ('Total_Y', '<i4'),
+])
+
+CSV_HEADER: str = "Timestamp_s,Rel_X,Rel_Y,Total_X,Total_Y\n"
+# acquire_raw_data の f"{elapsed:.4f},{dx},{dy},{total_x},{total_y}\n" と同じ書式
+CSV_ROW_FORMAT: str = "%.4f,%d,%d,%d,%d\n"
+
+RAW_CSV_NAME: str = "raw_data.log"
+RAW_BINARY_NAME: str = "raw_data.bin"
+
+CONVERT_CHUNK_ROWS: int = 100_000
+
+
+def make_header(dpi: int, polling_rate: int, start_px_x: int, start_px_y: int) -> Dict[str, Any]:
+    return {
+        'version': VERSION, 'dpi': int(dpi), 'polling_rate': int(polling_rate),
+        'start_px_x': int(start_px_x), 'start_px_y': int(start_px_y),
+    }
+
+
+def is_binary(path: str) -> bool:
+    """先頭の magic でバイナリ形式かどうかを判定する"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def pack_header(header: Dict[str, Any]) -> bytes:
+    return _HEADER_STRUCT.pack(
+        MAGIC, VERSION, RECORD_DTYPE.itemsize,
+        header['dpi'], header['polling_rate'], header['start_px_x'], header['start_px_y'],
+    )
+
+
+def unpack_header(data: bytes, source: str) -> Dict[str, Any]:
+    """ヘッダーのバイト列を解釈する (source はエラーメッセージ用の読み込み元)"""
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f"バイナリログのヘッダーが不完全です: {source}")
+    magic, version, record_size, dpi, polling_rate, sx, sy = _HEADER_STRUCT.unpack(data[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise ValueError(f"バイナリログではありません: {source}")
+    if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"未対応のバイナリログ形式です (version={version}, record_size={record_size}): {source}")
+    header = make_header(dpi, polling_rate, sx, sy)
+    header['version'] = version
+    return header
+
+
+def write_header(f, header: Dict[str, Any]):
+    f.write(pack_header(header))
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    with open(path, 'rb') as f:
+        data = f.read(HEADER_SIZE)
+    return unpack_header(data, path)
+
+
+def open_records(path: str) -> np.ndarray:
+    """レコード部分を読み取り専用の numpy.memmap として開く (解析コストなし)"""
+    read_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count <= 0:
+        # 空ファイルは mmap できないため、空配列を返す
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def format_csv_rows(records: np.ndarray) -> str:
+    """レコード配列を raw_data.log の行文字列にする"""
+    n = len(records)
+    if n == 0:
+        return ""
+    values = np.column_stack((
+        records['Timestamp_s'], records['Rel_X'], records['Rel_Y'], records['Total_X'], records['Total_Y'],
+    )).ravel().tolist()
+    return (CSV_ROW_FORMAT * n) % tuple(values)
+
+
+def iter_record_chunks(path: str, chunk_rows: int = CONVERT_CHUNK_ROWS) -> Iterator[np.ndarray]:
+    """バイナリログをレコード配列のチャンク (memmap のスライス) として返す"""
+    records = open_records(path)
+    for start in range(0, len(records), chunk_rows):
+        yield records[start:start + chunk_rows]
+
+
+def iter_csv_chunks(path: str, chunk_rows: int = CONVERT_CHUNK_ROWS) -> Iterator[np.ndarray]:
+    """raw_data.log (CSV) をレコード配列のチャンクとして返す"""
+    with open(path, 'r', newline='') as f:
+        header = f.readline().strip().split(',')
+        names = RECORD_DTYPE.names
+        cols = tuple(header.index(name) for name in names)
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            data = np.loadtxt(lines, delimiter=',', usecols=cols, dtype=np.float64, ndmin=2)
+            rec = np.empty(len(data), dtype=RECORD_DTYPE)
+            for i, name in enumerate(names):
+                rec[name] = data[:, i]
+            yield rec
+
+
+def convert_binary_to_csv(bin_path: str, csv_path: str) -> int:
+    rows = 0
+    with open(csv_path, 'w', newline='') as f:
+        f.write(CSV_HEADER)
+        for chunk in iter_record_chunks(bin_path):
+            f.write(format_csv_rows(chunk))
+            rows += len(chunk)
+    return rows
+
+
+def convert_csv_to_binary(csv_path: str, bin_path: str, header: Dict[str, Any]) -> int:
+    rows = 0
+    with open(bin_path, 'wb') as f:
+        write_header(f, header)
+        for chunk in iter_csv_chunks(csv_path):
+            f.write(chunk.tobytes())
+            rows += len(chunk)
+    return rows
+
+
+def default_header() -> Dict[str, Any]:
+    """course_constants.CourseConstants の DPI・ポーリングレート・スタート地点によるヘッダー"""
+    return make_header(CourseConstants.DPI_SETTING, CourseConstants.POLLING_RATE,
+                       CourseConstants.START_PX_X, CourseConstants.START_PX_Y)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="raw_data.log (CSV) と raw_data.bin (バイナリ) の相互変換")
+    parser.add_argument('src', help="変換元ファイル (形式は自動判定)")
+    parser.add_argument('dst', nargs='?', help="変換先ファイル (省略時は同じディレクトリの raw_data.log / raw_data.bin)")
+    args = parser.parse_args(argv)
+
+    src_dir = os.path.dirname(os.path.abspath(args.src))
+    try:
+        if is_binary(args.src):
+            dst = args.dst or os.path.join(src_dir, RAW_CSV_NAME)
+            rows = convert_binary_to_csv(args.src, dst)
+        else:
+            dst = args.dst or os.path.join(src_dir, RAW_BINARY_NAME)
+            rows = convert_csv_to_binary(args.src, dst, default_header())
+    except (OSError, ValueError) as e:
+        print(f"❌ 変換に失敗しました: {e}")
+        return 1
+    print(f"🔁 変換完了: {args.src} -> {dst} ({rows:,} 行)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
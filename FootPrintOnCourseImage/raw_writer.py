@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, Optional
+
+import raw_format
+
+# =============================================================================
+# 生データのバックグラウンド書き込み (Producer / Consumer)
+# =============================================================================
+#
+# ポーリングループ (Producer) は事前確保したレコード配列にサンプルを詰め、
+# 満杯になったら有限長キュー経由で書き込みスレッド (Consumer) に渡し、
+# 空きバッファと差し替えて計測を続ける。ディスクへの書き込みやフラッシュが
+# 遅くても、ポーリングループ側でファイル I/O が発生することはない。
+#
+# キューが満杯 (書き込みが追いつかない) 場合の扱い (back-pressure):
+#   'block' : 空きが出るまで待つ。データは失われないが、待ち時間だけ計測が止まる (delayed として記録)
+#   'drop'  : そのバッファを破棄してすぐに計測へ戻る (dropped として記録)
+
+QUEUE_SIZE: int = 8
+BACKPRESSURE_POLICIES = ('block', 'drop')
+
+_STOP = None
+
+
+class RawLogWriter:
+    """生データファイルへの書き込みを専用スレッドで行う"""
+
+    def __init__(self, path: str, binary: bool, header: Dict[str, Any], buffer_size: int,
+                 queue_size: int = QUEUE_SIZE, policy: str = 'block'):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"未対応の back-pressure ポリシーです: {policy}")
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self._binary = binary
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._free: "queue.Queue" = queue.Queue()
+        # 使用中のバッファは Producer 1 + キュー内 queue_size + 書き込み中 1 が上限
+        for _ in range(queue_size + 2):
+            self._free.put(np.empty(buffer_size, dtype=raw_format.RECORD_DTYPE))
+        self._error: Optional[BaseException] = None
+        self._closed = False
+
+        self.buffers_written = 0
+        self.samples_written = 0
+        self.bytes_written = 0
+        self.delayed_buffers = 0
+        self.delayed_wait_s = 0.0
+        self.dropped_buffers = 0
+        self.dropped_samples = 0
+        self.max_queue_depth = 0
+
+        if binary:
+            self._file = open(path, 'wb')
+            raw_format.write_header(self._file, header)
+        else:
+            self._file = open(path, 'w', newline='')
+            self._file.write(raw_format.CSV_HEADER)
+
+        self._thread = threading.Thread(target=self._run, name="RawLogWriter", daemon=True)
+        self._thread.start()
+
+    # --- Producer 側 (ポーリングループ) ---
+
+    def acquire_buffer(self) -> np.ndarray:
+        """空きバッファを1つ受け取る"""
+        return self._free.get()
+
+    def submit(self, buf: np.ndarray, count: int) -> np.ndarray:
+        """先頭 count 件が埋まったバッファを書き込みに回し、次に使うバッファを返す"""
+        if self._error is not None:
+            raise RuntimeError(f"書き込みスレッドでエラーが発生しました: {self._error}")
+        if count == 0:
+            return buf
+        try:
+            self._queue.put_nowait((buf, count))
+        except queue.Full:
+            if self.policy == 'drop':
+                self.dropped_buffers += 1
+                self.dropped_samples += count
+                return buf
+            self.delayed_buffers += 1
+            t0 = time.perf_counter()
+            self._queue.put((buf, count))
+            self.delayed_wait_s += time.perf_counter() - t0
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return self._free.get()
+
+    def close(self, buf: Optional[np.ndarray] = None, count: int = 0):
+        """残りのバッファを書き込み、スレッドの終了を待ってファイルを閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if buf is not None and count > 0 and self._error is None:
+                # 終了時は取りこぼさないよう、ポリシーに関わらず待って書き込む
+                self._queue.put((buf, count))
+            self._queue.put(_STOP)
+            self._thread.join()
+        finally:
+            self._file.close()
+        if self._error is not None:
+            raise RuntimeError(f"書き込みスレッドでエラーが発生しました: {self._error}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'policy': self.policy,
+            'buffer_size': self.buffer_size,
+            'buffers_written': self.buffers_written,
+            'samples_written': self.samples_written,
+            'bytes_written': self.bytes_written,
+            'delayed_buffers': self.delayed_buffers,
+            'delayed_wait_s': self.delayed_wait_s,
+            'dropped_buffers': self.dropped_buffers,
+            'dropped_samples': self.dropped_samples,
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+    # --- Consumer 側 (書き込みスレッド) ---
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            buf, count = item
+            try:
+                if self._error is None:
+                    self._write(buf[:count])
+            except BaseException as e:
+                # エラー後もキューは消化し続け、Producer が put で止まらないようにする
+                self._error = e
+            finally:
+                self._free.put(buf)
+        try:
+            self._file.flush()
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+
+    def _write(self, records: np.ndarray):
+        if self._binary:
+            data = records.tobytes()
+            self._file.write(data)
+            self.bytes_written += len(data)
+        else:
+            text = raw_format.format_csv_rows(records)
+            self._file.write(text)
+            self.bytes_written += len(text)
+        self.buffers_written += 1
+        self.samples_written += len(records)
@@ -0,0 +1,337 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# =============================================================================
+# Log/ 配下のセッションの一括再解析 (analyze + plot)
+# =============================================================================
+#
+# Log/<マウス名>/<マウス名>_<日時>/ を走査し、各セッションの analyze.log と trajectory_plot.png を
+# プロセスプールで並列に作り直す。
+# Log/reanalyze_manifest.json に「生データ・コース画像・コースデータのハッシュと定数」を記録し、
+# 前回から変わったセッションだけを処理する。
+#   - 生データのハッシュは (サイズ, 更新時刻) が前回と同じなら再計算しない
+#   - DPI_SETTING や START_PX_* を変えると全セッションが対象になる
+#   - コース画像と --kinematics-dt / --lap-gate-radius はセッションごとに計測時の値 (session_settings.json) を使う
+#
+# 実行例:
+#   py -3.12 reanalyze.py                      (変更のあったセッションだけ)
+#   py -3.12 reanalyze.py --mouse G304 --jobs 4
+#   py -3.12 reanalyze.py --force              (全セッション)
+
+MANIFEST_NAME: str = "reanalyze_manifest.json"
+MANIFEST_VERSION: int = 1
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def analysis_params(plot_engine: str, map_match: bool = False, kinematics_dt: Optional[float] = None,
+                    lap_gate_radius: Optional[float] = None) -> Dict[str, Any]:
+    """出力を左右する定数とオプション。1つでも変われば作り直す"""
+    import kinematics
+    import laps
+    from course_constants import CourseConstants
+    return {
+        'manifest_version': MANIFEST_VERSION,
+        'dpi': CourseConstants.DPI_SETTING,
+        'cm_per_pixel': CourseConstants.CM_PER_PIXEL,
+        'mickey_to_pixel': CourseConstants.MICKEY_TO_PIXEL,
+        'start_px_x': CourseConstants.START_PX_X,
+        'start_px_y': CourseConstants.START_PX_Y,
+        'plot_engine': plot_engine,
+        'map_match': map_match,
+        'kinematics_dt': kinematics.DT_S if kinematics_dt is None else kinematics_dt,
+        'kinematics_sigma': kinematics.SIGMA_S,
+        'lap_gate_radius_cm': laps.GATE_RADIUS_CM if lap_gate_radius is None else lap_gate_radius,
+        'lap_gate_rearm_cm': laps.GATE_REARM_CM,
+    }
+
+
+def find_sessions(log_root: str, mice: Optional[List[str]] = None) -> List[Dict[str, str]]:
+    """生データを持つセッションディレクトリを (マウス名, 日時) 順に列挙する"""
+    import heatmap
+    import raw_format
+    import run_store
+
+    # Log/ 直下のうち、マウスごとのディレクトリではないもの (実行記録とヒートマップ)
+    skipped = {run_store.STORE_DIR_NAME, heatmap.HEATMAP_DIR_NAME}
+    sessions = []
+    if not os.path.isdir(log_root):
+        return sessions
+    for mouse in sorted(os.listdir(log_root)):
+        mouse_dir = os.path.join(log_root, mouse)
+        if mouse in skipped or not os.path.isdir(mouse_dir) or (mice and mouse not in mice):
+            continue
+        for name in sorted(os.listdir(mouse_dir)):
+            session_dir = os.path.join(mouse_dir, name)
+            # 両方ある場合 (変換済み) は解析の速いバイナリ形式を使う
+            for raw_name in (raw_format.RAW_BINARY_NAME, raw_format.RAW_CSV_NAME):
+                raw_path = os.path.join(session_dir, raw_name)
+                if os.path.isfile(raw_path):
+                    sessions.append({'key': f"{mouse}/{name}", 'dir': session_dir, 'raw_path': raw_path})
+                    break
+    return sessions
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {'sessions': {}}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ マニフェストを読めないため、全セッションを対象にします: {e}")
+        return {'sessions': {}}
+    manifest.setdefault('sessions', {})
+    return manifest
+
+
+def save_manifest(path: str, manifest: Dict[str, Any]):
+    # 途中で中断されても壊れたファイルを残さないよう、書き終えてから置き換える
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _fingerprint(session: Dict[str, str], previous: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """生データのサイズ・更新時刻・ハッシュ。サイズと更新時刻が前回と同じならハッシュを再利用する"""
+    st = os.stat(session['raw_path'])
+    raw = {'name': os.path.basename(session['raw_path']), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if previous and all(previous.get(k) == raw[k] for k in ('name', 'size', 'mtime_ns')) and previous.get('sha256'):
+        raw['sha256'] = previous['sha256']
+    return raw
+
+
+def _lap_marks_sha256(session: Dict[str, str]) -> Optional[str]:
+    """計測中に SPACE で記録した周回の区切り (lap_marks.json)。手で直した場合も再解析の対象にする"""
+    import laps
+    import run_store
+
+    path = os.path.join(session['dir'], laps.LAP_MARKS_NAME)
+    return run_store.file_sha256(path) if os.path.exists(path) else None
+
+
+def session_options(session: Dict[str, Any], kinematics_dt: Optional[float] = None,
+                    lap_gate_radius: Optional[float] = None) -> Dict[str, Any]:
+    """セッションを計測した時のコース画像と解析オプション (引数で指定した値はそちらを優先する)"""
+    import kinematics
+    import laps
+    import run_store
+
+    try:
+        settings = run_store.load_session_settings(session['dir'])
+    except (OSError, ValueError):
+        settings = {}
+    image_path, warning = run_store.session_course_image(session['dir'], settings)
+    if kinematics_dt is None:
+        kinematics_dt = settings.get('kinematics_dt', kinematics.DT_S)
+    if lap_gate_radius is None:
+        lap_gate_radius = settings.get('lap_gate_radius', laps.GATE_RADIUS_CM)
+    return {'image_path': image_path, 'image_warning': warning,
+            'kinematics_dt': kinematics_dt, 'lap_gate_radius': lap_gate_radius}
+
+
+def process_session(session: Dict[str, Any], plot_engine: str, map_match: bool = False) -> Dict[str, Any]:
+    """1セッション分の analyze + plot (ワーカープロセスで実行される)。session には session_options() の値が入っている"""
+    import FootPrint
+    import run_metrics
+
+    t0 = time.perf_counter()
+    context = {
+        'output_dir': session['dir'], 'image_path': session['image_path'], 'raw_log_path': session['raw_path'],
+        'analysis_log_path': os.path.join(session['dir'], "analyze.log"),
+        'plot_path': os.path.join(session['dir'], "trajectory_plot.png"),
+        'final_total_mickey_distance': 0.0, 'plot_engine': plot_engine, 'map_match': map_match,
+        'kinematics_dt': session['kinematics_dt'], 'lap_gate_radius': session['lap_gate_radius'],
+    }
+    result = {'key': session['key']}
+    metrics = run_metrics.RunMetrics(settings={'plot_engine': plot_engine, 'map_match': map_match,
+                                               'kinematics_dt': session['kinematics_dt']})
+    try:
+        with metrics.stage('reanalyze') as analyze_stage:
+            analysis = FootPrint.run_analysis(context)
+            analyze_stage.rows = rows = analysis['rows']
+        result.update({k: analysis[k] for k in ('track', 'kinematics', 'map_match', 'warnings')})
+        result['laps'] = {k: v for k, v in analysis['laps'].items() if k != 'laps'}
+        t_analyze = time.perf_counter()
+        with metrics.stage('replot') as plot_stage:
+            FootPrint.render_plot(context)
+            if analysis['map_match'] is not None:
+                FootPrint.render_matched_plot(context)
+            plot_stage.rows = rows
+        t_plot = time.perf_counter()
+        result.update({
+            'ok': True, 'rows': rows, 'total_mickey_distance': analysis['total_mickey_distance'],
+            'analyze_s': t_analyze - t0, 'plot_s': t_plot - t_analyze, 'seconds': t_plot - t0,
+        })
+    except Exception as e:
+        result.update({'ok': False, 'error': f"{type(e).__name__}: {e}", 'seconds': time.perf_counter() - t0})
+    try:
+        # 計測時の工程 (acquire など) は残し、再解析の工程だけ上書きする
+        metrics.save(os.path.join(session['dir'], run_metrics.RUN_METRICS_NAME), merge=True)
+    except OSError:
+        pass
+    return result
+
+
+def _outputs_exist(session: Dict[str, str]) -> bool:
+    return all(os.path.exists(os.path.join(session['dir'], name)) for name in ("analyze.log", "trajectory_plot.png"))
+
+
+def run(log_root: str, mice: Optional[List[str]], jobs: Optional[int], plot_engine: str, force: bool,
+        dry_run: bool, map_match: bool = False, kinematics_dt: Optional[float] = None,
+        lap_gate_radius: Optional[float] = None) -> int:
+    import course_geometry
+    import run_store
+
+    manifest_path = os.path.join(log_root, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    previous_sessions = manifest['sessions']
+
+    sessions = find_sessions(log_root, mice)
+    if not sessions:
+        print(f"⚠️ 生データのあるセッションが見つかりません: {log_root}")
+        return 0
+
+    # セッションごとに計測時のコース画像 (と同じ日時のコースデータ) とオプションを使う
+    digests: Dict[str, Optional[str]] = {}
+
+    def digest(path: Optional[str]) -> Optional[str]:
+        if not path or not os.path.exists(path):
+            return None
+        if path not in digests:
+            digests[path] = run_store.file_sha256(path)
+        return digests[path]
+
+    print("=" * 70)
+    print(f"📂 対象: {log_root} ({len(sessions)} セッション)")
+    for s in sessions:
+        s.update(session_options(s, kinematics_dt, lap_gate_radius))
+        if s['image_warning']:
+            print(f"{s['image_warning']} ({s['key']})")
+        s['course_data'] = course_geometry.find_course_data(s['image_path'])
+        s['image_sha256'] = digest(s['image_path'])
+        s['course_data_sha256'] = digest(s['course_data'])
+        s['params'] = analysis_params(plot_engine, map_match, s['kinematics_dt'], s['lap_gate_radius'])
+    images = sorted({os.path.basename(s['image_path']) if s['image_sha256'] else 'なし (白紙)' for s in sessions})
+    print(f"🖼️ 背景画像 (計測時): {', '.join(images)}")
+
+    t_start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        # --- 1. 生データの指紋 (変更のあったファイルだけハッシュを計算) ---
+        raws = {s['key']: _fingerprint(s, previous_sessions.get(s['key'], {}).get('raw')) for s in sessions}
+        need_hash = [s for s in sessions if 'sha256' not in raws[s['key']]]
+        if need_hash:
+            print(f"🔎 ハッシュ計算: {len(need_hash)} ファイル")
+            for s, digest in zip(need_hash, pool.map(run_store.file_sha256, [s['raw_path'] for s in need_hash])):
+                raws[s['key']]['sha256'] = digest
+        t_hash = time.perf_counter()
+
+        # --- 2. 前回から変わったセッションを選ぶ ---
+        todo = []
+        for s in sessions:
+            prev = previous_sessions.get(s['key'])
+            unchanged = (prev is not None and prev.get('ok')
+                         and prev.get('raw', {}).get('sha256') == raws[s['key']]['sha256']
+                         and prev.get('image_sha256') == s['image_sha256']
+                         and prev.get('course_data_sha256') == s['course_data_sha256']
+                         and prev.get('params') == s['params']
+                         and prev.get('lap_marks_sha256') == _lap_marks_sha256(s)
+                         and _outputs_exist(s))
+            if force or not unchanged:
+                todo.append(s)
+        print(f"🔁 再解析: {len(todo)} セッション / スキップ: {len(sessions) - len(todo)} セッション "
+              f"(指紋 {t_hash - t_start:.2f} s)")
+        print("=" * 70)
+        if dry_run:
+            for s in todo:
+                print(f"   {s['key']}")
+            return 0
+        if not todo:
+            return 0
+
+        # --- 3. analyze + plot を並列実行 ---
+        failed = 0
+        busy_s = 0.0
+        sessions_by_key = {s['key']: s for s in todo}
+        futures = [pool.submit(process_session, s, plot_engine, map_match) for s in todo]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            result = future.result()
+            key = result['key']
+            busy_s += result['seconds']
+            prefix = f"[{done:>{len(str(len(todo)))}}/{len(todo)}]"
+            for warning in result.get('warnings') or []:
+                print(f"{prefix} {key}: {warning}")
+            if result['ok']:
+                print(f"{prefix} ✅ {key}: {result['seconds']:.2f} s (解析 {result['analyze_s']:.2f} s / "
+                      f"描画 {result['plot_s']:.2f} s, {result['rows']:,} 行, {result['total_mickey_distance']:.0f} Mickey)")
+                if result.get('track') and result['track']['samples']:
+                    print(f"      コース上 {result['track']['on_track_percent']:.1f}% / コース外 {result['track']['offtrack_events']} 回")
+                if result.get('laps') and result['laps']['best_lap'] is not None:
+                    print(f"      {result['laps']['complete_laps']} 周 / ベスト {result['laps']['best_time_s']:.3f} s / "
+                          f"平均 {result['laps']['mean_time_s']:.3f} s")
+                if result.get('map_match') and result['map_match']['steps']:
+                    print(f"      マップマッチング 補正量 平均 {result['map_match']['mean_correction_cm']:.1f} cm / "
+                          f"最大 {result['map_match']['max_correction_cm']:.1f} cm")
+            else:
+                failed += 1
+                print(f"{prefix} ❌ {key}: {result['error']}")
+            s = sessions_by_key[key]
+            previous_sessions[key] = {
+                'raw': raws[key], 'lap_marks_sha256': _lap_marks_sha256(s), 'image_sha256': s['image_sha256'],
+                'course_data_sha256': s['course_data_sha256'], 'params': s['params'],
+                'ok': result['ok'], 'track': result.get('track'), 'map_match': result.get('map_match'),
+                'kinematics': result.get('kinematics'), 'laps': result.get('laps'),
+                'seconds': result['seconds'], 'rows': result.get('rows'),
+                'total_mickey_distance': result.get('total_mickey_distance'), 'error': result.get('error'),
+                'processed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            # 中断されてもそこまでの結果を次回に活かせるよう、1件ごとに保存する
+            save_manifest(manifest_path, manifest)
+
+    # --- 4. 作り直した要約を実行記録 (Log/run_store/) にまとめて追記 ---
+    import run_store
+    store = run_store.RunStore(os.path.join(log_root, run_store.STORE_DIR_NAME))
+    stored = store.ingest([s['dir'] for s in todo])
+    if stored['ingested']:
+        print(f"🗄️ 実行記録に追加: {stored['ingested']} セッション (計 {len(store)} セッション)")
+
+    wall = time.perf_counter() - t_start
+    print("-" * 70)
+    print(f"🎉 完了: {len(todo) - failed} 成功 / {failed} 失敗 / 合計 {wall:.2f} s "
+          f"(セッション処理時間の合計 {busy_s:.2f} s, 並列化 x{busy_s / wall if wall > 0 else 0:.1f})")
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Log/ 配下のセッションを一括で再解析・再描画する")
+    parser.add_argument('--log-root', default=os.path.join(_BASE_DIR, "Log"), help="走査する Log ディレクトリ")
+    parser.add_argument('--mouse', action='append', help="対象のマウス名 (複数指定可。省略時は全て)")
+    parser.add_argument('--jobs', type=int, default=None, help="並列プロセス数 (省略時は CPU コア数)")
+    parser.add_argument('--plot-engine', choices=['raster', 'matplotlib'], default='raster')
+    parser.add_argument('--map-match', action='store_true', help="コース中心線へのマップマッチングも行う")
+    parser.add_argument('--kinematics-dt', type=float, metavar='SECONDS',
+                        help="運動量を再標本化する間隔 [s] (省略時は各セッションの計測時の値。0 で無効)")
+    parser.add_argument('--lap-gate-radius', type=float, metavar='CM',
+                        help="周回ゲートの半径 [cm] (省略時は各セッションの計測時の値)")
+    parser.add_argument('--force', action='store_true', help="変更の有無に関わらず全セッションを処理する")
+    parser.add_argument('--dry-run', action='store_true', help="対象セッションを表示するだけで処理しない")
+    args = parser.parse_args(argv)
+
+    # ワーカーごとに pygame の起動メッセージが出ないようにする
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    try:
+        return run(args.log_root, args.mouse, args.jobs, args.plot_engine, args.force, args.dry_run, args.map_match,
+                   args.kinematics_dt, args.lap_gate_radius)
+    except OSError as e:
+        print(f"\n❌ 一括再解析中にエラー: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
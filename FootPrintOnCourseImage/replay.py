@@ -0,0 +1,153 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from typing import Any, Dict, Iterator
+
+import raw_format
+import raw_writer
+
+# =============================================================================
+# 生データの再生 (ヘッドレス)
+# =============================================================================
+#
+# 既存の raw_data.log / raw_data.bin を取得工程に流し直し、解析・描画まで通しで実行する。
+# pygame のウィンドウもマウスも使わないため、同じ入力で何度でも同じ負荷を再現できる。
+#   realtime : 記録時のタイムスタンプどおりの速さで書き込みスレッドに渡す (取得ループの代わり)
+#   max      : 待たずにできるだけ速く流す (スループット計測用)
+# 再生時もタイムスタンプと積算値は元のまま書き出すため、CSV -> CSV なら元ファイルと一致する。
+#
+# 実行例:
+#   py -3.12 replay.py Log/G304_Test01/G304_Test01_20251207_143200/raw_data.log
+#   py -3.12 replay.py raw_data.bin --speed max --mouse Replay --raw-format binary
+
+REPLAY_SPEEDS = ('realtime', 'max')
+BUFFER_SIZE: int = 5000
+
+
+def iter_source_records(source_path: str) -> Iterator[np.ndarray]:
+    """再生元の生データをレコード配列のチャンクとして返す (形式は自動判定)"""
+    if raw_format.is_binary(source_path):
+        return raw_format.iter_record_chunks(source_path)
+    return raw_format.iter_csv_chunks(source_path)
+
+
+def replay_records(context: Dict[str, Any], chunks: Iterator[np.ndarray], speed: str = 'realtime',
+                   header: Dict[str, Any] = None) -> Dict[str, Any]:
+    """レコードのチャンク列を取得工程と同じ書き込みスレッド経由で context['raw_log_path'] に書き出す"""
+    if speed not in REPLAY_SPEEDS:
+        raise ValueError(f"未対応の再生速度です: {speed}")
+    binary = context['raw_format'] == 'binary'
+    if header is None:
+        header = raw_format.default_header()
+    writer = raw_writer.RawLogWriter(context['raw_log_path'], binary, header, BUFFER_SIZE,
+                                     policy=context.get('backpressure', 'block'))
+    buf = writer.acquire_buffer()
+    count = 0
+    samples = 0
+    max_lag_s = 0.0
+    last = None
+    start_ns = time.perf_counter_ns()
+    try:
+        for chunk in chunks:
+            n = len(chunk)
+            if n == 0:
+                continue
+            ts = chunk['Timestamp_s']
+            i = 0
+            while i < n:
+                if speed == 'realtime':
+                    now = (time.perf_counter_ns() - start_ns) / 1e9
+                    # 記録時刻を過ぎたサンプルをまとめて渡す
+                    j = int(np.searchsorted(ts, now, side='right'))
+                    if j <= i:
+                        time.sleep(float(ts[i]) - now)
+                        continue
+                    max_lag_s = max(max_lag_s, now - float(ts[i]))
+                else:
+                    j = n
+                while i < j:
+                    k = min(j - i, BUFFER_SIZE - count)
+                    buf[count:count + k] = chunk[i:i + k]
+                    count += k; i += k
+                    if count == BUFFER_SIZE:
+                        buf = writer.submit(buf, count)
+                        count = 0
+            samples += n
+            last = chunk[-1]
+    finally:
+        writer.close(buf, count)
+    elapsed = (time.perf_counter_ns() - start_ns) / 1e9
+    stats = {
+        'speed': speed, 'samples': samples, 'elapsed_s': elapsed,
+        'samples_per_s': samples / elapsed if elapsed > 0 else None,
+        'recorded_s': float(last['Timestamp_s']) if last is not None else 0.0,
+        'max_lag_ms': max_lag_s * 1000, 'writer': writer.stats(),
+    }
+    context['replay_stats'] = stats
+    context['writer_stats'] = stats['writer']
+    context['final_total_x'] = int(last['Total_X']) if last is not None else 0
+    context['final_total_y'] = int(last['Total_Y']) if last is not None else 0
+    return stats
+
+
+def replay_raw_data(context: Dict[str, Any], source_path: str, speed: str = 'realtime'):
+    """FootPrint.acquire_raw_data の代わりに、既存の生データを再生して取得工程を再現する"""
+    header = raw_format.read_header(source_path) if raw_format.is_binary(source_path) else None
+    print(f"▶️ 再生開始 ({speed}): {source_path}")
+    try:
+        stats = replay_records(context, iter_source_records(source_path), speed, header)
+    except Exception as e:
+        print(f"\n❌ 再生中にエラー: {e}")
+        if context.get('metrics') is not None:
+            context['metrics'].record_error('replay', e)
+        return
+    context['acquired_rows'] = stats['samples']
+    print(f"⏹️ 再生完了: {stats['samples']:,} サンプル / {stats['elapsed_s']:.2f} s "
+          f"(記録 {stats['recorded_s']:.2f} s, {stats['samples_per_s'] or 0:,.0f} サンプル/s)")
+    if speed == 'realtime':
+        print(f"   最大遅れ: {stats['max_lag_ms']:.2f} ms")
+
+
+def main(argv=None) -> int:
+    import FootPrint
+
+    parser = argparse.ArgumentParser(description="既存の生データを取得・解析・描画に流し直す (ウィンドウなし)")
+    parser.add_argument('source', help="再生する raw_data.log / raw_data.bin")
+    parser.add_argument('--speed', choices=list(REPLAY_SPEEDS), default='realtime',
+                        help="realtime: 記録時の速さで再生 / max: できるだけ速く再生")
+    parser.add_argument('--mouse', default="Replay", help="保存先のマウス名 (Log/<マウス名>/...)")
+    parser.add_argument('--raw-format', choices=['csv', 'binary'], default='csv')
+    parser.add_argument('--plot-engine', choices=['raster', 'matplotlib'], default='raster')
+    parser.add_argument('--map-match', action='store_true', help="コース中心線へのマップマッチングも行う")
+    parser.add_argument('--profile', action='store_true', help="工程ごとの cProfile の結果を profile_<工程>.prof に保存する")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        print(f"❌ 再生元が見つかりません: {args.source}")
+        return 1
+    context = None
+    try:
+        context = FootPrint._setup_context([sys.argv[0], args.mouse, '--raw-format', args.raw_format,
+                                            '--plot-engine', args.plot_engine]
+                                           + (['--map-match'] if args.map_match else [])
+                                           + (['--profile'] if args.profile else []))
+        FootPrint.start_metrics(context)
+        print(f"📂 保存先: {context['output_dir']}")
+        FootPrint.run_stage(context, 'replay', replay_raw_data, context, args.source, args.speed)
+        FootPrint.run_stage(context, 'analyze', FootPrint.analyze_raw_data, context)
+        FootPrint.run_stage(context, 'plot', FootPrint.plot_analysis_results, context)
+        FootPrint.run_stage(context, 'store', FootPrint.store_session, context)
+        print("-" * 70); print("🎉 全工程完了！")
+    except Exception as e:
+        print(f"予期せぬエラー: {e}")
+        return 1
+    finally:
+        if context is not None and 'metrics' in context:
+            FootPrint.save_metrics(context)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
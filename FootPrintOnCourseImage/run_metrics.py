@@ -0,0 +1,240 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+# =============================================================================
+# 工程ごとの計測 (run_metrics.json) と cProfile
+# =============================================================================
+#
+# main() の各工程 (計測・解析・描画など) を with metrics.stage('analyze'): で囲み、
+#   - 経過時間 (perf_counter) と CPU 時間 (process_time。書き込みスレッド等も含むプロセス全体)
+#   - ピーク RSS : Linux は工程の開始時に /proc/self/clear_refs でピークを戻すため工程ごとの値。
+#                  それ以外はプロセス開始からのピーク (Windows: PeakWorkingSetSize / macOS: ru_maxrss)
+#   - 読み書きしたバイト数: Linux は /proc/self/io の rchar / wchar、Windows は GetProcessIoCounters
+#   - 処理した行数 (工程ごとに呼び出し側が設定する)
+# を記録し、セッションディレクトリの run_metrics.json に書き出す。
+# 各工程の中で握りつぶされた例外も record_error() で記録し、成否を残す。
+# --profile 指定時は工程ごとの cProfile の結果を profile_<工程>.prof に保存する (python -m pstats で読める)。
+# 取れない値は null になる。
+
+RUN_METRICS_NAME: str = "run_metrics.json"
+PROFILE_NAME: str = "profile_{}.prof"
+VERSION: int = 1
+
+
+def _read_proc(name: str) -> Dict[str, int]:
+    values = {}
+    with open(f"/proc/self/{name}", 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            parts = value.split()
+            if parts and parts[0].isdigit():
+                values[key] = int(parts[0])
+    return values
+
+
+def _windows_counters() -> Dict[str, Optional[int]]:
+    import ctypes
+    from ctypes import wintypes
+
+    class IoCounters(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_ulonglong) for name in (
+            'ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount',
+            'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount')]
+
+    class MemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    handle = kernel32.GetCurrentProcess()
+    io = IoCounters()
+    mem = MemoryCounters()
+    mem.cb = ctypes.sizeof(mem)
+    result = {'read_bytes': None, 'written_bytes': None, 'peak_rss_bytes': None}
+    if kernel32.GetProcessIoCounters(handle, ctypes.byref(io)):
+        result['read_bytes'] = io.ReadTransferCount
+        result['written_bytes'] = io.WriteTransferCount
+    if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(mem), mem.cb):
+        result['peak_rss_bytes'] = mem.PeakWorkingSetSize
+    return result
+
+
+def reset_peak_rss() -> bool:
+    """Linux のみ: プロセスのピーク RSS (VmHWM) を現在の値に戻す。戻せたら True"""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def resource_counters() -> Dict[str, Optional[int]]:
+    """累積の読み書きバイト数とピーク RSS [byte]。取れない値は None"""
+    try:
+        if sys.platform.startswith('linux'):
+            io = _read_proc('io')
+            status = _read_proc('status')
+            return {'read_bytes': io.get('rchar'), 'written_bytes': io.get('wchar'),
+                    'peak_rss_bytes': status['VmHWM'] * 1024 if 'VmHWM' in status else None}
+        if sys.platform == 'win32':
+            return _windows_counters()
+        import resource
+        # macOS の ru_maxrss はバイト単位
+        return {'read_bytes': None, 'written_bytes': None,
+                'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    except (OSError, ValueError, AttributeError, ImportError):
+        return {'read_bytes': None, 'written_bytes': None, 'peak_rss_bytes': None}
+
+
+def _delta(end: Optional[int], start: Optional[int]) -> Optional[int]:
+    return end - start if end is not None and start is not None else None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if out.returncode != 0:
+        return None
+    return out.stdout.strip() or None
+
+
+def environment() -> Dict[str, Any]:
+    """ソフトウェアのバージョンとマシンの情報 (バージョンやマシンをまたいだ比較用)"""
+    versions = {}
+    for name in ('numpy', 'pygame', 'matplotlib'):
+        module = sys.modules.get(name)
+        versions[name] = getattr(module, '__version__', None) if module else None
+    return {
+        'git_commit': _git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+        'machine': platform.machine(), 'processor': platform.processor() or None, 'cpu_count': os.cpu_count(),
+        'packages': versions,
+    }
+
+
+class Stage:
+    """1工程分の計測。with を抜けたときに集計し、例外は記録してそのまま送出する"""
+
+    def __init__(self, metrics: 'RunMetrics', name: str):
+        self.metrics = metrics
+        self.name = name
+        self.rows: Optional[int] = None
+        self.error: Optional[str] = None
+        self.result: Dict[str, Any] = {}
+        self._profiler = None
+
+    def __enter__(self) -> 'Stage':
+        self._peak_reset = reset_peak_rss()
+        self._start = resource_counters()
+        self._cpu0 = time.process_time_ns()
+        if self.metrics.profile_dir is not None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._wall0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter_ns() - self._wall0
+        cpu = time.process_time_ns() - self._cpu0
+        profile_path = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            profile_path = os.path.join(self.metrics.profile_dir, PROFILE_NAME.format(self.name))
+            try:
+                self._profiler.dump_stats(profile_path)
+            except OSError:
+                profile_path = None
+        end = resource_counters()
+        if exc is not None:
+            self.error = "".join(traceback.format_exception_only(exc_type, exc)).strip()
+        self.error = self.error or self.metrics.errors.pop(self.name, None)
+        self.result = {
+            'stage': self.name, 'ok': self.error is None, 'error': self.error,
+            'wall_s': wall / 1e9, 'cpu_s': cpu / 1e9,
+            'cpu_percent': 100.0 * cpu / wall if wall > 0 else None,
+            'peak_rss_bytes': end['peak_rss_bytes'], 'peak_rss_scope': 'stage' if self._peak_reset else 'process',
+            'read_bytes': _delta(end['read_bytes'], self._start['read_bytes']),
+            'written_bytes': _delta(end['written_bytes'], self._start['written_bytes']),
+            'rows': self.rows,
+            'rows_per_s': self.rows / (wall / 1e9) if self.rows and wall > 0 else None,
+            'profile': os.path.basename(profile_path) if profile_path else None,
+        }
+        self.metrics.stages.append(self.result)
+        return False
+
+
+class RunMetrics:
+    """セッション1回分の工程ごとの計測結果"""
+
+    def __init__(self, profile_dir: Optional[str] = None, settings: Optional[Dict[str, Any]] = None):
+        self.profile_dir = profile_dir
+        self.settings = settings or {}
+        self.stages: List[Dict[str, Any]] = []
+        # 工程の中で捕まえて表示だけした例外 (工程名 -> メッセージ)
+        self.errors: Dict[str, str] = {}
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def stage(self, name: str) -> Stage:
+        return Stage(self, name)
+
+    def record_error(self, stage: str, error: BaseException):
+        self.errors[stage] = f"{type(error).__name__}: {error}"
+
+    def to_dict(self, stages: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        stages = self.stages if stages is None else stages
+        return {
+            'version': VERSION, 'started_at': self.started_at, 'settings': self.settings,
+            'environment': environment(), 'stages': stages,
+            'total_wall_s': sum(s['wall_s'] for s in stages),
+            'total_cpu_s': sum(s['cpu_s'] for s in stages),
+            'ok': all(s['ok'] for s in stages),
+        }
+
+    def save(self, path: str, merge: bool = False) -> Dict[str, Any]:
+        """run_metrics.json に保存する。merge=True なら既存のファイルの他の工程 (再解析時の計測など) を残す"""
+        stages = self.stages
+        settings = self.settings
+        if merge and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    old = json.load(f)
+            except (OSError, ValueError):
+                old = {}
+            names = {s['stage'] for s in stages}
+            stages = [s for s in old.get('stages', []) if s.get('stage') not in names] + stages
+            settings = {**old.get('settings', {}), **settings}
+        summary = self.to_dict(stages)
+        summary['settings'] = settings
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        return summary
+
+
+def _mib(value: Optional[int]) -> str:
+    return "-" if value is None else f"{value / 2**20:.1f}"
+
+
+def print_metrics(summary: Dict[str, Any]):
+    print(f"📏 工程別の計測: 計 {summary['total_wall_s']:.2f} s (CPU {summary['total_cpu_s']:.2f} s)")
+    for s in summary['stages']:
+        rows = f"{s['rows']:,} 行" if s['rows'] is not None else "-"
+        mark = "✅" if s['ok'] else "❌"
+        print(f"   {mark} {s['stage']:<8} {s['wall_s']:8.3f} s  CPU {s['cpu_s']:7.3f} s  ピーク RSS {_mib(s['peak_rss_bytes']):>7} MiB  "
+              f"読込 {_mib(s['read_bytes']):>7} MiB  書込 {_mib(s['written_bytes']):>7} MiB  {rows}")
+        if s['error']:
+            print(f"      {s['error']}")
@@ -0,0 +1,612 @@
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import time
+import numpy as np
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import kinematics
+
+# =============================================================================
+# セッションをまたいだ実行記録 (列指向ストア) と集計 API
+# =============================================================================
+#
+# 各セッションの解析結果は Log/<マウス名>/<マウス名>_<日時>/ にテキストで散らばっているため、
+# 数か月分のセンサーや DPI 設定を比べるたびに全部を読み直すことになる。
+# 解析の最後に session_summary.json (定数・集計値・周回タイム) を書き、それを間引いた運動量とともに
+# Log/run_store/segment_NNNNNN.npz へ一度だけ取り込む。
+#   - 追記のみ : 取り込みのたびに新しいセグメントを書く (書き終えてから置き換えるので壊れたファイルは残らない)
+#   - 重複なし : (セッション, session_summary.json のハッシュ) が取り込み済みなら読み飛ばす。
+#                再解析で要約が変わったセッションは新しい行として追記し、検索では最新の行だけを使う
+#   - 列指向   : セッション表は列ごとの配列 (マウス名・開始日時・コース画像・定数が索引)。
+#                運動量と周回タイムはセッションごとの区間 (offsets) で持つ
+# 集計は生データや analyze.log を一切読まずに、セッション表の列だけで行う。
+#
+# 実行例:
+#   py -3.12 run_store.py ingest                                  (Log/ 配下の未取り込みセッションを追加)
+#   py -3.12 run_store.py list --mouse G304
+#   py -3.12 run_store.py query closure_error_cm --by mouse       (マウスごとの平均の距離誤差)
+#   py -3.12 run_store.py query best_lap_s --by mouse dpi --func min --since 2025-12-01
+#
+# Python からは:
+#   store = run_store.RunStore("Log/run_store")
+#   store.aggregate('closure_error_cm', by='mouse')    -> {'G304': {'value': 12.3, 'sessions': 8}, ...}
+
+STORE_DIR_NAME: str = "run_store"
+SESSION_SUMMARY_NAME: str = "session_summary.json"
+SESSION_SETTINGS_NAME: str = "session_settings.json"
+SUMMARY_VERSION: int = 1
+HASH_BLOCK_SIZE: int = 1 << 20      # ハッシュ計算で一度に読むバイト数
+SEGMENT_PREFIX: str = "segment_"
+# 取り込む運動量の間隔 [s]。kinematics.bin (既定 10 ms) をこの幅の区間平均に間引く
+KINEMATICS_STEP_S: float = 0.1
+KINEMATICS_COLUMNS = ['Time_s', 'X_cm', 'Y_cm', 'Speed_cm_s', 'Accel_cm_s2', 'YawRate_deg_s']
+# constants 列 (定数の組をまとめた文字列) に入れる定数。MICKEY_TO_CM は DPI から決まるので含めない
+CONSTANT_KEYS = ['dpi', 'polling_rate', 'cm_per_pixel', 'start_px_x', 'start_px_y']
+
+# セッション表の列と型。数値の欠損は float が NaN、int が -1
+SESSION_COLUMNS: List[Tuple[str, str]] = [
+    ('key', 'str'), ('mouse', 'str'), ('session', 'str'), ('started_at', 'time'),
+    ('course_image', 'str'), ('course_image_sha256', 'str'), ('course_data', 'str'),
+    ('constants', 'str'), ('dpi', 'int'), ('polling_rate', 'int'), ('mickey_to_cm', 'float'),
+    ('cm_per_pixel', 'float'), ('start_px_x', 'int'), ('start_px_y', 'int'), ('raw_format', 'str'),
+    ('rows', 'int'), ('duration_s', 'float'), ('distance_cm', 'float'), ('closure_error_cm', 'float'),
+    ('laps', 'int'), ('best_lap_s', 'float'), ('mean_lap_s', 'float'),
+    ('mean_lap_distance_cm', 'float'), ('lap_distance_std_cm', 'float'),
+    ('on_track_percent', 'float'), ('offtrack_events', 'int'),
+    ('mean_speed_cm_s', 'float'), ('max_speed_cm_s', 'float'),
+    ('max_abs_accel_cm_s2', 'float'), ('max_abs_yaw_rate_deg_s', 'float'),
+    ('map_match_mean_correction_cm', 'float'), ('map_match_final_correction_cm', 'float'),
+    ('summary_sha256', 'str'), ('ingested_at', 'time'),
+]
+_KINDS = dict(SESSION_COLUMNS)
+
+AGGREGATES = {
+    'mean': np.mean, 'median': np.median, 'min': np.min, 'max': np.max, 'sum': np.sum, 'std': np.std,
+    'count': len,
+}
+
+
+# =============================================================================
+# session_summary.json (1セッション分の要約)
+# =============================================================================
+
+def session_identity(session_dir: str) -> Tuple[str, str, Optional[str]]:
+    """セッションディレクトリ Log/<マウス名>/<名前>_<YYYYMMDD_HHMMSS> から (マウス名, 名前, 開始日時 ISO 形式)"""
+    session_dir = os.path.abspath(session_dir)
+    session = os.path.basename(session_dir)
+    mouse = os.path.basename(os.path.dirname(session_dir))
+    try:
+        started = datetime.datetime.strptime(session[-15:], '%Y%m%d_%H%M%S').isoformat()
+    except ValueError:
+        started = None
+    return mouse, session, started
+
+
+def file_sha256(path: str) -> str:
+    # hashlib.file_digest は Python 3.11 以降にしかないので、ブロックごとに読んで足し込む
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_session_settings(context: Dict[str, Any]) -> Dict[str, Any]:
+    """計測時のコース画像と解析オプション (reanalyze.py が同じ条件で作り直すために使う)"""
+    image_path = context['image_path']
+    exists = bool(image_path) and os.path.exists(image_path)
+    return {
+        'course_image': os.path.basename(image_path) if exists else None,
+        'course_image_sha256': file_sha256(image_path) if exists else None,
+        'kinematics_dt': context.get('kinematics_dt'),
+        'lap_gate_radius': context.get('lap_gate_radius'),
+    }
+
+
+def save_session_settings(path: str, settings: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(settings, f, indent=2, ensure_ascii=False)
+
+
+def load_session_settings(session_dir: str) -> Dict[str, Any]:
+    """session_settings.json を読む。無い (古い) セッションは session_summary.json から分かる範囲だけを返す"""
+    path = os.path.join(session_dir, SESSION_SETTINGS_NAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    path = os.path.join(session_dir, SESSION_SUMMARY_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    if summary.get('settings'):
+        return summary['settings']
+    settings = {}
+    if 'course_image' in summary:
+        settings['course_image'] = summary['course_image']
+    if (summary.get('kinematics') or {}).get('dt_s'):
+        settings['kinematics_dt'] = summary['kinematics']['dt_s']
+    if (summary.get('laps') or {}).get('gate_radius_cm') is not None:
+        settings['lap_gate_radius'] = summary['laps']['gate_radius_cm']
+    return settings
+
+
+def _image_stamp(path: str) -> Optional[str]:
+    """CourseImage_YYYYMMDD_HHMMSS.jpg の日時部分 (無ければ None)"""
+    match = re.search(r'(\d{8}_\d{6})', os.path.basename(os.path.normpath(path)))
+    return match.group(1) if match else None
+
+
+def find_course_image(base_dir: str, before: Optional[str] = None) -> str:
+    """base_dir 内の CourseImage*.jpg のうち、名前順で最新のもの (FootPrint の計測と同じ選び方)"""
+    # --- 画像ファイルの自動検索ロジック ---
+    # ルール: "CourseImage" で始まり、".jpg" または ".jpeg" で終わるファイル
+    # before (YYYYMMDD_HHMMSS) を渡すと、その日時までに作られた画像から選ぶ (過去のセッションの再描画用)
+    image_candidates = []
+    try:
+        for f in os.listdir(base_dir):
+            if f.startswith("CourseImage") and (f.lower().endswith(".jpg") or f.lower().endswith(".jpeg")):
+                image_candidates.append(os.path.join(base_dir, f))
+    except FileNotFoundError:
+        pass
+
+    if image_candidates and before is not None:
+        # 名前に日時の無い画像は候補に残す。該当が無ければ全体から選ぶ
+        earlier = [p for p in image_candidates if (_image_stamp(p) or before) <= before]
+        image_candidates = earlier or image_candidates
+    if image_candidates:
+        # 名前順で降順ソート（日付が入っていれば最新が先頭に来る想定）
+        image_candidates.sort(reverse=True)
+        image_path = image_candidates[0]
+    else:
+        # 見つからない場合はデフォルト名（後のチェックでエラーになる）
+        image_path = os.path.join(base_dir, "CourseImage.jpg")
+    return image_path
+
+
+def session_course_image(session_dir: str, settings: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """セッションを計測した時のコース画像のパスと、代わりの画像を使う場合の警告 (無ければ None)
+
+    settings は load_session_settings() の結果。計測時に背景画像が無かったセッションは空文字列 (白紙) を返す。
+    記録が無い・画像が消えている場合は、セッションの日時までに作られた最新の画像を使う。
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    warning = None
+    if 'course_image' in settings:
+        name = settings['course_image']
+        if name is None:
+            return "", None
+        path = os.path.join(base_dir, name)
+        if os.path.exists(path):
+            return path, None
+        warning = f"⚠️ 計測時のコース画像 {name} が見つからないため、"
+    path = find_course_image(base_dir, _image_stamp(session_dir))
+    if warning is not None:
+        warning += f"{os.path.basename(path)} を使います" if os.path.exists(path) else "白紙に描きます"
+    return path, warning
+
+
+def build_session_summary(context: Dict[str, Any], constants: Dict[str, Any]) -> Dict[str, Any]:
+    """解析の各工程が context に残した集計値から session_summary.json の内容を作る"""
+    mouse, session, started = session_identity(context['output_dir'])
+    image_path = context['image_path']
+    has_image = bool(image_path) and os.path.exists(image_path)
+    lap = context.get('lap_summary') or {}
+    complete = [l for l in lap.get('laps', []) if l['complete']]
+    closure = None
+    if 'end_x_cm' in lap:
+        # 終点とスタート地点の距離。スタート地点に戻って止めた計測なら、これが推測航法の累積誤差になる
+        start_x = constants['start_px_x'] * constants['cm_per_pixel']
+        start_y = constants['start_px_y'] * constants['cm_per_pixel']
+        closure = math.hypot(lap['end_x_cm'] - start_x, lap['end_y_cm'] - start_y)
+    track = context.get('track_summary')
+    return {
+        'version': SUMMARY_VERSION, 'mouse': mouse, 'session': session, 'started_at': started,
+        'raw_file': os.path.basename(context['raw_log_path']),
+        'course_image': os.path.basename(image_path) if has_image else None,
+        'course_image_sha256': file_sha256(image_path) if has_image else None,
+        'course_data': os.path.basename(track['course_data']) if track else None,
+        'constants': constants, 'settings': build_session_settings(context),
+        'rows': lap.get('rows', context.get('analyzed_rows')),
+        'duration_s': lap.get('duration_s'), 'distance_cm': lap.get('distance_cm'),
+        'total_mickey_distance': context.get('final_total_mickey_distance'),
+        'end_x_cm': lap.get('end_x_cm'), 'end_y_cm': lap.get('end_y_cm'), 'closure_error_cm': closure,
+        'laps': {k: v for k, v in lap.items() if k != 'laps'},
+        'lap_times_s': [l['time_s'] for l in complete],
+        'lap_distances_cm': [l['distance_cm'] for l in complete],
+        'track': track, 'kinematics': context.get('kinematics_summary'),
+        'map_match': context.get('map_match_summary'),
+        'analyzed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save_session_summary(path: str, summary: Dict[str, Any]):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+def _session_row(summary: Dict[str, Any], summary_sha: str, ingested_at: np.datetime64) -> Dict[str, Any]:
+    """session_summary.json をセッション表の1行 (列名 -> 値) にする"""
+    c = summary.get('constants') or {}
+    lap = summary.get('laps') or {}
+    track = summary.get('track') or {}
+    kin = summary.get('kinematics') or {}
+    mm = summary.get('map_match') or {}
+    distances = summary.get('lap_distances_cm') or []
+    raw_file = summary.get('raw_file') or ""
+    return {
+        'key': f"{summary['mouse']}/{summary['session']}", 'mouse': summary['mouse'], 'session': summary['session'],
+        'started_at': summary.get('started_at'),
+        'course_image': summary.get('course_image'), 'course_image_sha256': summary.get('course_image_sha256'),
+        'course_data': summary.get('course_data'),
+        'constants': " ".join(f"{k}={c.get(k)}" for k in CONSTANT_KEYS),
+        'dpi': c.get('dpi'), 'polling_rate': c.get('polling_rate'), 'mickey_to_cm': c.get('mickey_to_cm'),
+        'cm_per_pixel': c.get('cm_per_pixel'), 'start_px_x': c.get('start_px_x'), 'start_px_y': c.get('start_px_y'),
+        'raw_format': 'binary' if raw_file.endswith('.bin') else 'csv',
+        'rows': summary.get('rows'), 'duration_s': summary.get('duration_s'),
+        'distance_cm': summary.get('distance_cm'), 'closure_error_cm': summary.get('closure_error_cm'),
+        'laps': lap.get('complete_laps'), 'best_lap_s': lap.get('best_time_s'), 'mean_lap_s': lap.get('mean_time_s'),
+        'mean_lap_distance_cm': lap.get('mean_distance_cm'),
+        'lap_distance_std_cm': float(np.std(distances)) if len(distances) > 1 else None,
+        'on_track_percent': track.get('on_track_percent'), 'offtrack_events': track.get('offtrack_events'),
+        'mean_speed_cm_s': kin.get('mean_speed_cm_s'), 'max_speed_cm_s': kin.get('max_speed_cm_s'),
+        'max_abs_accel_cm_s2': kin.get('max_abs_accel_cm_s2'),
+        'max_abs_yaw_rate_deg_s': kin.get('max_abs_yaw_rate_deg_s'),
+        'map_match_mean_correction_cm': mm.get('mean_correction_cm'),
+        'map_match_final_correction_cm': mm.get('final_correction_cm'),
+        'summary_sha256': summary_sha, 'ingested_at': ingested_at,
+    }
+
+
+def _column_array(kind: str, values: Sequence[Any]) -> np.ndarray:
+    if kind == 'str':
+        return np.array(["" if v is None else str(v) for v in values], dtype=str)
+    if kind == 'int':
+        return np.array([-1 if v is None else int(v) for v in values], dtype=np.int64)
+    if kind == 'float':
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    return np.array([np.datetime64('NaT') if v is None else np.datetime64(v, 's') for v in values],
+                    dtype='datetime64[s]')
+
+
+def _missing_column(kind: str, n: int) -> np.ndarray:
+    return _column_array(kind, [None] * n)
+
+
+def downsample_kinematics(path: str, step_s: float = KINEMATICS_STEP_S) -> Dict[str, np.ndarray]:
+    """kinematics.bin を step_s 幅の区間平均に間引く (無ければ空の列)"""
+    data = kinematics.read_kinematics(path, KINEMATICS_COLUMNS) if os.path.exists(path) else {}
+    n = len(data.get('Time_s', ()))
+    if n == 0:
+        return {name: np.zeros(0, dtype=np.float32) for name in KINEMATICS_COLUMNS}
+    dt = data['Time_s'][1] - data['Time_s'][0] if n > 1 else step_s
+    k = max(1, int(round(step_s / dt)))
+    starts = np.arange(0, n, k)
+    counts = np.diff(np.append(starts, n))
+    return {name: (np.add.reduceat(data[name].astype(np.float64), starts) / counts).astype(np.float32)
+            for name in KINEMATICS_COLUMNS}
+
+
+def find_session_dirs(log_root: str) -> List[str]:
+    """session_summary.json を持つ Log/<マウス名>/<セッション>/ を列挙する"""
+    dirs = []
+    if not os.path.isdir(log_root):
+        return dirs
+    for mouse in sorted(os.listdir(log_root)):
+        mouse_dir = os.path.join(log_root, mouse)
+        if mouse == STORE_DIR_NAME or not os.path.isdir(mouse_dir):
+            continue
+        for name in sorted(os.listdir(mouse_dir)):
+            if os.path.isfile(os.path.join(mouse_dir, name, SESSION_SUMMARY_NAME)):
+                dirs.append(os.path.join(mouse_dir, name))
+    return dirs
+
+
+def store_path_for_session(session_dir: str) -> str:
+    """Log/<マウス名>/<セッション>/ に対応するストア Log/run_store/"""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(session_dir))), STORE_DIR_NAME)
+
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, set, np.ndarray)) else [value]
+
+
+# =============================================================================
+# ストア本体
+# =============================================================================
+
+class RunStore:
+    """Log/run_store/ の全セグメントを読み、セッションごとの最新の行だけを集計の対象にする
+
+    セッション表は起動時に全セグメントから読み込む (列ごとの小さな配列なので速い)。
+    運動量と周回タイムは要求されたセッションのセグメントだけを開いて切り出す。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.segments: List[str] = []
+        # 取り込み済みの (セッション, 要約のハッシュ)。古い版の行も含む
+        self._known: set = set()
+        self.columns: Dict[str, np.ndarray] = {name: _missing_column(kind, 0) for name, kind in SESSION_COLUMNS}
+        self._segment = np.zeros(0, dtype=np.int64)
+        self._row = np.zeros(0, dtype=np.int64)
+        self.reload()
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    def reload(self):
+        if os.path.isdir(self.path):
+            self.segments = sorted(os.path.join(self.path, f) for f in os.listdir(self.path)
+                                   if f.startswith(SEGMENT_PREFIX) and f.endswith('.npz'))
+        else:
+            self.segments = []
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name, _ in SESSION_COLUMNS}
+        segment, row = [], []
+        for i, path in enumerate(self.segments):
+            with np.load(path) as z:
+                n = len(z['session_key'])
+                for name, kind in SESSION_COLUMNS:
+                    # 後から増えた列は古いセグメントでは欠損とする
+                    field = f"session_{name}"
+                    parts[name].append(z[field] if field in z.files else _missing_column(kind, n))
+            segment.append(np.full(n, i, dtype=np.int64)); row.append(np.arange(n, dtype=np.int64))
+        if not segment:
+            return
+        columns = {name: np.concatenate(values) for name, values in parts.items()}
+        segment = np.concatenate(segment); row = np.concatenate(row)
+        self._known = set(zip(columns['key'].tolist(), columns['summary_sha256'].tolist()))
+
+        # 同じセッションが複数あれば最後に追記した行を使う
+        keys = columns['key']
+        _, last = np.unique(keys[::-1], return_index=True)
+        latest = len(keys) - 1 - last
+        latest = latest[np.lexsort((keys[latest], columns['started_at'][latest]))]
+        self.columns = {name: values[latest] for name, values in columns.items()}
+        self._segment = segment[latest]; self._row = row[latest]
+
+    # --- 取り込み ---
+
+    def ingest(self, session_dirs: Iterable[str], kinematics_step_s: float = KINEMATICS_STEP_S) -> Dict[str, Any]:
+        """session_summary.json を持つセッションのうち、未取り込み (または要約が変わった) ものを1セグメントに追記する"""
+        t0 = time.perf_counter()
+        now = np.datetime64(datetime.datetime.now().replace(microsecond=0), 's')
+        rows, kin, lap_times, lap_distances = [], [], [], []
+        skipped = missing = 0
+        for session_dir in session_dirs:
+            path = os.path.join(session_dir, SESSION_SUMMARY_NAME)
+            if not os.path.isfile(path):
+                missing += 1
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+            # 解析し直しただけで結果が同じなら取り込み直さないよう、解析日時を除いてハッシュする
+            content = {k: v for k, v in summary.items() if k != 'analyzed_at'}
+            sha = hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+            row = _session_row(summary, sha, now)
+            if (row['key'], sha) in self._known:
+                skipped += 1
+                continue
+            rows.append(row)
+            kin.append(downsample_kinematics(os.path.join(session_dir, kinematics.KINEMATICS_NAME), kinematics_step_s))
+            lap_times.append(summary.get('lap_times_s') or [])
+            lap_distances.append(summary.get('lap_distances_cm') or [])
+            self._known.add((row['key'], sha))
+
+        segment = None
+        if rows:
+            arrays = {f"session_{name}": _column_array(kind, [r[name] for r in rows]) for name, kind in SESSION_COLUMNS}
+            arrays.update(_ragged_arrays('kinematics', kin))
+            arrays.update(_ragged_arrays('lap', [{'time_s': np.asarray(t, dtype=np.float64),
+                                                  'distance_cm': np.asarray(d, dtype=np.float64)}
+                                                 for t, d in zip(lap_times, lap_distances)]))
+            segment = self._write_segment(arrays)
+            self.reload()
+        return {'ingested': len(rows), 'skipped': skipped, 'missing': missing, 'segment': segment,
+                'seconds': time.perf_counter() - t0}
+
+    def _write_segment(self, arrays: Dict[str, np.ndarray]) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        numbers = [int(os.path.basename(p)[len(SEGMENT_PREFIX):-4]) for p in self.segments]
+        path = os.path.join(self.path, f"{SEGMENT_PREFIX}{max(numbers, default=0) + 1:06d}.npz")
+        # 途中で中断されても壊れたセグメントを残さないよう、書き終えてから置き換える
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        return path
+
+    def compact(self) -> Optional[str]:
+        """最新の行だけを1つのセグメントにまとめ、古いセグメントを削除する"""
+        if len(self.segments) < 2:
+            return None
+        old = list(self.segments)
+        arrays = {f"session_{name}": values for name, values in self.columns.items()}
+        keys = self.columns['key'].tolist()
+        arrays.update(_ragged_arrays('kinematics', [self.kinematics(k) for k in keys]))
+        arrays.update(_ragged_arrays('lap', [self.laps(k) for k in keys]))
+        path = self._write_segment(arrays)
+        for p in old:
+            os.remove(p)
+        self.reload()
+        return path
+
+    # --- 検索と集計 ---
+
+    def select(self, mouse=None, since=None, until=None, course_image=None, **where) -> np.ndarray:
+        """条件に合うセッションの行番号。since は含み、until は含まない (日付または日時の文字列)。
+        where には任意の列を指定できる (値のリストならいずれかに一致)。例: select(dpi=[800, 1600])"""
+        mask = np.ones(len(self), dtype=bool)
+        if mouse is not None:
+            mask &= np.isin(self.columns['mouse'], _as_list(mouse))
+        if since is not None:
+            mask &= self.columns['started_at'] >= np.datetime64(since, 's')
+        if until is not None:
+            mask &= self.columns['started_at'] < np.datetime64(until, 's')
+        if course_image is not None:
+            mask &= np.isin(self.columns['course_image'], _as_list(course_image))
+        for name, value in where.items():
+            if name not in self.columns:
+                raise KeyError(f"セッション表に無い列です: {name}")
+            mask &= np.isin(self.columns[name], _as_list(value))
+        return np.flatnonzero(mask)
+
+    def table(self, columns: Optional[Sequence[str]] = None, **filters) -> Dict[str, np.ndarray]:
+        """条件に合うセッションの列 (列名 -> 配列)"""
+        rows = self.select(**filters)
+        return {name: self.columns[name][rows] for name in (columns or self.columns)}
+
+    def values(self, metric: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """数値の列を float で返す (欠損は NaN)"""
+        if _KINDS.get(metric) not in ('int', 'float'):
+            raise KeyError(f"集計できる数値の列ではありません: {metric}")
+        values = self.columns[metric] if rows is None else self.columns[metric][rows]
+        if _KINDS[metric] == 'int':
+            return np.where(values < 0, np.nan, values.astype(np.float64))
+        return values
+
+    def aggregate(self, metric: str, by: Union[str, Sequence[str]] = 'mouse', func: str = 'mean',
+                  **filters) -> Dict[Any, Dict[str, Any]]:
+        """metric をグループごとに集計する。欠損 (NaN) のセッションは除く
+
+        戻り値は {グループ: {'value': 集計値, 'sessions': 集計に使ったセッション数}}。
+        by に複数の列を渡すとグループはタプルになる。
+        """
+        if func not in AGGREGATES:
+            raise ValueError(f"未対応の集計です: {func} ({', '.join(AGGREGATES)})")
+        by = [by] if isinstance(by, str) else list(by)
+        rows = self.select(**filters)
+        values = self.values(metric, rows)
+        valid = ~np.isnan(values)
+        rows = rows[valid]; values = values[valid]
+        if not len(rows):
+            return {}
+        uniques, codes = zip(*(np.unique(self.columns[name][rows], return_inverse=True) for name in by))
+        group = np.ravel_multi_index(codes, [len(u) for u in uniques])
+        order = np.argsort(group, kind='stable')
+        group = group[order]; values = values[order]
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        result = {}
+        for begin, end in zip(starts, np.append(starts[1:], len(group))):
+            index = np.unravel_index(group[begin], [len(u) for u in uniques])
+            labels = tuple(u[i].item() for u, i in zip(uniques, index))
+            result[labels[0] if len(by) == 1 else labels] = {
+                'value': float(AGGREGATES[func](values[begin:end])), 'sessions': int(end - begin)}
+        return result
+
+    def _ragged(self, prefix: str, key: str, columns: Sequence[str]) -> Dict[str, np.ndarray]:
+        hit = np.flatnonzero(self.columns['key'] == key)
+        if not len(hit):
+            raise KeyError(f"取り込まれていないセッションです: {key}")
+        i = hit[0]
+        with np.load(self.segments[self._segment[i]]) as z:
+            offsets = z[f"{prefix}_offsets"]
+            begin, end = offsets[self._row[i]], offsets[self._row[i] + 1]
+            return {name: z[f"{prefix}_{name}"][begin:end] for name in columns}
+
+    def kinematics(self, key: str, columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """取り込み時に間引いた運動量 (KINEMATICS_STEP_S 間隔)"""
+        return self._ragged('kinematics', key, columns or KINEMATICS_COLUMNS)
+
+    def laps(self, key: str) -> Dict[str, np.ndarray]:
+        """完走した周回のタイムと距離"""
+        return self._ragged('lap', key, ['time_s', 'distance_cm'])
+
+    def iter_kinematics(self, columns: Optional[Sequence[str]] = None,
+                        **filters) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        """条件に合うセッションの (キー, 運動量) をセグメントごとにまとめて読みながら返す"""
+        columns = list(columns or KINEMATICS_COLUMNS)
+        rows = self.select(**filters)
+        for segment in np.unique(self._segment[rows]):
+            with np.load(self.segments[segment]) as z:
+                offsets = z['kinematics_offsets']
+                data = {name: z[f"kinematics_{name}"] for name in columns}
+                for i in rows[self._segment[rows] == segment]:
+                    begin, end = offsets[self._row[i]], offsets[self._row[i] + 1]
+                    yield str(self.columns['key'][i]), {name: values[begin:end] for name, values in data.items()}
+
+
+def _ragged_arrays(prefix: str, items: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """セッションごとの可変長の列を、連結した配列と区間の先頭位置 (offsets, 長さ N+1) にする"""
+    lengths = [len(next(iter(item.values()))) if item else 0 for item in items]
+    arrays = {f"{prefix}_offsets": np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)}
+    names = next((list(item) for item in items if item), [])
+    for name in names:
+        arrays[f"{prefix}_{name}"] = np.concatenate([item[name] for item in items])
+    return arrays
+
+
+# =============================================================================
+# コマンドライン
+# =============================================================================
+
+def print_aggregate(result: Dict[Any, Dict[str, Any]], metric: str, func: str, by: Sequence[str]):
+    if not result:
+        print(f"⚠️ {metric} の値を持つセッションがありません")
+        return
+    print(f"📈 {metric} の {func} ({' / '.join(by)} ごと)")
+    width = max(len(str(group)) for group in result)
+    for group, item in result.items():
+        print(f"   {str(group):<{width}}  {item['value']:12.3f}  ({item['sessions']} セッション)")
+
+
+def print_sessions(table: Dict[str, np.ndarray]):
+    print(f"🗄️ {len(table['key'])} セッション")
+    for i in range(len(table['key'])):
+        best = table['best_lap_s'][i]
+        print(f"   {table['key'][i]:<40} {str(table['started_at'][i]):<19} {table['distance_cm'][i]:10.1f} cm  "
+              f"{table['laps'][i]:>3} 周  ベスト {'-' if np.isnan(best) else f'{best:.3f} s':>9}  "
+              f"誤差 {table['closure_error_cm'][i]:7.1f} cm")
+
+
+def main(argv=None) -> int:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="セッションをまたいだ実行記録 (Log/run_store/) の取り込みと集計")
+    parser.add_argument('--log-root', default=os.path.join(base_dir, "Log"), help="Log ディレクトリ")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('ingest', help="session_summary.json を持つ未取り込みのセッションを追加する")
+    sub.add_parser('compact', help="セグメントを1つにまとめる")
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('--mouse', action='append', help="対象のマウス名 (複数指定可)")
+    filters.add_argument('--since', help="この日時以降に開始したセッション (例: 2025-12-01)")
+    filters.add_argument('--until', help="この日時より前に開始したセッション")
+    filters.add_argument('--course-image', help="コース画像のファイル名")
+    sub.add_parser('list', parents=[filters], help="取り込み済みのセッションを表示する")
+    p = sub.add_parser('query', parents=[filters], help="列をグループごとに集計する")
+    p.add_argument('metric', help="集計する数値の列 (例: closure_error_cm, best_lap_s, max_speed_cm_s)")
+    p.add_argument('--by', nargs='+', default=['mouse'], help="グループにする列 (例: mouse dpi constants)")
+    p.add_argument('--func', choices=list(AGGREGATES), default='mean')
+    args = parser.parse_args(argv)
+
+    store = RunStore(os.path.join(args.log_root, STORE_DIR_NAME))
+    try:
+        if args.command == 'ingest':
+            result = store.ingest(find_session_dirs(args.log_root))
+            print(f"🗄️ 取り込み: {result['ingested']} セッション / 取り込み済み {result['skipped']} セッション "
+                  f"({result['seconds']:.2f} s, 計 {len(store)} セッション)")
+        elif args.command == 'compact':
+            path = store.compact()
+            print(f"🗄️ {os.path.basename(path)} にまとめました" if path else "🗄️ まとめるセグメントはありません")
+        else:
+            filters = {'mouse': args.mouse, 'since': args.since, 'until': args.until, 'course_image': args.course_image}
+            if args.command == 'list':
+                print_sessions(store.table(**filters))
+            else:
+                print_aggregate(store.aggregate(args.metric, args.by, args.func, **filters), args.metric, args.func, args.by)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ 実行記録を処理できません: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+import time
+import pygame
+from typing import Any, Dict, Optional
+
+# =============================================================================
+# ポーリングループの周期制御 (スケジューラ)
+# =============================================================================
+#
+#   tick   : 従来どおり pygame.time.Clock.tick。OS のスリープ精度に依存し、1 ms 周期には粗い
+#   hybrid : 期限の手前まで time.sleep し、残りを perf_counter_ns でスピン待ちする。精度は高いが CPU を使う
+#   free   : 待たずに回し続け、pygame.MOUSEMOTION イベントの rel を合算して移動量とする。
+#            ポーリング間の相対移動を取りこぼさない代わりに CPU を1コア使い切る
+#
+# いずれも wait() をループの末尾で1回呼ぶ。drains_motion が True のスケジューラでは、
+# 移動量を get_rel ではなくイベントから取得する。
+# time_left_ns() は今周の期限までの残り時間 (期限を持たないスケジューラでは None)。
+# 描画など省略できる処理を、期限に間に合う時だけ行うために使う。
+
+SCHEDULERS = ('tick', 'hybrid', 'free')
+
+
+class ClockTickScheduler:
+    name = 'tick'
+    drains_motion = False
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._clock = pygame.time.Clock()
+
+    def start(self):
+        self._clock.tick()
+
+    def wait(self):
+        self._clock.tick(self.rate)
+
+    def time_left_ns(self, now_ns: int) -> Optional[int]:
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'name': self.name, 'rate': self.rate}
+
+
+class HybridScheduler:
+    """sleep + スピン待ちで期限 (前回の期限 + 周期) に合わせる"""
+    name = 'hybrid'
+    drains_motion = False
+
+    # スリープの寝過ごし量の初期見積もりと下限。
+    # 見積もりはスリープした時にしか更新されないため、初期値は周期より十分小さくしておく
+    INITIAL_MARGIN_NS: int = 200_000
+    MIN_MARGIN_NS: int = 100_000
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.period_ns = 1_000_000_000 // rate
+        self.deadline_ns = 0
+        self._overshoot_ns = float(self.INITIAL_MARGIN_NS)
+        self.margin_ns = self.INITIAL_MARGIN_NS
+        self.sleeps = 0
+        self.sleep_ns = 0
+        self.spin_ns = 0
+        self.overruns = 0
+
+    def start(self):
+        self.deadline_ns = time.perf_counter_ns()
+
+    def wait(self):
+        self.deadline_ns += self.period_ns
+        now = time.perf_counter_ns()
+        remaining = self.deadline_ns - now
+        if remaining <= 0:
+            # 1周期以上遅れた場合は期限を現在時刻に合わせ直し、遅れを取り戻そうと連続で回らないようにする
+            if -remaining > self.period_ns:
+                self.deadline_ns = now
+                self.overruns += 1
+            return
+
+        if remaining > self.margin_ns:
+            request = remaining - self.margin_ns
+            time.sleep(request / 1e9)
+            after = time.perf_counter_ns()
+            self.sleeps += 1
+            self.sleep_ns += after - now
+            # 寝過ごし量の移動平均から、次回スリープを切り上げる余裕を決める
+            self._overshoot_ns = 0.9 * self._overshoot_ns + 0.1 * max(0, after - now - request)
+            self.margin_ns = max(self.MIN_MARGIN_NS, int(self._overshoot_ns * 1.5))
+            now = after
+
+        spin_start = now
+        deadline = self.deadline_ns
+        while now < deadline:
+            now = time.perf_counter_ns()
+        self.spin_ns += now - spin_start
+
+    def time_left_ns(self, now_ns: int) -> Optional[int]:
+        # wait() で期限を1周期進めるため、今周の期限は deadline_ns + period_ns
+        return self.deadline_ns + self.period_ns - now_ns
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name, 'rate': self.rate, 'sleeps': self.sleeps,
+            'sleep_s': self.sleep_ns / 1e9, 'spin_s': self.spin_ns / 1e9,
+            'margin_ms': self.margin_ns / 1e6, 'overruns': self.overruns,
+        }
+
+
+class FreeRunScheduler:
+    """待たずに回し続け、移動量は MOUSEMOTION イベントから合算する"""
+    name = 'free'
+    drains_motion = True
+
+    def __init__(self, rate: int):
+        self.rate = rate
+
+    def start(self):
+        pass
+
+    def wait(self):
+        pass
+
+    def time_left_ns(self, now_ns: int) -> Optional[int]:
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'name': self.name}
+
+
+def create_scheduler(name: str, rate: int):
+    if name == 'tick':
+        return ClockTickScheduler(rate)
+    if name == 'hybrid':
+        return HybridScheduler(rate)
+    if name == 'free':
+        return FreeRunScheduler(rate)
+    raise ValueError(f"未対応のスケジューラです: {name}")
+
+
+def sum_motion(events: list):
+    """イベント列に含まれる MOUSEMOTION の相対移動量を合算する"""
+    dx = 0
+    dy = 0
+    for event in events:
+        if event.type == pygame.MOUSEMOTION:
+            rx, ry = event.rel
+            dx += rx
+            dy += ry
+    return dx, dy
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# =============================================================================
+# 起動タイムライン (プロセス開始 -> 最初の get_rel)
+# =============================================================================
+#
+# 起動してから最初のサンプルを取るまでの各段階の時刻を perf_counter_ns で記録し、表示する。
+# 原点はプロセスの生成時刻 (インタプリタ自体の起動も含む) で、OS から取れない場合は FootPrint.py の読み込み開始。
+#   Linux  : /proc/self/stat の starttime (起動からのクロック tick、10 ms 程度の分解能)
+#   Windows: GetProcessTimes の作成時刻
+# このモジュールは起動の最初に読み込まれるため、標準ライブラリ以外は import しない。
+
+
+def _process_age_ns() -> Optional[int]:
+    """プロセスが生成されてからの経過時間 [ns] (取れなければ None)"""
+    try:
+        if sys.platform.startswith('linux'):
+            with open('/proc/self/stat', 'r') as f:
+                # 2番目の項目 (コマンド名) は空白を含み得るため、最後の ')' より後ろを分割する
+                fields = f.read().rsplit(')', 1)[1].split()
+            start_ticks = int(fields[19])
+            uptime_s = time.clock_gettime(time.CLOCK_BOOTTIME)
+            return int((uptime_s - start_ticks / os.sysconf('SC_CLK_TCK')) * 1e9)
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+            kernel32 = ctypes.windll.kernel32
+            creation, exit_, kernel, user, now = (wintypes.FILETIME() for _ in range(5))
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            if not kernel32.GetProcessTimes(kernel32.GetCurrentProcess(), ctypes.byref(creation), ctypes.byref(exit_),
+                                            ctypes.byref(kernel), ctypes.byref(user)):
+                return None
+            kernel32.GetSystemTimePreciseAsFileTime(ctypes.byref(now))
+
+            def to_100ns(ft):
+                return (ft.dwHighDateTime << 32) | ft.dwLowDateTime
+            return (to_100ns(now) - to_100ns(creation)) * 100
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    return None
+
+
+class StartupTimeline:
+    """起動の各段階の時刻。origin_ns は perf_counter_ns の時間軸でのプロセス生成時刻 (または読み込み開始)"""
+
+    def __init__(self, module_start_ns: Optional[int] = None):
+        now = time.perf_counter_ns()
+        age = _process_age_ns()
+        self.process_start_known = age is not None and age >= 0
+        fallback = module_start_ns if module_start_ns is not None else now
+        self.origin_ns = now - age if self.process_start_known else fallback
+        self.marks: List[Tuple[str, int]] = []
+        if module_start_ns is not None:
+            self.mark("FootPrint.py 読み込み開始", module_start_ns)
+
+    def mark(self, label: str, t_ns: Optional[int] = None):
+        self.marks.append((label, time.perf_counter_ns() if t_ns is None else t_ns))
+
+    def to_dict(self) -> Dict[str, Any]:
+        prev = self.origin_ns
+        stages = []
+        for label, t in self.marks:
+            stages.append({'stage': label, 'at_ms': (t - self.origin_ns) / 1e6, 'delta_ms': (t - prev) / 1e6})
+            prev = t
+        return {'origin': 'process' if self.process_start_known else 'module', 'stages': stages,
+                'total_ms': stages[-1]['at_ms'] if stages else 0.0}
+
+    def print(self):
+        summary = self.to_dict()
+        origin = "プロセス開始" if summary['origin'] == 'process' else "FootPrint.py 読み込み開始"
+        print(f"🚀 起動タイムライン ({origin}から): 最初のサンプルまで {summary['total_ms']:.0f} ms")
+        for stage in summary['stages']:
+            print(f"   {stage['at_ms']:8.1f} ms  (+{stage['delta_ms']:7.1f} ms)  {stage['stage']}")
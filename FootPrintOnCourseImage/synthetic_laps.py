@@ -0,0 +1,170 @@
+import argparse
+import math
+import sys
+import numpy as np
+from typing import Iterator, List, Tuple
+
+import raw_format
+
+# =============================================================================
+# 合成周回データの生成
+# =============================================================================
+#
+# コースパーツの寸法 (黄 120 cm / 青 60 cm / 緑 42 cm の直線、および円弧) を並べた周回路を
+# 一定速度で走ったときの生データ (raw_data.log / raw_data.bin と同じレコード) を作る。
+# 実機なしで取得・解析・描画の各工程を再現性のある負荷で動かすために使う。
+#
+# 周回路はトークン列で指定する:
+#   Y / B / G   : 黄 / 青 / 緑パーツ1本分の直線
+#   R<角度>     : 右 (画像上で時計回り) に <角度> 度曲がる円弧
+#   L<角度>     : 左に曲がる円弧
+# 既定の DEFAULT_LAP は 横 300 cm + 縦 42 cm の直線を半径 60 cm の円弧でつないだ閉じた周回路。
+
+PART_LENGTH_CM = {'Y': 120.0, 'B': 60.0, 'G': 42.0}
+
+DEFAULT_LAP: str = "Y Y B R90 G R90 Y Y B R90 G R90"
+DEFAULT_RADIUS_CM: float = 60.0
+DEFAULT_SPEED_CM_S: float = 150.0
+DEFAULT_CHUNK_ROWS: int = 100_000
+
+
+class LapPath:
+    """直線と円弧をつないだ周回路。走行距離 s [cm] から画像上の位置 [cm] を求める"""
+
+    def __init__(self, spec: str = DEFAULT_LAP, radius_cm: float = DEFAULT_RADIUS_CM):
+        self.spec = spec
+        self.radius_cm = radius_cm
+        # (開始距離, 開始 x, 開始 y, 開始方位 [rad], 曲がる向き (0: 直線 / ±1), 長さ)
+        segments: List[Tuple[float, float, float, float, int, float]] = []
+        s = 0.0; x = 0.0; y = 0.0; heading = 0.0
+        for token in spec.split():
+            kind = token[0].upper()
+            if kind in PART_LENGTH_CM:
+                length = PART_LENGTH_CM[kind]
+                segments.append((s, x, y, heading, 0, length))
+                x += length * math.cos(heading); y += length * math.sin(heading)
+            elif kind in ('R', 'L'):
+                try:
+                    turn = math.radians(float(token[1:]))
+                except ValueError:
+                    raise ValueError(f"円弧の角度が読めません: {token}")
+                sign = 1 if kind == 'R' else -1
+                length = radius_cm * turn
+                segments.append((s, x, y, heading, sign, length))
+                cx = x - sign * radius_cm * math.sin(heading); cy = y + sign * radius_cm * math.cos(heading)
+                heading += sign * turn
+                x = cx + sign * radius_cm * math.sin(heading); y = cy - sign * radius_cm * math.cos(heading)
+            else:
+                raise ValueError(f"未対応のパーツ記号です: {token} (Y / B / G / R<角度> / L<角度>)")
+            s += length
+        if not segments:
+            raise ValueError("周回路が空です")
+        self.length_cm = s
+        self.closure_cm = math.hypot(x, y)
+        self._seg = np.array(segments, dtype=np.float64)
+
+    def positions(self, s: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """走行距離 s [cm] (周回ごとに先頭へ戻る) における位置 (x, y) [cm] を返す。始点が原点"""
+        s = np.mod(s, self.length_cm)
+        seg = self._seg
+        i = np.searchsorted(seg[:, 0], s, side='right') - 1
+        s0, x0, y0, h0, sign, _ = (seg[i, k] for k in range(6))
+        u = s - s0
+        x = x0 + u * np.cos(h0)
+        y = y0 + u * np.sin(h0)
+        arc = sign != 0
+        if arc.any():
+            r = self.radius_cm; sg = sign[arc]; h = h0[arc]
+            cx = x0[arc] - sg * r * np.sin(h); cy = y0[arc] + sg * r * np.cos(h)
+            h = h + sg * u[arc] / r
+            x[arc] = cx + sg * r * np.sin(h); y[arc] = cy - sg * r * np.cos(h)
+        return x, y
+
+
+def iter_synthetic_records(seconds: float, rate: int = 1000, speed_cm_s: float = DEFAULT_SPEED_CM_S,
+                           path: LapPath = None, mickey_to_cm: float = None, noise_mickey: float = 0.0,
+                           seed: int = 0, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[np.ndarray]:
+    """周回路を走った生データを RECORD_DTYPE のチャンクとして返す。
+
+    座標の対応は plot と同じ (画像 x = +Total_Y, 画像 y = -Total_X)。
+    取得ループと同様に、移動量ゼロのサンプルは記録しない。
+    """
+    if path is None:
+        path = LapPath()
+    if mickey_to_cm is None:
+        from course_constants import CourseConstants
+        mickey_to_cm = CourseConstants.MICKEY_TO_CM
+    rng = np.random.default_rng(seed)
+    samples = int(round(seconds * rate))
+    prev_tx = 0
+    prev_ty = 0
+    for start in range(1, samples + 1, chunk_rows):
+        i = np.arange(start, min(start + chunk_rows, samples + 1), dtype=np.float64)
+        t = i / rate
+        x, y = path.positions(speed_cm_s * t)
+        mx = -y / mickey_to_cm
+        my = x / mickey_to_cm
+        if noise_mickey:
+            mx = mx + rng.normal(0.0, noise_mickey, len(i))
+            my = my + rng.normal(0.0, noise_mickey, len(i))
+        # 累積値を整数に丸めてから差分を取るため、端数は次のサンプルに持ち越される
+        tx = np.rint(mx).astype(np.int64)
+        ty = np.rint(my).astype(np.int64)
+        rx = np.diff(tx, prepend=prev_tx)
+        ry = np.diff(ty, prepend=prev_ty)
+        prev_tx = int(tx[-1]); prev_ty = int(ty[-1])
+        moved = (rx != 0) | (ry != 0)
+        rec = np.empty(int(moved.sum()), dtype=raw_format.RECORD_DTYPE)
+        rec['Timestamp_s'] = t[moved]
+        rec['Rel_X'] = rx[moved]; rec['Rel_Y'] = ry[moved]
+        rec['Total_X'] = tx[moved]; rec['Total_Y'] = ty[moved]
+        yield rec
+
+
+def write_synthetic_log(out_path: str, records: Iterator[np.ndarray], binary: bool = None) -> int:
+    """レコードのチャンク列を raw_data.log (CSV) または raw_data.bin に書き出す。戻り値は行数"""
+    if binary is None:
+        binary = out_path.endswith(".bin")
+    rows = 0
+    if binary:
+        with open(out_path, 'wb') as f:
+            raw_format.write_header(f, raw_format.default_header())
+            for rec in records:
+                f.write(rec.tobytes()); rows += len(rec)
+    else:
+        with open(out_path, 'w', newline='') as f:
+            f.write(raw_format.CSV_HEADER)
+            for rec in records:
+                f.write(raw_format.format_csv_rows(rec)); rows += len(rec)
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="コースパーツ寸法の周回路を走った合成生データを生成する")
+    parser.add_argument('out', help="出力ファイル (.bin ならバイナリ形式、それ以外は CSV)")
+    parser.add_argument('--lap', default=DEFAULT_LAP, help=f"周回路のパーツ列 (既定: \"{DEFAULT_LAP}\")")
+    parser.add_argument('--radius', type=float, default=DEFAULT_RADIUS_CM, help="円弧の半径 [cm]")
+    parser.add_argument('--laps', type=float, default=10, help="周回数")
+    parser.add_argument('--seconds', type=float, help="走行時間 [s] (指定時は --laps より優先)")
+    parser.add_argument('--speed', type=float, default=DEFAULT_SPEED_CM_S, help="走行速度 [cm/s]")
+    parser.add_argument('--rate', type=int, default=1000, help="サンプリングレート [Hz]")
+    parser.add_argument('--noise', type=float, default=0.0, help="センサーノイズの標準偏差 [Mickey]")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        path = LapPath(args.lap, args.radius)
+        seconds = args.seconds if args.seconds is not None else args.laps * path.length_cm / args.speed
+        if path.closure_cm > 1.0:
+            print(f"⚠️ 周回路が閉じていません (終点と始点の差 {path.closure_cm:.1f} cm)")
+        records = iter_synthetic_records(seconds, args.rate, args.speed, path, noise_mickey=args.noise, seed=args.seed)
+        rows = write_synthetic_log(args.out, records)
+    except (OSError, ValueError) as e:
+        print(f"❌ 生成に失敗しました: {e}")
+        return 1
+    print(f"🏁 合成データ生成: {args.out} ({rows:,} 行, 1周 {path.length_cm:.1f} cm, {seconds:.1f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
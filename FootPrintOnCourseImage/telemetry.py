@@ -0,0 +1,394 @@
+import argparse
+import os
+import socket
+import stat
+import struct
+import sys
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+import raw_format
+
+# =============================================================================
+# 計測中のサンプルのリアルタイム配信 (テレメトリ)
+# =============================================================================
+#
+# acquire_raw_data で取得したサンプルを、同じマシン内のシミュレーターやダッシュボードへ
+# UDP または Unix ドメインソケット (データグラム) で随時送る。
+#
+# フレーム構成 (リトルエンディアン):
+#   [ヘッダー 32 byte] magic, version, 種別, サンプル数, シーケンス番号(u4),
+#                      先頭サンプルの通し番号(u8), 送信時刻(u8, perf_counter_ns)
+#   [本体]  種別 SAMPLES: raw_data.bin と同じ 24 byte のレコード x サンプル数
+#           種別 START  : raw_data.bin のヘッダー (32 byte) + セッション開始時刻(u8, perf_counter_ns)
+#           種別 END    : なし
+#
+# ポーリングループはフレームのバッファに直接レコードを詰めるだけで、
+# 最初のサンプルから batch_ms 経過するか max_batch 件たまったら、ノンブロッキングの sendto で1回送る。
+# 送れなかったフレーム (受信側のキューが満杯 = 購読者が遅い / 購読者がいない) は待たずに捨てて件数を数える。
+# UDP の受信バッファあふれは送信側では分からないため、購読者がシーケンス番号の欠けとして数える。
+# 時刻は perf_counter_ns (単調増加クロック) のため、遅延を求められるのは同じマシン内のプロセス同士に限る。
+#
+# 実行例:
+#   py -3.12 FootPrint.py G304_Test01 --telemetry udp://127.0.0.1:9870
+#   py -3.12 telemetry.py udp://127.0.0.1:9870            (参照用の購読者: 受信状況を1秒ごとに表示)
+#   python3 telemetry.py unix:///tmp/footprint.sock
+
+MAGIC: bytes = b"FPTM"
+VERSION: int = 1
+
+KIND_SAMPLES: int = 0
+KIND_START: int = 1
+KIND_END: int = 2
+
+_FRAME_STRUCT = struct.Struct('<4sBBHIQQ4x')
+FRAME_HEADER_SIZE: int = _FRAME_STRUCT.size
+_START_NS_STRUCT = struct.Struct('<Q')
+
+DEFAULT_ADDRESS: str = "udp://127.0.0.1:9870"
+DEFAULT_BATCH_MS: float = 5.0
+# 1フレームのサンプル数の上限 (UDP の1データグラム 65507 byte に収まる範囲)
+MAX_BATCH: int = 1024
+MAX_FRAME_SIZE: int = FRAME_HEADER_SIZE + MAX_BATCH * raw_format.RECORD_DTYPE.itemsize
+
+
+def parse_address(spec: str) -> Tuple[int, Any]:
+    """'udp://host:port' / 'host:port' / 'unix:///path' を (アドレスファミリ, アドレス) にする"""
+    if spec.startswith('unix://'):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError(f"この環境では Unix ドメインソケットを使えません: {spec}")
+        path = spec[len('unix://'):]
+        if not path:
+            raise ValueError(f"ソケットのパスが空です: {spec}")
+        return socket.AF_UNIX, path
+    address = spec[len('udp://'):] if spec.startswith('udp://') else spec
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"配信先は udp://host:port または unix:///path の形式で指定してください: {spec}")
+    return socket.AF_INET, (host, int(port))
+
+
+def decode_frame(data) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    """フレームを (ヘッダー, レコード配列) にする。レコード配列は data を参照する (SAMPLES 以外は None)"""
+    if len(data) < FRAME_HEADER_SIZE:
+        raise ValueError(f"フレームが短すぎます ({len(data)} byte)")
+    magic, version, kind, count, seq, first_sample, send_ns = _FRAME_STRUCT.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("テレメトリのフレームではありません")
+    if version != VERSION:
+        raise ValueError(f"未対応のテレメトリ形式です (version={version})")
+    frame = {'kind': kind, 'count': count, 'seq': seq, 'first_sample': first_sample, 'send_ns': send_ns}
+    records = None
+    if kind == KIND_SAMPLES:
+        size = count * raw_format.RECORD_DTYPE.itemsize
+        if len(data) < FRAME_HEADER_SIZE + size:
+            raise ValueError(f"フレームのサンプルが不完全です ({count} 件)")
+        records = np.frombuffer(data, dtype=raw_format.RECORD_DTYPE, count=count, offset=FRAME_HEADER_SIZE)
+    elif kind == KIND_START:
+        payload = bytes(data[FRAME_HEADER_SIZE:])
+        frame['header'] = raw_format.unpack_header(payload, "テレメトリ")
+        frame['start_ns'] = _START_NS_STRUCT.unpack_from(payload, raw_format.HEADER_SIZE)[0]
+    return frame, records
+
+
+class TelemetryPublisher:
+    """ポーリングループからサンプルを受け取り、まとめてノンブロッキングで送る (送信はループのスレッドで行う)"""
+
+    def __init__(self, address: str, batch_ms: float = DEFAULT_BATCH_MS, max_batch: int = MAX_BATCH):
+        if not 1 <= max_batch <= MAX_BATCH:
+            raise ValueError(f"1フレームのサンプル数は 1〜{MAX_BATCH} で指定してください: {max_batch}")
+        self.address = address
+        family, self._addr = parse_address(address)
+        self.batch_ns = int(batch_ms * 1e6)
+        self.max_batch = max_batch
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        # レコードはフレームのバッファに直接書き込み、送信時にコピーしない
+        self._frame = bytearray(FRAME_HEADER_SIZE + max_batch * raw_format.RECORD_DTYPE.itemsize)
+        self._view = memoryview(self._frame)
+        self._records = np.frombuffer(self._frame, dtype=raw_format.RECORD_DTYPE, count=max_batch,
+                                      offset=FRAME_HEADER_SIZE)
+        self._count = 0
+        self._first_ns = 0
+        self._seq = 0
+        self._sample_index = 0
+        self._closed = False
+
+        self.frames_sent = 0
+        self.samples_sent = 0
+        self.bytes_sent = 0
+        self.dropped_frames = 0
+        self.dropped_samples = 0
+        self.unreachable_frames = 0
+        self.send_errors = 0
+        self.last_error: Optional[str] = None
+        self.send_ns = 0
+        self.max_send_ns = 0
+
+    # --- ポーリングループ側 ---
+
+    def start(self, start_ns: int, header: Dict[str, Any]):
+        """セッション開始を知らせる (生データのヘッダーと開始時刻。購読者が位置と遅延の計算に使う)"""
+        self._send_control(KIND_START, raw_format.pack_header(header) + _START_NS_STRUCT.pack(start_ns))
+
+    def add(self, sample: Tuple[float, int, int, int, int], now_ns: int):
+        """1サンプル (Timestamp_s, Rel_X, Rel_Y, Total_X, Total_Y) を積む。上限に達したらその場で送る"""
+        if self._count == 0:
+            self._first_ns = now_ns
+        self._records[self._count] = sample
+        self._count += 1
+        if self._count == self.max_batch:
+            self.flush()
+
+    def tick(self, now_ns: int):
+        """最初のサンプルから batch_ms 経過していれば送る (毎周呼ぶ)"""
+        if self._count and now_ns - self._first_ns >= self.batch_ns:
+            self.flush()
+
+    def flush(self):
+        n = self._count
+        if n == 0:
+            return
+        _FRAME_STRUCT.pack_into(self._frame, 0, MAGIC, VERSION, KIND_SAMPLES, n, self._seq, self._sample_index,
+                                time.perf_counter_ns())
+        self._send(self._view[:FRAME_HEADER_SIZE + n * raw_format.RECORD_DTYPE.itemsize], n)
+        self._sample_index += n
+        self._count = 0
+
+    def close(self):
+        """残りのサンプルと終了の知らせを送り、ソケットを閉じる"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+            self._send_control(KIND_END)
+        finally:
+            self._sock.close()
+
+    # --- 送信 ---
+
+    def _send_control(self, kind: int, payload: bytes = b""):
+        data = _FRAME_STRUCT.pack(MAGIC, VERSION, kind, 0, self._seq, self._sample_index, time.perf_counter_ns())
+        self._send(data + payload, 0)
+
+    def _send(self, data, samples: int):
+        t0 = time.perf_counter_ns()
+        try:
+            self._sock.sendto(data, self._addr)
+            self.frames_sent += 1
+            self.samples_sent += samples
+            self.bytes_sent += len(data)
+        except BlockingIOError:
+            # 受信側のキュー (または送信バッファ) が満杯。待たずに捨てる
+            self.dropped_frames += 1
+            self.dropped_samples += samples
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 購読者がいない (Unix ドメインソケットのパスが無い・誰も待ち受けていない)
+            self.unreachable_frames += 1
+            self.dropped_samples += samples
+        except OSError as e:
+            self.send_errors += 1
+            self.dropped_samples += samples
+            self.last_error = str(e)
+        finally:
+            # 欠けたフレームは購読者がシーケンス番号の飛びで検出する
+            self._seq = (self._seq + 1) & 0xFFFFFFFF
+            dt = time.perf_counter_ns() - t0
+            self.send_ns += dt
+            self.max_send_ns = max(self.max_send_ns, dt)
+
+    def stats(self) -> Dict[str, Any]:
+        frames = self.frames_sent + self.dropped_frames + self.unreachable_frames + self.send_errors
+        return {
+            'address': self.address,
+            'batch_ms': self.batch_ns / 1e6,
+            'max_batch': self.max_batch,
+            'frames_sent': self.frames_sent,
+            'samples_sent': self.samples_sent,
+            'bytes_sent': self.bytes_sent,
+            'dropped_frames': self.dropped_frames,
+            'dropped_samples': self.dropped_samples,
+            'unreachable_frames': self.unreachable_frames,
+            'send_errors': self.send_errors,
+            'last_error': self.last_error,
+            'mean_send_us': self.send_ns / frames / 1e3 if frames else None,
+            'max_send_us': self.max_send_ns / 1e3,
+        }
+
+
+def print_publisher_stats(stats: Dict[str, Any]):
+    print(f"📡 テレメトリ ({stats['address']}): {stats['frames_sent']:,} フレーム / {stats['samples_sent']:,} サンプル送信"
+          f"  (送信 平均 {stats['mean_send_us'] or 0:.1f} µs / 最大 {stats['max_send_us']:.1f} µs)")
+    if stats['dropped_frames']:
+        print(f"⚠️ 購読者が追いつかず {stats['dropped_frames']:,} フレームを破棄しました")
+    if stats['unreachable_frames']:
+        print(f"ℹ️ 購読者がいないため {stats['unreachable_frames']:,} フレームを送れませんでした")
+    if stats['send_errors']:
+        print(f"⚠️ 送信エラー {stats['send_errors']:,} 回: {stats['last_error']}")
+
+
+class TelemetrySubscriber:
+    """配信を受け取り、シーケンス番号の欠けと遅延 (サンプル取得 -> 受信) を数える"""
+
+    def __init__(self, address: str, recv_buffer: Optional[int] = None):
+        self.address = address
+        family, addr = parse_address(address)
+        self._path = addr if family != socket.AF_INET else None
+        if self._path is not None and os.path.exists(self._path):
+            # 前回の購読者が残したソケットファイルだけを消す
+            if not stat.S_ISSOCK(os.stat(self._path).st_mode):
+                raise ValueError(f"ソケット以外のファイルが既にあります: {self._path}")
+            os.unlink(self._path)
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        if recv_buffer:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+        self._sock.bind(addr)
+        self._buf = bytearray(MAX_FRAME_SIZE)
+        self.header: Optional[Dict[str, Any]] = None
+        self.start_ns: Optional[int] = None
+        self.ended = False
+        self.last: Optional[np.ndarray] = None
+        self.frames = 0
+        self.samples = 0
+        self.lost_frames = 0
+        self.lost_samples = 0
+        self.invalid_frames = 0
+        self._next_seq: Optional[int] = None
+        self._next_sample = 0
+        self._latencies: List[np.ndarray] = []
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Tuple[Dict[str, Any], Optional[np.ndarray]]]:
+        """1フレーム受け取る。timeout 秒以内に届かなければ None"""
+        self._sock.settimeout(timeout)
+        try:
+            n = self._sock.recv_into(self._buf)
+        except socket.timeout:
+            return None
+        recv_ns = time.perf_counter_ns()
+        try:
+            frame, records = decode_frame(memoryview(self._buf)[:n])
+        except ValueError:
+            self.invalid_frames += 1
+            return None
+        frame['recv_ns'] = recv_ns
+        if frame['kind'] == KIND_START:
+            # 新しいセッション: 通し番号を数え直す
+            self.header, self.start_ns, self.ended = frame['header'], frame['start_ns'], False
+            self._next_seq, self._next_sample = None, 0
+        if self._next_seq is not None:
+            gap = (frame['seq'] - self._next_seq) & 0xFFFFFFFF
+            # 前後した (遅れて届いた) フレームは数えない
+            if gap < 0x80000000:
+                self.lost_frames += gap
+        self._next_seq = (frame['seq'] + 1) & 0xFFFFFFFF
+        self.frames += 1
+        if records is not None:
+            records = records.copy()
+            if frame['first_sample'] > self._next_sample:
+                self.lost_samples += frame['first_sample'] - self._next_sample
+            self._next_sample = max(self._next_sample, frame['first_sample'] + frame['count'])
+            self.samples += len(records)
+            if len(records):
+                self.last = records[-1]
+                if self.start_ns is not None:
+                    captured_ns = self.start_ns + records['Timestamp_s'] * 1e9
+                    self._latencies.append((recv_ns - captured_ns) / 1e6)
+        elif frame['kind'] == KIND_END:
+            self.ended = True
+        return frame, records
+
+    def take_latencies(self) -> np.ndarray:
+        """前回の呼び出しから受け取ったサンプルの遅延 [ms] (取得してから受信するまで)"""
+        latencies = np.concatenate(self._latencies) if self._latencies else np.empty(0)
+        self._latencies = []
+        return latencies
+
+    def position_cm(self) -> Optional[Tuple[float, float]]:
+        """最後に受け取ったサンプルのコース画像上の位置 [cm] (FootPrint.py と同じ座標変換、1 px = 1 cm)"""
+        if self.last is None or self.header is None:
+            return None
+        mickey_to_cm = 2.54 / self.header['dpi']
+        return (self.header['start_px_x'] + int(self.last['Total_Y']) * mickey_to_cm,
+                self.header['start_px_y'] - int(self.last['Total_X']) * mickey_to_cm)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'address': self.address, 'frames': self.frames, 'samples': self.samples,
+            'lost_frames': self.lost_frames, 'lost_samples': self.lost_samples,
+            'invalid_frames': self.invalid_frames, 'ended': self.ended,
+        }
+
+    def close(self):
+        self._sock.close()
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+
+def latency_summary(latencies: np.ndarray) -> Dict[str, Optional[float]]:
+    if len(latencies) == 0:
+        return {'p50': None, 'p99': None, 'max': None}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {'p50': float(p50), 'p99': float(p99), 'max': float(latencies.max())}
+
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def subscribe(address: str, report_s: float = 1.0, duration_s: Optional[float] = None) -> int:
+    """参照用の購読者: 受信状況 (サンプル数・位置・遅延・欠け) を report_s 秒ごとに表示する"""
+    subscriber = TelemetrySubscriber(address)
+    print(f"👂 {address} で待ち受け中 (Ctrl+C で終了)")
+    t_end = time.perf_counter() + duration_s if duration_s else None
+    next_report = time.perf_counter() + report_s
+    samples = 0
+    try:
+        while t_end is None or time.perf_counter() < t_end:
+            received = subscriber.receive(timeout=max(0.0, next_report - time.perf_counter()))
+            if received is not None and received[0]['kind'] == KIND_START:
+                h = subscriber.header
+                print(f"▶️ セッション開始 (DPI {h['dpi']}, {h['polling_rate']} Hz, スタート地点 "
+                      f"{h['start_px_x']}, {h['start_px_y']} px)")
+            elif received is not None and received[0]['kind'] == KIND_END:
+                print(f"⏹️ セッション終了: {subscriber.samples:,} サンプル受信 / 欠け {subscriber.lost_frames:,} フレーム "
+                      f"({subscriber.lost_samples:,} サンプル)")
+            now = time.perf_counter()
+            if now < next_report:
+                continue
+            latency = latency_summary(subscriber.take_latencies())
+            position = subscriber.position_cm()
+            where = f"({position[0]:7.1f}, {position[1]:7.1f}) cm" if position else "-"
+            rate = (subscriber.samples - samples) / report_s
+            samples = subscriber.samples
+            if rate:
+                print(f"📡 {rate:8,.0f} サンプル/s  位置 {where}  遅延 p50 {_ms(latency['p50'])} ms / "
+                      f"最大 {_ms(latency['max'])} ms  欠け {subscriber.lost_frames:,} フレーム")
+            next_report = now + report_s
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="FootPrint.py --telemetry の配信を受け取って表示する (参照用の購読者)")
+    parser.add_argument('address', nargs='?', default=DEFAULT_ADDRESS,
+                        help=f"待ち受けるアドレス (udp://host:port / unix:///path、既定: {DEFAULT_ADDRESS})")
+    parser.add_argument('--interval', type=float, default=1.0, help="表示間隔 [s]")
+    parser.add_argument('--duration', type=float, help="指定秒数で終了する")
+    args = parser.parse_args(argv)
+    try:
+        return subscribe(args.address, args.interval, args.duration)
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_laps  # noqa: E402
+
+MICKEY_TO_CM: float = 2.54 / 800
+START_CM = (500.0, 273.0)
+# 1つの軌跡を何通りかのチャンク長で解析し、結果が一致することを確かめる (13 は端数の出やすい長さ)
+CHUNK_SIZES = (13, 997, 100_000)
+
+
+@pytest.fixture(scope='session')
+def synthetic_raw(tmp_path_factory) -> str:
+    """合成周回データ (約 2.8 周、ノイズ入り) の raw_data.log"""
+    path = str(tmp_path_factory.mktemp("raw") / "raw_data.log")
+    records = synthetic_laps.iter_synthetic_records(20.0, 1000, 150.0, mickey_to_cm=MICKEY_TO_CM,
+                                                    noise_mickey=0.5, seed=1)
+    synthetic_laps.write_synthetic_log(path, records, binary=False)
+    return path
+
+
+# 合成周回路の上下の直線部分だけにパーツを置いたコース (カーブではコース外の仮説に切り替わる)
+COURSE_ROWS = [
+    ("P1", "yellow", 560.0, 273.0, 0), ("P2", "yellow", 680.0, 273.0, 0), ("P3", "blue", 770.0, 273.0, 0),
+    ("P4", "yellow", 740.0, 435.0, 180), ("P5", "yellow", 620.0, 435.0, 180), ("P6", "blue", 530.0, 435.0, 180),
+]
+
+
+@pytest.fixture(scope='session')
+def course_csv(tmp_path_factory) -> str:
+    """synthetic_raw の周回路に合わせた CourseData_*.csv"""
+    path = tmp_path_factory.mktemp("course") / "CourseData_20250101_000000.csv"
+    lines = ["Name,type,x,y,rotation"] + [",".join(str(v) for v in row) for row in COURSE_ROWS]
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return str(path)
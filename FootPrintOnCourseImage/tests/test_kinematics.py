@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import analyze_engine
+import kinematics
+from conftest import CHUNK_SIZES, MICKEY_TO_CM, START_CM
+
+
+def _resample(raw_path, tmp_path, chunk_rows, dt=kinematics.DT_S):
+    out_path = str(tmp_path / f"kinematics_{chunk_rows}.bin")
+    stage = kinematics.KinematicsStage(START_CM, MICKEY_TO_CM, 1000, out_path, dt)
+    analyze_engine.analyze_file(raw_path, str(tmp_path / "analyze.log"), chunk_rows, kinematics=stage)
+    return stage.finish(), out_path
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_SIZES)
+def test_kinematics_do_not_depend_on_chunk_size(synthetic_raw, tmp_path, chunk_rows):
+    expected_summary, expected_path = _resample(synthetic_raw, tmp_path, 1_000_000)
+    summary, path = _resample(synthetic_raw, tmp_path, chunk_rows)
+    assert summary['rows'] == expected_summary['rows']
+    assert summary['distance_cm'] == pytest.approx(expected_summary['distance_cm'], rel=1e-9)
+    expected = kinematics.read_kinematics(expected_path)
+    got = kinematics.read_kinematics(path)
+    assert got.keys() == expected.keys()
+    for name in expected:
+        # 値は float32 で保存するので、累積和の丸め誤差で最後の桁が揺れる分だけ許す
+        np.testing.assert_allclose(got[name], expected[name], rtol=1e-5, atol=1e-3, err_msg=name)
+
+
+def test_kinematics_bin_round_trip(synthetic_raw, tmp_path):
+    dt = 0.02
+    summary, path = _resample(synthetic_raw, tmp_path, 997, dt)
+    data = kinematics.read_kinematics(path)
+    assert set(data) == {'Time_s', *kinematics.COLUMNS}
+    assert all(len(values) == summary['rows'] for values in data.values())
+    np.testing.assert_allclose(data['Time_s'], np.arange(summary['rows']) * dt)
+    # 一定速度 (150 cm/s) で走った合成データなので、平滑化後の速度も走行中はほぼ一定
+    moving = (data['Time_s'] > 1.0) & (data['Time_s'] < 19.0)
+    assert np.median(data['Speed_cm_s'][moving]) == pytest.approx(150.0, rel=0.02)
+    assert float(data['Speed_cm_s'].sum()) * dt == pytest.approx(summary['distance_cm'], rel=1e-5)
+    # 先頭はスタート地点で止まっていたものとして平滑化するので、σ の間に進む距離 (約 3 cm) までずれる
+    assert (data['X_cm'][0], data['Y_cm'][0]) == pytest.approx(START_CM, abs=3.0)
+
+    with open(path, 'rb') as f:
+        header = kinematics.read_header(f)
+    assert header['dt'] == dt and list(header['columns']) == list(kinematics.COLUMNS)
+
+    # 列を絞って読んでも同じ値が返る
+    part = kinematics.read_kinematics(path, ['Speed_cm_s'])
+    assert set(part) == {'Speed_cm_s'}
+    np.testing.assert_array_equal(part['Speed_cm_s'], data['Speed_cm_s'])
+    with pytest.raises(ValueError):
+        kinematics.read_kinematics(path, ['Jerk'])
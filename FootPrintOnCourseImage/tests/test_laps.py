@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import analyze_engine
+import laps
+import synthetic_laps
+from conftest import CHUNK_SIZES, MICKEY_TO_CM, START_CM
+
+
+def assert_laps_equal(got, expected):
+    # 距離は累積和の順序が変わるため丸め誤差の範囲で比べる (行番号・バイト位置は完全一致)
+    assert len(got) == len(expected)
+    for a, b in zip(got, expected):
+        assert a == pytest.approx(b, rel=1e-9)
+
+
+def _detect(raw_path, tmp_path, chunk_rows, marks=None):
+    detector = laps.LapDetector(START_CM, MICKEY_TO_CM, marks=marks)
+    analyze_engine.analyze_file(raw_path, str(tmp_path / "analyze.log"), chunk_rows, lap_detector=detector)
+    return detector.finish(raw_path)
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_SIZES)
+def test_gate_laps_do_not_depend_on_chunk_size(synthetic_raw, tmp_path, chunk_rows):
+    expected = _detect(synthetic_raw, tmp_path, 1_000_000)
+    assert expected['complete_laps'] == 2
+    assert_laps_equal(_detect(synthetic_raw, tmp_path, chunk_rows)['laps'], expected['laps'])
+
+
+def test_gate_visit_closed_at_chunk_boundary():
+    # ゲートから離れ (行 0)、ゲート内に戻り (行 1)、次のチャンクの先頭 (行 2) で既にゲートの外に出る
+    ts = np.array([0.001, 0.002, 0.003]); dx = np.zeros(3, dtype=np.int64); dy = np.array([200, -195, 50])
+    whole = laps.LapDetector((0.0, 0.0), 1.0)
+    whole.update(ts, dx, dy)
+    split = laps.LapDetector((0.0, 0.0), 1.0)
+    split.update(ts[:2], dx[:2], dy[:2])
+    split.update(ts[2:], dx[2:], dy[2:])
+    assert_laps_equal(split.finish()['laps'], whole.finish()['laps'])
+    assert [b[0] for b in split.boundaries] == [0, 2]
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_SIZES)
+def test_manual_marks_do_not_depend_on_chunk_size(synthetic_raw, tmp_path, chunk_rows):
+    ts = next(analyze_engine.iter_raw_chunks(synthetic_raw, 1_000_000))[0]
+    # チャンクの最後の行と同時刻の区切りも含める
+    marks = [float(ts[12]), float(ts[4000]), float(ts[9999])]
+    expected = _detect(synthetic_raw, tmp_path, 1_000_000, marks)
+    assert [lap['start_row'] for lap in expected['laps']] == [0, 13, 4001, 10000]
+    assert_laps_equal(_detect(synthetic_raw, tmp_path, chunk_rows, marks)['laps'], expected['laps'])
+
+
+
+@pytest.mark.parametrize('marks', [[0.0005, 0.0025], [0.001, 0.0025], [0.0, 0.0005, 0.0025]])
+def test_mark_before_first_sample_starts_lap_one(marks):
+    # 移動量ゼロのサンプルは記録されないので、走り出す前の記録は最初のサンプルより前の時刻になる
+    ts = np.array([0.001, 0.002, 0.003, 0.004]); dx = np.ones(4, dtype=np.int64); dy = np.zeros(4, dtype=np.int64)
+    detector = laps.LapDetector((0.0, 0.0), 1.0, marks=marks)
+    detector.update(ts, dx, dy)
+    summary = detector.finish()
+    assert [(lap['start_row'], lap['end_row']) for lap in summary['laps']] == [(0, 2), (2, 4)]
+    assert summary['laps'][0]['start_s'] == marks[-2]
+    assert summary['best_time_s'] == pytest.approx(0.0025 - marks[-2])
+
+
+def test_marks_without_samples_between_do_not_make_empty_laps():
+    ts = np.array([0.001, 0.002, 0.003, 0.004]); dx = np.ones(4, dtype=np.int64); dy = np.zeros(4, dtype=np.int64)
+    detector = laps.LapDetector((0.0, 0.0), 1.0, marks=[0.0015, 0.0018, 0.0035])
+    detector.update(ts, dx, dy)
+    result = detector.finish()['laps']
+    assert [(lap['start_row'], lap['end_row']) for lap in result] == [(0, 1), (1, 3), (3, 4)]
+    # 後の記録をその周回の開始とする
+    assert result[1]['start_s'] == 0.0018
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_read_lap_round_trip(tmp_path, binary):
+    # 周回インデックスのバイト位置から読んだ周回が、全体を読んで行番号で切り出したものと一致する
+    raw_path = str(tmp_path / ("raw_data.bin" if binary else "raw_data.log"))
+    records = synthetic_laps.iter_synthetic_records(20.0, 1000, 150.0, mickey_to_cm=MICKEY_TO_CM,
+                                                    noise_mickey=0.5, seed=1)
+    synthetic_laps.write_synthetic_log(raw_path, records, binary=binary)
+    summary = _detect(raw_path, tmp_path, 997)
+    laps.save_lap_index(str(tmp_path / laps.LAP_INDEX_NAME), summary, raw_path)
+
+    ts, dx, dy = next(analyze_engine.iter_raw_chunks(raw_path, 1_000_000))
+    assert len(summary['laps']) == 3
+    for lap in summary['laps']:
+        r0, r1 = lap['start_row'], lap['end_row']
+        got = laps.read_lap(str(tmp_path), lap['lap'])
+        for values, column in zip(got, (ts, dx, dy)):
+            np.testing.assert_array_equal(values, column[r0:r1])
+        # 要素を直接渡しても (lap_index.json を読まずに) 同じ周回を返す
+        got = laps.read_lap(str(tmp_path), lap, raw_name=laps.load_lap_index(str(tmp_path))['raw_file'])
+        np.testing.assert_array_equal(got[0], ts[r0:r1])
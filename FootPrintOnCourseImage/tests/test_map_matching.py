@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import analyze_engine
+import map_matching
+from conftest import CHUNK_SIZES, MICKEY_TO_CM, START_CM
+
+
+def _match(raw_path, course_csv, tmp_path, chunk_rows):
+    out_path = str(tmp_path / f"matched_path_{chunk_rows}.csv")
+    matcher = map_matching.create_map_matcher(course_csv, START_CM, MICKEY_TO_CM, out_path)
+    analyze_engine.analyze_file(raw_path, str(tmp_path / "analyze.log"), chunk_rows, map_matcher=matcher)
+    summary = matcher.finish()
+    data = np.loadtxt(out_path, delimiter=',', skiprows=1, ndmin=2)
+    return summary, data
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_SIZES)
+def test_matched_path_does_not_depend_on_chunk_size(synthetic_raw, course_csv, tmp_path, chunk_rows):
+    expected_summary, expected = _match(synthetic_raw, course_csv, tmp_path, 1_000_000)
+    assert expected_summary['lanes'] == 6
+    # 直線では車線に乗り、カーブではコース外になる
+    assert 0 < expected_summary['matched_percent'] < 100
+    parts = set(np.unique(expected[:, 5]).tolist())
+    assert -1.0 in parts and len(parts) > 1
+
+    summary, data = _match(synthetic_raw, course_csv, tmp_path, chunk_rows)
+    assert summary['samples'] == expected_summary['samples']
+    assert summary['steps'] == expected_summary['steps']
+    assert summary['lane_switches'] == expected_summary['lane_switches']
+    assert summary['matched_percent'] == pytest.approx(expected_summary['matched_percent'])
+    assert summary['max_correction_cm'] == pytest.approx(expected_summary['max_correction_cm'], rel=1e-9)
+    # 位置は小数2桁で書き出すので、累積和の丸め誤差で最後の桁が揺れる分だけ許す
+    assert data.shape == expected.shape
+    np.testing.assert_array_equal(data[:, 0], expected[:, 0])
+    np.testing.assert_allclose(data[:, 1:5], expected[:, 1:5], rtol=0, atol=0.0101)
+    np.testing.assert_array_equal(data[:, 5], expected[:, 5])
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import analyze_engine
+import rasterizer
+from conftest import CHUNK_SIZES, MICKEY_TO_CM, START_CM
+
+# 捨てた点は直前に残した点と同じ許容誤差の格子 (対角 √2 倍) に入り、そこから RDP の許容誤差だけずれうる
+MAX_ERROR_PX = rasterizer.SIMPLIFY_TOLERANCE_PX * (1 + np.sqrt(2)) + 1e-9
+
+
+def _trajectory_chunks(raw_path, chunk_rows):
+    # FootPrint の plot と同じ変換 (cm = px)。先頭はスタート地点のみのチャンク
+    x0, y0 = START_CM
+    yield np.array([x0]), np.array([y0])
+    for _, dx, dy in analyze_engine.iter_raw_chunks(raw_path, chunk_rows):
+        x = x0 + np.cumsum(dy) * MICKEY_TO_CM
+        y = y0 - np.cumsum(dx) * MICKEY_TO_CM
+        x0, y0 = float(x[-1]), float(y[-1])
+        yield x, y
+
+
+def _distance_to_polyline(px, py, x, y, block=1000):
+    sx = np.diff(x); sy = np.diff(y)
+    length2 = sx * sx + sy * sy
+    result = np.empty(len(px))
+    for i in range(0, len(px), block):
+        qx = px[i:i + block, None] - x[None, :-1]
+        qy = py[i:i + block, None] - y[None, :-1]
+        t = np.clip(np.divide(qx * sx + qy * sy, length2, out=np.zeros_like(qx), where=length2 > 0), 0.0, 1.0)
+        result[i:i + block] = np.hypot(qx - t * sx, qy - t * sy).min(axis=1)
+    return result
+
+
+@pytest.mark.parametrize('chunk_rows', CHUNK_SIZES)
+def test_simplified_path_stays_within_tolerance(synthetic_raw, chunk_rows):
+    px, py = (np.concatenate(v) for v in zip(*_trajectory_chunks(synthetic_raw, 1_000_000)))
+    x, y = rasterizer.simplify_chunks(_trajectory_chunks(synthetic_raw, chunk_rows))
+    # 間引けていて (チャンクの両端は必ず残るので、短いチャンクほど頂点は多い)、始点と終点は残る
+    assert len(x) < len(px) // 2
+    assert (x[0], y[0]) == (px[0], py[0])
+    assert (x[-1], y[-1]) == pytest.approx((px[-1], py[-1]), abs=1e-9)
+    assert _distance_to_polyline(px, py, x, y).max() <= MAX_ERROR_PX
+
+
+def test_rdp_window_keeps_split_points():
+    # 窓の区切りは必ず残し、直線上の点は区切り以外すべて落とす
+    n = 1000
+    x = np.arange(n, dtype=np.float64); y = np.zeros(n)
+    idx = rasterizer.simplify_rdp(x, y, 0.25, window=128)
+    np.testing.assert_array_equal(idx, np.append(np.arange(0, n - 1, 128), n - 1))
+    # 窓の中の1点だけ大きく外れていれば、その点も残る
+    y[300] = 5.0
+    assert 300 in rasterizer.simplify_rdp(x, y, 0.25, window=128)